@@ -1,39 +1,74 @@
-from flask import Flask, request, jsonify
-from auth_cf import handle_request
-
-app = Flask(__name__)
-
-@app.route('/my-webhook', methods=['POST'])
-def webhook():
-    req = request.get_json(silent=True, force=True)
-    response = process_request(req)
-    return jsonify(response)
-
-def process_request(req):
-    tag = req['fulfillmentInfo'].get('tag', '')
-    parameters = req.get('sessionInfo', {}).get('parameters', {})
-    session_id = req.get('sessionInfo', {}).get('session', '').split('/')[-1]
-    input_text = req.get('text', '')
-    if not input_text:
-        input_text = req.get('transcript', '')
-
-    response_text = handle_request(tag, input_text, parameters)
-
-    response = {
-        "fulfillment_response": {
-            "messages": [
-                {
-                    "text": {
-                        "text": [response_text]
-                    }
-                }
-            ]
-        },
-        "sessionInfo": {
-            "parameters": parameters
-        }
-    }
-    return response
-
-if __name__ == '__main__':
-    app.run(port=5000, debug=True)
+import os
+import uuid
+from flask import Flask, Response, request, jsonify
+from auth_cf import handle_request
+from clients import WARM_UP_ON_START, warm_up, warm_up_in_background, warm_up_status
+import metrics
+
+app = Flask(__name__)
+
+def start_warm_up():
+    # Called by whatever serves the app (see __main__, or a gunicorn post_worker_init hook),
+    # not at import: asgi_app and the bench import this module for its helpers
+    if WARM_UP_ON_START:
+        warm_up_in_background()
+
+@app.route('/my-webhook', methods=['POST'])
+def webhook():
+    with metrics.trace("webhook", server="flask"):
+        req = request.get_json(silent=True, force=True)
+        response = process_request(req)
+        return jsonify(response)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/warmup', methods=['GET'])
+def warmup():
+    # Readiness hook: blocks until clients and chains are built
+    if not warm_up_status()["warm"]:
+        warm_up()
+    return jsonify(warm_up_status())
+
+def parse_request(req):
+    tag = req['fulfillmentInfo'].get('tag', '')
+    parameters = req.get('sessionInfo', {}).get('parameters', {})
+    # Requests without a CX session get a throwaway ID rather than sharing one history
+    session_id = req.get('sessionInfo', {}).get('session', '').split('/')[-1] or str(uuid.uuid4())
+    input_text = req.get('text', '')
+    if not input_text:
+        input_text = req.get('transcript', '')
+    return tag, input_text, parameters, session_id
+
+def build_response(response_text, parameters):
+    response = {
+        "fulfillment_response": {
+            "messages": [
+                {
+                    "text": {
+                        "text": [response_text]
+                    }
+                }
+            ]
+        },
+        "sessionInfo": {
+            "parameters": parameters
+        }
+    }
+    return response
+
+def process_request(req):
+    tag, input_text, parameters, session_id = parse_request(req)
+    metrics.annotate(tag=tag, session_id=session_id)
+
+    with metrics.span("handle_request", tag=tag):
+        response_text = handle_request(tag, input_text, parameters, session_id)
+
+    return build_response(response_text, parameters)
+
+if __name__ == '__main__':
+    # With the debug reloader only the child process serves requests
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warm_up()
+    app.run(port=5000, debug=True)
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager
+from quart import Quart, Response, request, jsonify
+from app import parse_request, build_response
+from auth_cf import ahandle_request, astream_request
+from streaming import FollowupRegistry, split_first_sentence
+from clients import WARM_UP_ON_START, warm_up, warm_up_in_background, warm_up_status
+import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Concurrency and deadline settings. Dialogflow CX gives up on a webhook after
+# 5 seconds by default, so the deadline has to leave room for the round trip.
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "256"))
+MAX_PENDING_REQUESTS = int(os.environ.get("MAX_PENDING_REQUESTS", "1024"))
+REQUEST_DEADLINE_SECONDS = float(os.environ.get("REQUEST_DEADLINE_SECONDS", "4.5"))
+
+# Streaming mode answers with the first complete sentence and parks the rest of the
+# response for a follow-up turn. The CX flow routes on $session.params.followup_pending
+# to a page whose webhook call uses FOLLOWUP_TAG to collect it.
+STREAMING_ENABLED = os.environ.get("STREAMING_ENABLED", "false").lower() == "true"
+FOLLOWUP_TAG = os.environ.get("FOLLOWUP_TAG", "followup")
+
+FALLBACK_MESSAGE = "I'm sorry, that is taking a little longer than expected. Could you please repeat that?"
+BUSY_MESSAGE = "I'm sorry, all our lines are busy right now. Please try again in a moment."
+
+app = Quart(__name__)
+
+# Created lazily so the semaphore belongs to the serving event loop
+_request_slots = None
+_pending_requests = 0
+_busy_slots = 0
+followups = FollowupRegistry()
+
+def get_request_slots():
+    global _request_slots
+    if _request_slots is None:
+        _request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _request_slots
+
+@asynccontextmanager
+async def request_slot():
+    # Time spent waiting for a slot is its own stage, separate from the handler
+    global _busy_slots
+    slots = get_request_slots()
+    with metrics.span("queue_wait"):
+        await slots.acquire()
+    _busy_slots += 1
+    try:
+        yield
+    finally:
+        _busy_slots -= 1
+        slots.release()
+
+metrics.register_source("bot_asgi", lambda: {
+    "pending_requests": _pending_requests,
+    "max_concurrent_requests": MAX_CONCURRENT_REQUESTS,
+    "busy_slots": _busy_slots,
+})
+
+@app.before_serving
+async def start_warm_up():
+    # Accept connections right away; clients and chains are built in the background
+    if WARM_UP_ON_START:
+        warm_up_in_background()
+
+@app.route('/warmup', methods=['GET'])
+async def warmup():
+    if not warm_up_status()["warm"]:
+        await asyncio.get_running_loop().run_in_executor(None, warm_up)
+    return jsonify(warm_up_status())
+
+@app.route('/my-webhook', methods=['POST'])
+async def webhook():
+    with metrics.trace("webhook", server="asgi"):
+        req = await request.get_json(silent=True, force=True)
+        response = await process_request(req)
+        return jsonify(response)
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+async def process_request(req):
+    global _pending_requests
+    tag, input_text, parameters, session_id = parse_request(req)
+    metrics.annotate(tag=tag, session_id=session_id)
+
+    # Shed load instead of queueing calls that could never meet the deadline
+    if _pending_requests >= MAX_PENDING_REQUESTS:
+        logger.warning(f"Rejecting request for session {session_id}: {_pending_requests} requests pending")
+        metrics.count("requests_shed")
+        return build_response(BUSY_MESSAGE, parameters)
+
+    _pending_requests += 1
+    try:
+        response_text = await asyncio.wait_for(
+            _respond(tag, input_text, parameters, session_id),
+            timeout=REQUEST_DEADLINE_SECONDS,
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Request for session {session_id} exceeded {REQUEST_DEADLINE_SECONDS}s deadline")
+        metrics.count("deadline_exceeded")
+        response_text = FALLBACK_MESSAGE
+    finally:
+        _pending_requests -= 1
+
+    return build_response(response_text, parameters)
+
+async def _respond(tag, input_text, parameters, session_id):
+    if tag == FOLLOWUP_TAG:
+        return await _collect_followup(parameters, session_id)
+    if STREAMING_ENABLED:
+        return await _respond_streaming(tag, input_text, parameters, session_id)
+    async with request_slot():
+        with metrics.span("handle_request", tag=tag):
+            return await ahandle_request(tag, input_text, parameters, session_id)
+
+async def _respond_streaming(tag, input_text, parameters, session_id):
+    first_sentence, rest = await split_first_sentence(_stream_with_slot(tag, input_text, parameters, session_id))
+    if rest is not None:
+        followups.put(session_id, rest)
+    parameters['followup_pending'] = rest is not None
+    return first_sentence
+
+async def _stream_with_slot(tag, input_text, parameters, session_id):
+    # The slot is held until the whole response has been generated, not just the first sentence
+    async with request_slot():
+        async for chunk in astream_request(tag, input_text, parameters, session_id):
+            yield chunk
+
+async def _collect_followup(parameters, session_id):
+    remainder = await followups.pop(session_id)
+    parameters['followup_pending'] = False
+    return remainder or "Is there anything else I can help you with?"
+
+if __name__ == '__main__':
+    # For production run under an ASGI server, e.g. `hypercorn asgi_app:app`
+    app.run(port=5000)
@@ -1,124 +1,354 @@
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.runnables.history import RunnableWithMessageHistory
-import os
-import logging
-import re
-
-# Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Set environment variables
-os.environ["OPENAI_API_KEY"] = "your-api-key"
-
-# Initialize LangChain components
-llm = ChatOpenAI(model="gpt-4")
-memory = ConversationBufferMemory()
-conversation = ConversationChain(llm=llm, memory=memory, verbose=True)
-
-# System message for the AI assistant
-SYSTEM_MESSAGE = """
-You are an intelligent assistant for a healthcare provider. 
-Your role is to accurately answer authentication questions and coverage flow questions using the member details provided.
-
-Please consider the following guidelines:
-- Clearly respond with 'Yes' or 'No' for yes/no questions.
-- Provide exact information for specific requests.
-- Ensure consistency with previous answers.
-- If information is unavailable, state so and suggest what additional details are needed.
-- Maintain strict adherence to privacy standards.
-
-Focus on clarity, accuracy, and conciseness in your answers.
-
-Once authentication is confirmed, extract the CPT code from the member details and proceed with coverage flow questions.
-"""
-
-conversation.memory.chat_memory.add_message(SystemMessage(content=SYSTEM_MESSAGE))
-
-# Sample member details (you can modify or load this dynamically)
-payload_data = {
-   "CalleeType":"HUMAN_SMALL",
-   "Priority":"0",
-   "Utterances":"demo transcript",
-   "cptCode":"99213",
-   "benefitCoverageServiceType":"Chiropractic care",
-   "benefitCoverageType":"Rehabilitative",
-   "birthDate":"4/5/2022",
-   "memberDob":"12/17/1991",
-   "memberFirstName":" Nancy ",
-   "memberLastName":"Amaya",
-   "memberPhoneNumber":"650-834-1151",
-   "memberId":"0014168073-01",
-   "providerNpi":"1750522140",
-   # ... (other fields as needed)
-}
-
-coverage_flow_questions = [
-    "Has the patient met the deductible? please respond with yes/no",
-    "What is the copay for this code?",
-    "What is the member's coinsurance amount?",
-    "Is medical necessity review for any of the codes? please respond with yes/no",
-]
-
-def get_session_history(session_id: str):
-    # This is a placeholder. In a real application, you'd implement
-    # session management, possibly using a database.
-    memory = ConversationBufferMemory(return_messages=True)
-    memory.chat_memory.add_message(SystemMessage(content=SYSTEM_MESSAGE))
-    return memory
-
-def respond_to_authentication(question: str, payload_data: dict, coverage_flow_questions: list):
-    prompt_template = ChatPromptTemplate.from_messages([
-        ("system", SYSTEM_MESSAGE),
-        MessagesPlaceholder(variable_name="history"),
-        ("human", "Member Details: {payload_data}\n\nCoverage Flow Questions: {coverage_flow_questions}\n\nUser Question: {input}"),
-    ])
-
-    chain = prompt_template | llm
-
-    with_message_history = RunnableWithMessageHistory(
-        chain,
-        get_session_history,
-        input_messages_key="history",
-        history_messages_key="history",
-    )
-
-    response = with_message_history.invoke(
-        {
-            "input": question,
-            "payload": payload_data,
-            "coverage_questions": coverage_flow_questions
-        },
-        config={"configurable": {"session_id": "abc123"}},
-    )
-
-    return response.content
-
-def extract_info(message):
-    # This function can be used to extract specific information from user messages
-    # For example, extracting CPT codes, member IDs, etc.
-    # Implement as needed for your use case
-    pass
-
-def handle_request(tag, input_text, parameters):
-    if tag == 'welcome':
-        return get_welcome_message()
-    elif tag in ['authentication', 'coverage_flow', 'get_parking_info']:
-        return respond_to_authentication(input_text, payload_data, coverage_flow_questions)
-    else:
-        return "I'm not sure how to help with that. Can you please rephrase your request?"
-
-def get_welcome_message():
-    return "Welcome! I'm here to assist you with authentication and coverage flow questions. How can I help you today?"
-
-# You can add more helper functions as needed, similar to helpers.py
-
-if __name__ == "__main__":
-    # This is for testing purposes
-    print(handle_request('welcome', '', {}))
-    print(handle_request('authentication', "What is the member's date of birth?", {}))
-    print(handle_request('coverage_flow', "What is the copay for the CPT code 99213?", {}))
+from clients import lazy
+from llm_client import is_fallback
+import router
+from session_store import session_store
+import fast_path
+import coverage_flow
+from prefetch import PREFETCH_ENABLED, prefetcher
+from member_store import MEMBER_BATCH_PATHS, get_member_store
+from metrics import count, span
+from extractor import extract_entities
+from response_cache import response_cache, build_key, fingerprint, is_cacheable
+from prompt_builder import build_member_context, select_member_fields, coverage_questions_for_stage, history_trimmer, prompt_token_counter
+import asyncio
+import os
+import time
+import logging
+import re
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set environment variables
+os.environ["OPENAI_API_KEY"] = "your-api-key"
+
+# System message for the AI assistant
+SYSTEM_MESSAGE = """
+You are an intelligent assistant for a healthcare provider. 
+Your role is to accurately answer authentication questions and coverage flow questions using the member details provided.
+
+Please consider the following guidelines:
+- Clearly respond with 'Yes' or 'No' for yes/no questions.
+- Provide exact information for specific requests.
+- Ensure consistency with previous answers.
+- If information is unavailable, state so and suggest what additional details are needed.
+- Maintain strict adherence to privacy standards.
+
+Focus on clarity, accuracy, and conciseness in your answers.
+
+The coverage flow questions are asked separately; when the representative asks something mid-flow, answer it and do not ask the questions yourself.
+"""
+
+# Sample member details, used when a call's parameters match no member in the loaded batch
+payload_data = {
+   "CalleeType":"HUMAN_SMALL",
+   "Priority":"0",
+   "Utterances":"demo transcript",
+   "cptCode":"99213",
+   "benefitCoverageServiceType":"Chiropractic care",
+   "benefitCoverageType":"Rehabilitative",
+   "birthDate":"4/5/2022",
+   "memberDob":"12/17/1991",
+   "memberFirstName":" Nancy ",
+   "memberLastName":"Amaya",
+   "memberPhoneNumber":"650-834-1151",
+   "memberId":"0014168073-01",
+   "providerNpi":"1750522140",
+   # ... (other fields as needed)
+}
+
+coverage_flow_questions = [
+    "Has the patient met the deductible? please respond with yes/no",
+    "What is the copay for this code?",
+    "What is the member's coinsurance amount?",
+    "Is medical necessity review for any of the codes? please respond with yes/no",
+]
+
+# Used when a caller has no webhook session, e.g. the demo below
+DEFAULT_SESSION_ID = "local"
+
+# Tags whose turns go through the coverage-flow state machine
+FLOW_STAGES = ('authentication', 'coverage_flow')
+
+def get_session_history(session_id: str):
+    # Bounded per-session history; survives restarts when SESSION_DB_PATH is set
+    return session_store.get(session_id)
+
+@lazy
+def get_prompt_template():
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    return ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_MESSAGE),
+        MessagesPlaceholder(variable_name="history"),
+        ("human", "Member Details: {payload_data}\n\nCoverage Flow Questions: {coverage_flow_questions}\n\nUser Question: {input}"),
+    ])
+
+@lazy
+def get_chain():
+    # Built on first use (or by clients.warm_up) so importing this module stays cheap.
+    # The model tier is picked per call through the "model_tier" configurable
+    return history_trimmer("history") | get_prompt_template() | prompt_token_counter() | router.tiered_llm()
+
+@lazy
+def get_with_message_history():
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+    return RunnableWithMessageHistory(
+        get_chain(),
+        get_session_history,
+        input_messages_key="input",
+        history_messages_key="history",
+    )
+
+def build_chain_input(question: str, payload_data: dict, coverage_flow_questions: list, stage: str):
+    # Only the member fields and questions this turn needs, not the whole payload
+    return {
+        "input": question,
+        "payload_data": build_member_context(question, payload_data, stage),
+        "coverage_flow_questions": coverage_questions_for_stage(coverage_flow_questions, stage)
+    }
+
+def remember_turn(session_id: str, question: str, response: str):
+    # Keep answers produced outside the chain in the history so later turns stay consistent
+    from langchain_core.messages import AIMessage, HumanMessage
+    get_session_history(session_id).add_messages([HumanMessage(content=question), AIMessage(content=response)])
+
+def answer_from_payload(question: str, payload_data: dict, stage: str, session_id: str):
+    # Plain lookups ("What is the member's DOB?") are answered without an LLM round trip
+    if stage != "authentication":
+        return None
+    response = fast_path.answer(question, payload_data, get_session_history(session_id))
+    if response is not None:
+        remember_turn(session_id, question, response)
+    return response
+
+def advance_flow(question: str, payload_data: dict, coverage_flow_questions: list, session_id: str):
+    # The call's progress is structured session state, so scripted turns skip the LLM
+    # and model turns only see the open question instead of the whole flow
+    state = session_store.get_state(session_id) or coverage_flow.new_state()
+    response = coverage_flow.next_turn(state, question, payload_data, coverage_flow_questions)
+    if response is not None:
+        session_store.save_state(session_id, state)
+        remember_turn(session_id, question, response)
+    return response, coverage_flow.prompt_stage(state), coverage_flow.prompt_questions(state, coverage_flow_questions)
+
+def response_cache_key(question: str, payload_data: dict, stage: str):
+    # Keyed by the normalized question, the stage and only the member fields the answer can depend on
+    if not is_cacheable(question, stage):
+        response_cache.bypass()
+        return None
+    return build_key(question, stage, fingerprint(select_member_fields(question, payload_data, stage)))
+
+def answer_from_cache(question: str, cache_key: str, stage: str, session_id: str):
+    if cache_key is None:
+        return None
+    response = response_cache.get(cache_key, stage)
+    if response is not None:
+        remember_turn(session_id, question, response)
+    return response
+
+def answer_from_prefetch(question: str, slot, session_id: str):
+    response = prefetcher.serve(slot, question)
+    if response is None:
+        return None
+    remember_turn(session_id, question, response.content)
+    return response.content
+
+def prefetch_next_turn(session_id: str, payload_data: dict, coverage_flow_questions: list, state: dict):
+    # Get a model answer ready for the question representatives most often ask first at
+    # the flow's new position, while this one is still answering
+    position = coverage_flow.position(state)
+    stage = coverage_flow.prompt_stage(state)
+    questions = coverage_flow.prompt_questions(state, coverage_flow_questions)
+    # Generated against the history as it is now, which is what the next turn would see
+    history = list(get_session_history(session_id).messages)
+
+    def generate(question):
+        chain_input = dict(build_chain_input(question, payload_data, questions, stage), history=history)
+        response = get_chain().invoke(chain_input, config=router.route_config(session_id, router.route(stage, question)))
+        return None if is_fallback(response) else response
+
+    prefetcher.schedule(session_id, position, generate)
+
+def _answer_without_llm(question: str, payload_data: dict, coverage_flow_questions: list, stage: str, session_id: str, slot):
+    if stage in FLOW_STAGES:
+        with span("coverage_flow"):
+            flow_response, stage, coverage_flow_questions = advance_flow(question, payload_data, coverage_flow_questions, session_id)
+        if flow_response is not None:
+            return flow_response, stage, coverage_flow_questions, None, "coverage_flow"
+
+    with span("fast_path"):
+        fast_response = answer_from_payload(question, payload_data, stage, session_id)
+    if fast_response is not None:
+        return fast_response, stage, coverage_flow_questions, None, "fast_path"
+
+    if slot is not None:
+        with span("prefetch"):
+            prefetched_response = answer_from_prefetch(question, slot, session_id)
+        if prefetched_response is not None:
+            return prefetched_response, stage, coverage_flow_questions, None, "prefetch"
+
+    with span("response_cache"):
+        cache_key = response_cache_key(question, payload_data, stage)
+        cached_response = answer_from_cache(question, cache_key, stage, session_id)
+    if cached_response is not None:
+        return cached_response, stage, coverage_flow_questions, cache_key, "cache"
+
+    return None, stage, coverage_flow_questions, cache_key, "llm"
+
+def answer_without_llm(question: str, payload_data: dict, coverage_flow_questions: list, stage: str, session_id: str):
+    """Try the scripted flow, the payload fast path, a prefetched answer and the response cache, in that order.
+
+    Returns (response, stage, coverage_flow_questions, cache_key); response is None
+    when the LLM is needed, with the stage and questions narrowed for its prompt.
+    """
+    speculating = PREFETCH_ENABLED and stage in FLOW_STAGES
+    if speculating:
+        slot = prefetcher.claim(session_id)
+        position = coverage_flow.position(session_store.get_state(session_id))
+    else:
+        slot = position = None
+    response, prompt_stage, prompt_questions, cache_key, source = _answer_without_llm(
+        question, payload_data, coverage_flow_questions, stage, session_id, slot
+    )
+    count("responses", source=source)
+    if speculating:
+        prefetcher.finish(slot, question, needs_model=source not in ("coverage_flow", "fast_path"))
+        state = session_store.get_state(session_id)
+        if state is not None and coverage_flow.position(state) != position:
+            prefetch_next_turn(session_id, payload_data, coverage_flow_questions, state)
+    return response, prompt_stage, prompt_questions, cache_key
+
+def respond_to_authentication(question: str, payload_data: dict, coverage_flow_questions: list, stage: str = "authentication", session_id: str = DEFAULT_SESSION_ID):
+    started = time.perf_counter()
+    response, stage, coverage_flow_questions, cache_key = answer_without_llm(question, payload_data, coverage_flow_questions, stage, session_id)
+    if response is not None:
+        router.record(router.RULES_TIER, time.perf_counter() - started)
+        return response
+
+    tier = router.route(stage, question)
+    started = time.perf_counter()
+    with span("llm", tag=stage, tier=tier):
+        response = get_with_message_history().invoke(
+            build_chain_input(question, payload_data, coverage_flow_questions, stage),
+            config=router.route_config(session_id, tier),
+        )
+    router.record(tier, time.perf_counter() - started, response)
+    if cache_key is not None and not is_fallback(response):
+        response_cache.put(cache_key, response.content, stage, latency=time.perf_counter() - started)
+
+    return response.content
+
+async def arespond_to_authentication(question: str, payload_data: dict, coverage_flow_questions: list, stage: str = "authentication", session_id: str = DEFAULT_SESSION_ID):
+    """Async variant of respond_to_authentication; awaits the LLM without blocking the event loop."""
+    started = time.perf_counter()
+    response, stage, coverage_flow_questions, cache_key = answer_without_llm(question, payload_data, coverage_flow_questions, stage, session_id)
+    if response is not None:
+        router.record(router.RULES_TIER, time.perf_counter() - started)
+        return response
+
+    tier = router.route(stage, question)
+    started = time.perf_counter()
+    with span("llm", tag=stage, tier=tier):
+        response = await get_with_message_history().ainvoke(
+            build_chain_input(question, payload_data, coverage_flow_questions, stage),
+            config=router.route_config(session_id, tier),
+        )
+    router.record(tier, time.perf_counter() - started, response)
+    if cache_key is not None and not is_fallback(response):
+        response_cache.put(cache_key, response.content, stage, latency=time.perf_counter() - started)
+
+    return response.content
+
+async def astream_authentication(question: str, payload_data: dict, coverage_flow_questions: list, stage: str = "authentication", session_id: str = DEFAULT_SESSION_ID):
+    """Stream the response as text chunks; scripted, fast-path and cached answers arrive as a single chunk."""
+    started = time.perf_counter()
+    response, stage, coverage_flow_questions, cache_key = answer_without_llm(question, payload_data, coverage_flow_questions, stage, session_id)
+    if response is not None:
+        router.record(router.RULES_TIER, time.perf_counter() - started)
+        yield response
+        return
+
+    tier = router.route(stage, question)
+    started = time.perf_counter()
+    message = None
+    with span("llm", tag=stage, tier=tier, streaming=True):
+        async for chunk in get_with_message_history().astream(
+            build_chain_input(question, payload_data, coverage_flow_questions, stage),
+            config=router.route_config(session_id, tier),
+        ):
+            # Chunks add up to the full message, including usage when the model reports it
+            message = chunk if message is None else message + chunk
+            yield chunk.content
+    router.record(tier, time.perf_counter() - started, message)
+    if cache_key is not None and message is not None and not is_fallback(message):
+        response_cache.put(cache_key, message.content, stage, latency=time.perf_counter() - started)
+
+MEMBER_NOT_FOUND_MESSAGE = "I'm sorry, I don't have the member details for this call. Could we check the member ID?"
+
+def member_payload(parameters):
+    """The member this call is about, from the loaded batch, or None when the batch doesn't have them.
+
+    The sample payload is only used when no member batch is configured.
+    """
+    if not MEMBER_BATCH_PATHS:
+        return payload_data
+    with span("member_lookup"):
+        record = get_member_store().lookup(parameters)
+    if record is None:
+        logger.warning(f"No member in the batch matches parameters: {sorted(parameters)}")
+        return None
+    return record.to_payload()
+
+async def amember_payload(parameters):
+    # The first lookup loads the batch, which takes seconds; keep it off the event loop
+    return await asyncio.to_thread(member_payload, parameters)
+
+def extract_info(message):
+    # CPT codes and member IDs mentioned by the representative, in order of appearance
+    entities = extract_entities(message)
+    return {'cpt_codes': entities['cpt_codes'], 'member_ids': entities['member_ids']}
+
+def handle_request(tag, input_text, parameters, session_id=DEFAULT_SESSION_ID):
+    if tag == 'welcome':
+        return get_welcome_message()
+    elif tag in ['authentication', 'coverage_flow', 'get_parking_info']:
+        member = member_payload(parameters)
+        if member is None:
+            return MEMBER_NOT_FOUND_MESSAGE
+        return respond_to_authentication(input_text, member, coverage_flow_questions, tag, session_id)
+    else:
+        return "I'm not sure how to help with that. Can you please rephrase your request?"
+
+async def ahandle_request(tag, input_text, parameters, session_id=DEFAULT_SESSION_ID):
+    if tag == 'welcome':
+        return get_welcome_message()
+    elif tag in ['authentication', 'coverage_flow', 'get_parking_info']:
+        member = await amember_payload(parameters)
+        if member is None:
+            return MEMBER_NOT_FOUND_MESSAGE
+        return await arespond_to_authentication(input_text, member, coverage_flow_questions, tag, session_id)
+    else:
+        return "I'm not sure how to help with that. Can you please rephrase your request?"
+
+async def astream_request(tag, input_text, parameters, session_id=DEFAULT_SESSION_ID):
+    if tag in ['authentication', 'coverage_flow', 'get_parking_info']:
+        member = await amember_payload(parameters)
+        if member is None:
+            yield MEMBER_NOT_FOUND_MESSAGE
+            return
+        async for chunk in astream_authentication(input_text, member, coverage_flow_questions, tag, session_id):
+            yield chunk
+    else:
+        yield await ahandle_request(tag, input_text, parameters, session_id)
+
+def get_welcome_message():
+    return "Welcome! I'm here to assist you with authentication and coverage flow questions. How can I help you today?"
+
+# You can add more helper functions as needed, similar to helpers.py
+
+if __name__ == "__main__":
+    # This is for testing purposes
+    print(handle_request('welcome', '', {}))
+    print(handle_request('authentication', "What is the member's date of birth?", {}))
+    print(handle_request('coverage_flow', "What is the copay for the CPT code 99213?", {}))
@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from clients import DEFAULT_MODEL, get_llm
+import coverage_flow
+from member_store import expand_paths, iter_member_rows
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+BATCH_LLM_MODEL = os.environ.get("BATCH_LLM_MODEL", DEFAULT_MODEL)
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_RETRIES = int(os.environ.get("BATCH_MAX_RETRIES", "5"))
+# Backoff doubles from the base per attempt, with full jitter, up to the cap
+BATCH_BACKOFF_BASE_SECONDS = float(os.environ.get("BATCH_BACKOFF_BASE_SECONDS", "1.0"))
+BATCH_BACKOFF_MAX_SECONDS = float(os.environ.get("BATCH_BACKOFF_MAX_SECONDS", "30.0"))
+
+EXTRACTION_MESSAGE = """
+You review recorded calls between our agent and an insurance representative.
+Read the transcript and answer each coverage flow question with what the representative said.
+Respond with a JSON object only: one key per question, exactly as written, plus "reference_number".
+Use 'Yes' or 'No' for yes/no questions and null when the transcript doesn't say.
+"""
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERROR_NAMES = {"APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError"}
+JSON_OBJECT_PATTERN = re.compile(r"\{.*\}", re.DOTALL)
+
+def is_rate_limited(exc):
+    return getattr(exc, "status_code", None) == 429 or type(exc).__name__ == "RateLimitError"
+
+def is_retryable(exc):
+    return (
+        isinstance(exc, (asyncio.TimeoutError, ConnectionError))
+        or getattr(exc, "status_code", None) in RETRYABLE_STATUS_CODES
+        or type(exc).__name__ in RETRYABLE_ERROR_NAMES
+    )
+
+def job_id(record, index):
+    # A batch request covers many members and calls, so a call is its own document or the
+    # batch, member and call count together; fall back to the member and position in the input
+    if record.get("callDocumentId"):
+        return record["callDocumentId"]
+    member_id = record.get("memberId", "unknown")
+    if record.get("batchRequestDocumentId"):
+        return f"{record['batchRequestDocumentId']}/{member_id}#{record.get('call_count', index)}"
+    return f"{member_id}#{index}"
+
+def load_checkpoint(output_path):
+    """IDs already answered in a previous run; failed jobs and a torn last line are retried."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if not result.get("error"):
+                done.add(result["job_id"])
+    return done
+
+def parse_answers(text, coverage_flow_questions):
+    match = JSON_OBJECT_PATTERN.search(text)
+    if match is None:
+        raise ValueError("model output has no JSON object")
+    raw = json.loads(match.group(0))
+    answers = {}
+    for question in coverage_flow_questions:
+        asked = coverage_flow.question_text(question)
+        value = raw.get(question, raw.get(asked))
+        answers[asked] = None if value is None else coverage_flow.parse_answer(question, str(value))
+    return answers, raw.get("reference_number")
+
+class BatchRunner:
+    """Re-run coverage extraction over recorded transcripts with a bounded pool of LLM calls.
+
+    Results are appended to a JSONL file as they finish, which doubles as the
+    checkpoint: a rerun skips every job already answered there. A rate limit
+    pauses every worker, not just the one that hit it.
+    """
+
+    def __init__(self, coverage_flow_questions, output_path, concurrency=BATCH_CONCURRENCY,
+                 max_retries=BATCH_MAX_RETRIES, model=BATCH_LLM_MODEL):
+        self.coverage_flow_questions = coverage_flow_questions
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.model = model
+        self._cooldown_until = 0.0
+        self.stats = {"submitted": 0, "skipped": 0, "succeeded": 0, "failed": 0, "retries": 0, "rate_limited": 0}
+
+    def build_messages(self, transcript):
+        from langchain_core.messages import HumanMessage, SystemMessage
+        questions = "\n".join(f"- {question}" for question in self.coverage_flow_questions)
+        return [
+            SystemMessage(content=EXTRACTION_MESSAGE),
+            HumanMessage(content=f"Coverage Flow Questions:\n{questions}\n\nTranscript:\n{transcript}"),
+        ]
+
+    async def run(self, records):
+        done = load_checkpoint(self.output_path)
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        started = time.perf_counter()
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            for index, record in enumerate(records):
+                key = job_id(record, index)
+                if key in done:
+                    self.stats["skipped"] += 1
+                    continue
+                # Acquire before creating the task so only `concurrency` records are held in memory
+                await slots.acquire()
+                task = asyncio.create_task(self._process(key, record, output))
+                task.add_done_callback(lambda _: slots.release())
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                self.stats["submitted"] += 1
+            if tasks:
+                await asyncio.gather(*tasks)
+        self.stats["seconds"] = round(time.perf_counter() - started, 3)
+        return self.stats
+
+    async def _process(self, key, record, output):
+        started = time.perf_counter()
+        result = {
+            "job_id": key,
+            "batchRequestDocumentId": record.get("batchRequestDocumentId"),
+            "callDocumentId": record.get("callDocumentId") or None,
+            "memberId": record.get("memberId"),
+            "call_count": record.get("call_count"),
+        }
+        transcript = record.get("Utterances") or record.get("transcript") or ""
+        attempts = 0
+        try:
+            if not transcript.strip():
+                raise ValueError("record has no transcript")
+            text, attempts = await self._invoke_with_retries(self.build_messages(transcript))
+            result["answers"], result["reference_number"] = parse_answers(text, self.coverage_flow_questions)
+            self.stats["succeeded"] += 1
+        except Exception as exc:
+            logger.warning(f"Job {key} failed: {exc!r}")
+            result["error"] = repr(exc)
+            self.stats["failed"] += 1
+        result["attempts"] = attempts
+        result["latency"] = round(time.perf_counter() - started, 3)
+        # One write per line, flushed, so a crash loses at most the line being written
+        output.write(json.dumps(result) + "\n")
+        output.flush()
+
+    async def _invoke_with_retries(self, messages):
+        # The client's own retries and the webhook's fallback answers are off so
+        # errors reach the backoff and the shared cooldown here
+        llm = get_llm(self.model, resilient=False, temperature=0, max_retries=0)
+        attempt = 0
+        while True:
+            attempt += 1
+            delay = self._cooldown_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                response = await llm.ainvoke(messages)
+                return response.content, attempt
+            except Exception as exc:
+                if attempt > self.max_retries or not is_retryable(exc):
+                    raise
+                backoff = random.uniform(0, min(BATCH_BACKOFF_MAX_SECONDS, BATCH_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+                self.stats["retries"] += 1
+                if is_rate_limited(exc):
+                    self.stats["rate_limited"] += 1
+                    self._cooldown_until = max(self._cooldown_until, time.monotonic() + backoff)
+                await asyncio.sleep(backoff)
+
+def install_fake_llm(latency, rate_limit_rate):
+    """Answer from the local fake model, for dry runs and tests of the retry path."""
+    import clients
+    import fakes
+    clients.set_llm_factory(lambda model, **kwargs: fakes.FakeChatModel(latency=latency, rate_limit_rate=rate_limit_rate))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract coverage answers from recorded call transcripts.")
+    parser.add_argument("paths", nargs="+", help="call records with an Utterances field (.jsonl or .csv, optionally .gz)")
+    parser.add_argument("--output", default="coverage_answers.jsonl", help="results JSONL; also the resume checkpoint")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--max-retries", type=int, default=BATCH_MAX_RETRIES)
+    parser.add_argument("--fake", action="store_true", help="use the local fake LLM")
+    parser.add_argument("--fake-latency", type=float, default=0.2)
+    parser.add_argument("--fake-rate-limit", type=float, default=0.0, help="fraction of fake calls that are rate limited")
+    args = parser.parse_args()
+    if args.fake:
+        install_fake_llm(args.fake_latency, args.fake_rate_limit)
+    from auth_cf import coverage_flow_questions
+    runner = BatchRunner(coverage_flow_questions, args.output, args.concurrency, args.max_retries)
+    stats = asyncio.run(runner.run(iter_member_rows(expand_paths(args.paths))))
+    print(json.dumps(stats))
@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Load test for /my-webhook. Replays recorded Dialogflow CX request bodies as
+# concurrent callers against the Flask or ASGI app in-process (with a fake LLM
+# and fake BigQuery) or against a running server via --url.
+#
+#   python bench.py --server asgi --concurrency 50 --calls 200 --llm-latency 1.5
+#   python bench.py --compare bench_results_before.json
+
+DEFAULT_REQUESTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_requests", "cx_requests.jsonl")
+
+def load_requests(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def caller_requests(requests, caller):
+    """The recorded conversation with the session path rewritten for one caller."""
+    bodies = json.loads(json.dumps(requests))
+    for body in bodies:
+        session = body.get("sessionInfo", {}).get("session", "")
+        body["sessionInfo"]["session"] = session.replace("SESSION", f"bench-{caller}")
+    return bodies
+
+def install_fakes(llm_latency, first_token_latency, bigquery_latency):
+    """Swap the shared LLM and BigQuery clients for local stand-ins."""
+    import clients
+    import fakes
+
+    fake_bigquery = fakes.FakeBigQueryClient(latency=bigquery_latency)
+    clients.set_bigquery_factory(lambda: fake_bigquery)
+    clients.set_llm_factory(lambda model, **kwargs: fakes.FakeChatModel(
+        latency=llm_latency, first_token_latency=first_token_latency))
+    return fakes
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def run_flask(bodies_per_caller, concurrency):
+    import app as flask_app
+
+    def run_caller(bodies):
+        client = flask_app.app.test_client()
+        timings = []
+        for body in bodies:
+            start = time.perf_counter()
+            response = client.post("/my-webhook", json=body)
+            timings.append((time.perf_counter() - start, response.status_code == 200))
+        return timings
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return [t for timings in pool.map(run_caller, bodies_per_caller) for t in timings]
+
+async def run_async(bodies_per_caller, concurrency, url=None):
+    if url is None:
+        import asgi_app
+        client = asgi_app.app.test_client()
+        post = lambda body: client.post("/my-webhook", json=body)
+        status = lambda response: response.status_code
+        close = None
+    else:
+        import httpx
+        http = httpx.AsyncClient(timeout=30.0, limits=httpx.Limits(max_connections=concurrency))
+        post = lambda body: http.post(url, json=body)
+        status = lambda response: response.status_code
+        close = http.aclose
+
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run_caller(bodies):
+        timings = []
+        async with slots:
+            for body in bodies:
+                start = time.perf_counter()
+                try:
+                    ok = status(await post(body)) == 200
+                except Exception:
+                    ok = False
+                timings.append((time.perf_counter() - start, ok))
+        return timings
+
+    try:
+        results = await asyncio.gather(*(run_caller(bodies) for bodies in bodies_per_caller))
+    finally:
+        if close is not None:
+            await close()
+    return [t for timings in results for t in timings]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def summarize(timings, wall_seconds, usage, rss_before):
+    latencies = np.array([t for t, _ in timings]) * 1000
+    turns = len(timings)
+    summary = {
+        "requests": turns,
+        "errors": sum(1 for _, ok in timings if not ok),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(turns / wall_seconds, 2) if wall_seconds else None,
+        "latency_ms": {
+            "mean": round(float(latencies.mean()), 2),
+            "p50": round(float(np.percentile(latencies, 50)), 2),
+            "p95": round(float(np.percentile(latencies, 95)), 2),
+            "p99": round(float(np.percentile(latencies, 99)), 2),
+            "max": round(float(latencies.max()), 2),
+        },
+    }
+    if usage is not None:
+        summary["llm_calls"] = usage["calls"]
+        summary["prompt_tokens_per_turn"] = round(usage["prompt_tokens"] / turns, 1)
+        summary["completion_tokens_per_turn"] = round(usage["completion_tokens"] / turns, 1)
+        summary["rss_mb"] = {
+            "before": round(rss_before / 2**20, 1) if rss_before else None,
+            "after": round((current_rss_bytes() or 0) / 2**20, 1),
+            "peak": round(peak_rss_bytes() / 2**20, 1),
+        }
+    return summary
+
+def compare(baseline_path, current):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    rows = [("throughput_rps", baseline["throughput_rps"], current["throughput_rps"])]
+    rows += [(f"latency_ms.{k}", baseline["latency_ms"][k], current["latency_ms"][k]) for k in ("p50", "p95", "p99")]
+    if "prompt_tokens_per_turn" in baseline and "prompt_tokens_per_turn" in current:
+        rows.append(("prompt_tokens_per_turn", baseline["prompt_tokens_per_turn"], current["prompt_tokens_per_turn"]))
+    for name, before, after in rows:
+        change = (after - before) / before * 100 if before else float("nan")
+        print(f"{name:26} {before:>12} {after:>12} {change:>+8.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /my-webhook endpoint.")
+    parser.add_argument("--server", choices=["asgi", "flask"], default="asgi", help="in-process app to drive")
+    parser.add_argument("--url", help="benchmark a running server instead, e.g. http://localhost:5000/my-webhook")
+    parser.add_argument("--requests", default=DEFAULT_REQUESTS, help="JSONL file of recorded CX request bodies")
+    parser.add_argument("--calls", type=int, default=100, help="number of simulated calls (sessions)")
+    parser.add_argument("--concurrency", type=int, default=20, help="calls in flight at once")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="fake LLM seconds per completion")
+    parser.add_argument("--first-token-latency", type=float, default=0.3, help="fake LLM seconds to first streamed token")
+    parser.add_argument("--bigquery-latency", type=float, default=0.5, help="fake BigQuery seconds per query")
+    parser.add_argument("--streaming", action="store_true", help="enable STREAMING_ENABLED in the ASGI app")
+    parser.add_argument("--output", default="bench_results.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="previous results file to diff against")
+    args = parser.parse_args()
+
+    if args.streaming:
+        os.environ["STREAMING_ENABLED"] = "true"
+    fakes = None if args.url else install_fakes(args.llm_latency, args.first_token_latency, args.bigquery_latency)
+
+    requests = load_requests(args.requests)
+    bodies_per_caller = [caller_requests(requests, caller) for caller in range(args.calls)]
+    rss_before = current_rss_bytes()
+
+    start = time.perf_counter()
+    if args.url or args.server == "asgi":
+        timings = asyncio.run(run_async(bodies_per_caller, args.concurrency, args.url))
+    else:
+        timings = run_flask(bodies_per_caller, args.concurrency)
+    wall_seconds = time.perf_counter() - start
+
+    results = summarize(timings, wall_seconds, fakes.fake_llm_usage if fakes else None, rss_before)
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    if args.compare:
+        compare(args.compare, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from bq_writer import SESSION_COLUMNS
+from metrics import span
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Session lookups are served from memory for this long unless a write lands first
+READER_CACHE_TTL_SECONDS = float(os.environ.get("READER_CACHE_TTL_SECONDS", "5"))
+READER_CACHE_SIZE = int(os.environ.get("READER_CACHE_SIZE", "10000"))
+
+SESSION_COLUMN_NAMES = [name for name, _ in SESSION_COLUMNS]
+TIMESTAMP_COLUMNS = [name for name, type_ in SESSION_COLUMNS if type_ == "TIMESTAMP"]
+
+def build_select_query(table, columns, where):
+    # Only the table name is formatted in; values always travel as query parameters
+    projection = ", ".join(f"`{name}`" for name in columns)
+    return f"SELECT {projection} FROM `{table}` WHERE {where}"
+
+class SessionReader:
+    """Parameterized, column-projected reads of the parking sessions table.
+
+    Single-session lookups go through a short-TTL read-through cache that the
+    SessionEventWriter invalidates as batches land; bulk fetches come back as
+    Arrow tables without building per-row Python objects.
+    """
+
+    def __init__(self, client_factory, table, writer=None,
+                 ttl_seconds=READER_CACHE_TTL_SECONDS, max_entries=READER_CACHE_SIZE):
+        self.client_factory = client_factory
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # The query text is the same for every session, so BigQuery can reuse its cached plan
+        self.session_query = build_select_query(table, SESSION_COLUMN_NAMES, "session_id = @session_id")
+
+        self._cache = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "bulk_fetches": 0, "bulk_rows": 0}
+        if writer is not None:
+            writer.add_write_listener(self.invalidate)
+
+    def get(self, session_id, columns=None):
+        """Rows for one session as dicts, limited to `columns` when given."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(session_id)
+            if entry is not None and entry[1] > now:
+                self._cache.move_to_end(session_id)
+                self.stats["hits"] += 1
+                return self._project(entry[0], columns)
+            self.stats["misses"] += 1
+            generation = self._generation
+
+        from google.cloud import bigquery
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("session_id", "STRING", session_id)]
+        )
+        with span("bigquery_read"):
+            rows = [dict(row.items()) for row in self.client_factory().query(self.session_query, job_config=job_config).result()]
+
+        with self._lock:
+            # A write that landed while the query ran may not be in these rows; don't cache them
+            if generation == self._generation:
+                self._cache[session_id] = (rows, now + self.ttl_seconds)
+                self._cache.move_to_end(session_id)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return self._project(rows, columns)
+
+    def get_many(self, session_ids, columns=None):
+        """Rows for many sessions in one query, as a pyarrow Table."""
+        from google.cloud import bigquery
+        columns = columns or SESSION_COLUMN_NAMES
+        query = build_select_query(self.table, columns, "session_id IN UNNEST(@session_ids)")
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ArrayQueryParameter("session_ids", "STRING", list(session_ids))]
+        )
+        with span("bigquery_bulk_read"):
+            table = self.client_factory().query(query, job_config=job_config).to_arrow()
+        with self._lock:
+            self.stats["bulk_fetches"] += 1
+            self.stats["bulk_rows"] += table.num_rows
+        return table
+
+    def invalidate(self, session_ids):
+        with self._lock:
+            self._generation += 1
+            for session_id in session_ids:
+                self._cache.pop(session_id, None)
+            self.stats["invalidations"] += len(session_ids)
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self.stats, entries=len(self._cache))
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        return metrics
+
+    @staticmethod
+    def _project(rows, columns):
+        # Copies, so callers can overlay pending changes without touching the cache
+        if columns is None:
+            return [dict(row) for row in rows]
+        return [{name: row.get(name) for name in columns} for row in rows]
@@ -0,0 +1,294 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from metrics import span
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Flush as soon as this many sessions have pending changes...
+WRITER_MAX_BATCH_SIZE = int(os.environ.get("WRITER_MAX_BATCH_SIZE", "500"))
+# ...or once the oldest pending change is this many seconds old
+WRITER_FLUSH_INTERVAL = float(os.environ.get("WRITER_FLUSH_INTERVAL", "1.0"))
+# Callers block (backpressure) once this many sessions are waiting to be written...
+WRITER_MAX_PENDING = int(os.environ.get("WRITER_MAX_PENDING", "10000"))
+# ...for at most this long, after which the event is dropped rather than stalling the turn
+WRITER_SUBMIT_TIMEOUT = float(os.environ.get("WRITER_SUBMIT_TIMEOUT", "5.0"))
+# A row is dead-lettered after failing this many writes; retries back off exponentially up to the cap
+WRITER_MAX_ATTEMPTS = int(os.environ.get("WRITER_MAX_ATTEMPTS", "5"))
+WRITER_MAX_BACKOFF = float(os.environ.get("WRITER_MAX_BACKOFF", "30.0"))
+# Dead-lettered rows kept in memory for inspection; every one is also logged
+WRITER_DEAD_LETTER_SIZE = int(os.environ.get("WRITER_DEAD_LETTER_SIZE", "1000"))
+
+# Columns of the parking_sessions table and their BigQuery types
+SESSION_COLUMNS = [
+    ("session_id", "STRING"),
+    ("start_time", "TIMESTAMP"),
+    ("active", "BOOL"),
+    ("vehicle_type", "STRING"),
+    ("vehicle_number", "STRING"),
+    ("parking_hours", "INT64"),
+    ("timestamp", "TIMESTAMP"),
+    ("confirmed", "BOOL"),
+    ("confirmation_timestamp", "TIMESTAMP"),
+]
+
+MERGE_TEMPLATE = """
+MERGE `{table}` T
+USING UNNEST(@rows) S
+ON T.session_id = S.session_id
+WHEN MATCHED THEN UPDATE SET
+    {updates}
+WHEN NOT MATCHED THEN
+    INSERT ({columns}) VALUES ({values})
+"""
+
+def build_merge_query(table):
+    names = [name for name, _ in SESSION_COLUMNS]
+    updates = ",\n    ".join(f"`{name}` = COALESCE(S.`{name}`, T.`{name}`)" for name in names[1:])
+    columns = ", ".join(f"`{name}`" for name in names)
+    values = ", ".join(f"S.`{name}`" for name in names)
+    return MERGE_TEMPLATE.format(table=table, updates=updates, columns=columns, values=values)
+
+def is_rejected(exc):
+    """Whether BigQuery refused the statement itself (bad row or schema), so retrying it as is can't succeed."""
+    try:
+        from google.api_core.exceptions import BadRequest
+    except ImportError:
+        return False
+    return isinstance(exc, BadRequest)
+
+class SessionEventWriter:
+    """Write-behind buffer for parking session lifecycle events.
+
+    Events are coalesced per session and written by a background thread with
+    one MERGE statement per flush, so a turn never waits on BigQuery DML.
+    Unwritten changes are visible through pending_row() for read-your-writes.
+    A batch BigQuery rejects is split until the offending rows are alone; rows
+    that keep failing are dead-lettered after max_attempts writes.
+    """
+
+    def __init__(self, client_factory, table, max_batch_size=WRITER_MAX_BATCH_SIZE,
+                 flush_interval=WRITER_FLUSH_INTERVAL, max_pending=WRITER_MAX_PENDING,
+                 submit_timeout=WRITER_SUBMIT_TIMEOUT, max_attempts=WRITER_MAX_ATTEMPTS,
+                 max_backoff=WRITER_MAX_BACKOFF):
+        # Called on the writer thread, so the BigQuery client is only built once there is work
+        self.client_factory = client_factory
+        self.table = table
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.submit_timeout = submit_timeout
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.merge_query = build_merge_query(table)
+
+        self._pending = {}
+        self._in_flight = {}
+        self._oldest_pending = None
+        self._flush_requested = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+        self._write_listeners = []
+        # session_id -> failed writes of the changes now pending for it
+        self._attempts = {}
+        self.dead_letters = deque(maxlen=WRITER_DEAD_LETTER_SIZE)
+
+        self.stats = {"events": 0, "flushes": 0, "rows_written": 0, "errors": 0, "retried": 0,
+                      "dead_lettered": 0, "dropped": 0}
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="session-event-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def add_write_listener(self, listener):
+        """Call listener(session_ids) after each batch lands, e.g. to invalidate read caches."""
+        self._write_listeners.append(listener)
+
+    def submit(self, session_id, **fields):
+        """Queue column changes for a session; later changes win over earlier ones.
+
+        Returns False when the queue stayed full for submit_timeout seconds and
+        the changes were dropped.
+        """
+        if self._thread is None:
+            self.start()
+        deadline = time.monotonic() + self.submit_timeout
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("SessionEventWriter is closed")
+            while len(self._pending) >= self.max_pending and session_id not in self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["dropped"] += 1
+                    logger.error(f"Session writer queue full for {self.submit_timeout}s, dropped changes for {session_id}: {fields}")
+                    return False
+                self._condition.wait(remaining)
+            row = self._pending.setdefault(session_id, {"session_id": session_id})
+            row.update(fields)
+            self.stats["events"] += 1
+            if self._oldest_pending is None:
+                # Wake the writer so it starts timing the flush interval from this event
+                self._oldest_pending = time.monotonic()
+                self._condition.notify_all()
+            elif len(self._pending) >= self.max_batch_size:
+                self._condition.notify_all()
+        return True
+
+    def pending_row(self, session_id):
+        """Return the changes for a session that are not yet committed, or None."""
+        with self._condition:
+            in_flight = self._in_flight.get(session_id)
+            pending = self._pending.get(session_id)
+            if in_flight is None and pending is None:
+                return None
+            row = dict(in_flight or {})
+            row.update(pending or {})
+            return row
+
+    def queue_depth(self):
+        with self._condition:
+            return len(self._pending) + len(self._in_flight)
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been written (or timeout)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            self._flush_requested = True
+            self._condition.notify_all()
+            while self._pending or self._in_flight:
+                if self._thread is None or not self._thread.is_alive():
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return not (self._pending or self._in_flight)
+
+    def close(self, timeout=30.0):
+        """Flush outstanding events and stop the background thread."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._pending:
+            logger.error(f"Session writer closed with {len(self._pending)} unwritten sessions")
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._should_flush():
+                    if self._closed and not self._pending:
+                        return
+                    self._condition.wait(self._time_to_next_flush())
+                if len(self._pending) <= self.max_batch_size:
+                    self._in_flight, self._pending = self._pending, {}
+                    self._oldest_pending = None
+                else:
+                    batch_ids = list(self._pending)[:self.max_batch_size]
+                    self._in_flight = {session_id: self._pending.pop(session_id) for session_id in batch_ids}
+                self._flush_requested = False
+                batch = list(self._in_flight.values())
+            self._write(batch)
+
+    def _should_flush(self):
+        if not self._pending:
+            return False
+        if self._closed or self._flush_requested or len(self._pending) >= self.max_batch_size:
+            return True
+        return time.monotonic() - self._oldest_pending >= self.flush_interval
+
+    def _time_to_next_flush(self):
+        if self._oldest_pending is None:
+            return None
+        return max(0.0, self.flush_interval - (time.monotonic() - self._oldest_pending))
+
+    def _merge(self, batch):
+        from google.cloud import bigquery
+        job_config = bigquery.QueryJobConfig(query_parameters=[self._rows_parameter(batch)])
+        with span("bigquery_merge"):
+            self.client_factory().query(self.merge_query, job_config=job_config).result()
+
+    def _write_rows(self, batch):
+        """MERGE the rows, halving rejected batches; returns the rows that failed and the last error."""
+        try:
+            self._merge(batch)
+            return [], None
+        except Exception as exc:
+            if len(batch) == 1 or not is_rejected(exc):
+                return batch, exc
+        middle = len(batch) // 2
+        failed_left, error_left = self._write_rows(batch[:middle])
+        failed_right, error_right = self._write_rows(batch[middle:])
+        return failed_left + failed_right, error_right or error_left
+
+    def _write(self, batch):
+        failed, error = self._write_rows(batch)
+        failed_ids = {row["session_id"] for row in failed}
+        written_ids = [row["session_id"] for row in batch if row["session_id"] not in failed_ids]
+
+        # Invalidate before the rows leave _in_flight, so a reader never sees neither the change nor a fresh read
+        if written_ids:
+            for listener in self._write_listeners:
+                try:
+                    listener(written_ids)
+                except Exception:
+                    logger.exception("Session write listener failed")
+
+        backoff = 0.0
+        with self._condition:
+            for session_id in written_ids:
+                self._attempts.pop(session_id, None)
+            if failed:
+                self.stats["errors"] += 1
+                logger.error(f"Failed to write {len(failed)} of {len(batch)} session rows: {error!r}")
+            for row in failed:
+                session_id = row["session_id"]
+                attempts = self._attempts.pop(session_id, 0) + 1
+                if self._closed or attempts >= self.max_attempts:
+                    # Changes submitted since are left pending and get a fresh set of attempts
+                    self.dead_letters.append({"row": row, "attempts": attempts, "error": repr(error)})
+                    self.stats["dead_lettered"] += 1
+                    logger.error(f"Dead-lettered session row after {attempts} failed writes: {row}")
+                    continue
+                # Put the failed row back underneath anything submitted meanwhile
+                retry = dict(row)
+                retry.update(self._pending.get(session_id, {}))
+                self._pending[session_id] = retry
+                self._attempts[session_id] = attempts
+                self.stats["retried"] += 1
+                backoff = max(backoff, min(self.flush_interval * 2 ** (attempts - 1), self.max_backoff))
+            if self._pending and self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+            self._in_flight = {}
+            if written_ids:
+                self.stats["flushes"] += 1
+                self.stats["rows_written"] += len(written_ids)
+            self._condition.notify_all()
+        if written_ids:
+            logger.info(f"Flushed {len(written_ids)} session rows to {self.table}")
+        if backoff:
+            time.sleep(backoff)
+
+    @staticmethod
+    def _rows_parameter(batch):
+        from google.cloud import bigquery
+        structs = [
+            bigquery.StructQueryParameter(
+                None,
+                *[bigquery.ScalarQueryParameter(name, type_, row.get(name)) for name, type_ in SESSION_COLUMNS]
+            )
+            for row in batch
+        ]
+        return bigquery.ArrayQueryParameter("rows", "STRUCT", structs)
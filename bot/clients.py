@@ -0,0 +1,175 @@
+import argparse
+import logging
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from metrics import llm_usage_handler
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Shared per-process clients. Nothing expensive is imported or constructed until
+# first use (or warm_up), so importing the bot modules stays cheap.
+
+DEFAULT_MODEL = os.environ.get("LLM_MODEL", "gpt-4")
+# Servers build clients in a background thread at startup instead of on the first request
+WARM_UP_ON_START = os.environ.get("WARM_UP_ON_START", "true").lower() == "true"
+
+_lock = threading.RLock()
+_llms = {}
+_bigquery_client = None
+_llm_factory = None
+_bigquery_factory = None
+_warm_up_timings = None
+_lazy_builders = []
+
+def _default_llm_factory(model, **kwargs):
+    try:
+        from langchain_openai import ChatOpenAI
+    except ImportError:
+        from langchain_community.chat_models import ChatOpenAI
+    from llm_client import openai_client_kwargs
+    # Pooled keep-alive connections and a timeout, unless the caller sets its own
+    return ChatOpenAI(model=model, **{**openai_client_kwargs(), **kwargs})
+
+def _default_bigquery_factory():
+    from google.cloud import bigquery
+    return bigquery.Client()
+
+def get_llm(model=DEFAULT_MODEL, resilient=True, **kwargs):
+    """Process-wide chat model for a model name and settings, built on first use.
+
+    Unless `resilient` is False the model is wrapped by llm_client.resilient(),
+    which answers with a canned fallback instead of raising or running past its deadline.
+    """
+    key = (model, resilient, tuple(sorted(kwargs.items())))
+    llm = _llms.get(key)
+    if llm is None:
+        with _lock:
+            llm = _llms.get(key)
+            if llm is None:
+                started = time.perf_counter()
+                llm = (_llm_factory or _default_llm_factory)(model, **kwargs)
+                if resilient:
+                    from llm_client import resilient as make_resilient
+                    llm = make_resilient(llm, model)
+                # Token usage of every call feeds the /metrics endpoint
+                llm.callbacks = [*(llm.callbacks or []), llm_usage_handler()]
+                _llms[key] = llm
+                logger.info(f"Created LLM client for {model} in {time.perf_counter() - started:.3f}s")
+    return llm
+
+def get_bigquery_client():
+    """Process-wide BigQuery client, built on first use."""
+    global _bigquery_client
+    if _bigquery_client is None:
+        with _lock:
+            if _bigquery_client is None:
+                started = time.perf_counter()
+                _bigquery_client = (_bigquery_factory or _default_bigquery_factory)()
+                logger.info(f"Created BigQuery client in {time.perf_counter() - started:.3f}s")
+    return _bigquery_client
+
+def set_llm_factory(factory):
+    """Replace how LLM clients are built (e.g. with a local fake); drops cached clients and chains."""
+    global _llm_factory
+    with _lock:
+        _llm_factory = factory
+        _llms.clear()
+        _reset_lazy()
+
+def set_bigquery_factory(factory):
+    """Replace how the BigQuery client is built; drops the cached client."""
+    global _bigquery_factory, _bigquery_client
+    with _lock:
+        _bigquery_factory = factory
+        _bigquery_client = None
+
+def lazy(builder):
+    """Decorator for zero-argument builders: run once on first call, then return the cached result.
+
+    Decorated builders are also run by warm_up().
+    """
+    result = []
+
+    def get():
+        if not result:
+            with _lock:
+                if not result:
+                    result.append(builder())
+        return result[0]
+
+    get.__name__ = builder.__name__
+    get.__doc__ = builder.__doc__
+    get.reset = result.clear
+    _lazy_builders.append(get)
+    return get
+
+def _reset_lazy():
+    for builder in _lazy_builders:
+        builder.reset()
+
+def warm_up(include_bigquery=True):
+    """Build every lazy client and chain now, so the first request doesn't pay for it."""
+    global _warm_up_timings
+    timings = {}
+    started = time.perf_counter()
+    get_llm()
+    timings["llm"] = time.perf_counter() - started
+    for builder in list(_lazy_builders):
+        step = time.perf_counter()
+        builder()
+        timings[builder.__name__] = time.perf_counter() - step
+    if include_bigquery:
+        step = time.perf_counter()
+        try:
+            get_bigquery_client()
+        except Exception:
+            logger.exception("BigQuery client warm-up failed")
+        timings["bigquery"] = time.perf_counter() - step
+    timings["total"] = time.perf_counter() - started
+    _warm_up_timings = {name: round(seconds, 4) for name, seconds in timings.items()}
+    logger.info(f"Warm-up finished: {_warm_up_timings}")
+    return _warm_up_timings
+
+def warm_up_in_background(include_bigquery=True):
+    thread = threading.Thread(target=warm_up, kwargs={"include_bigquery": include_bigquery},
+                              name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+def warm_up_status():
+    return {"warm": _warm_up_timings is not None, "timings": _warm_up_timings}
+
+def import_costs(module, top=20):
+    """Cumulative import time of `module` and its heaviest dependencies, from a fresh interpreter.
+
+    Uses `python -X importtime`; returns [(module_name, milliseconds), ...] sorted by cost.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    costs = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        if match:
+            costs.append((match.group(3), int(match.group(1)) / 1000))
+    costs.sort(key=lambda item: item[1], reverse=True)
+    return costs[:top]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report import cost of a bot module, or time a warm-up.")
+    parser.add_argument("module", nargs="?", default="asgi_app")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--warm-up", action="store_true", help="also time warm_up() in this process")
+    args = parser.parse_args()
+    for name, milliseconds in import_costs(args.module, args.top):
+        print(f"{milliseconds:10.1f} ms  {name}")
+    if args.warm_up:
+        __import__(args.module)
+        print(warm_up(include_bigquery=False))
@@ -0,0 +1,220 @@
+import re
+import threading
+from fast_path import REPEAT_PATTERN
+from metrics import register_source
+
+# Stages of a coverage call, in order
+AUTHENTICATION = "authentication"
+COVERAGE = "coverage"
+REFERENCE_NUMBER = "reference_number"
+FEEDBACK = "feedback"
+COMPLETE = "complete"
+
+# The representative saying the caller may go ahead ends authentication
+AUTH_CONFIRMED_PATTERN = re.compile(
+    r"\b(?:(?:is|are|been|you're|you\s+are|successfully)\s+(?:verified|authenticated)"
+    r"|authentication\s+(?:is\s+)?(?:complete|completed|done|confirmed|successful)"
+    r"|go\s+ahead\s+with\s+your\s+questions?)\b",
+    re.IGNORECASE,
+)
+# A turn that asks us something rather than answering our question
+QUESTION_PATTERN = re.compile(
+    r"^\s*(?:what|which|who|when|where|why|how|can|could|would|will|is|are|do|does|did|may)\b.*\?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+SUMMARY_PATTERN = re.compile(
+    r"\b(?:summary|summari[sz]e|recap|dictionary|(?:all\s+(?:the\s+)?|the\s+)(?:answers|responses))\b",
+    re.IGNORECASE,
+)
+# Hedges answer nothing; the question is asked again
+UNSURE_PATTERN = re.compile(
+    r"\b(?:not\s+(?:sure|certain)|unsure|(?:don't|do\s+not|dont)\s+know|no\s+idea"
+    r"|(?:can't|cannot|can\s+not|unable\s+to)\s+(?:say|tell|confirm|see))\b",
+    re.IGNORECASE,
+)
+# Checked before YES_PATTERN, which would otherwise take "it has not been met" for a yes
+NO_PATTERN = re.compile(
+    r"^\W*(?:no|nope|not|never|(?:it|that|this)(?:\s+(?:has|is|does)\s+not|\s+(?:hasn't|isn't|doesn't)|'s\s+not)"
+    r"|they\s+(?:have\s+not|haven't|are\s+not|aren't|do\s+not|don't))\b",
+    re.IGNORECASE,
+)
+YES_PATTERN = re.compile(
+    r"^\W*(?:yes|yeah|yep|yup|correct|(?:it|that|this)(?:\s+(?:has|is|does)|'s)(?!\s+not\b)|they\s+(?:have|are|do)(?!\s+not\b))\b",
+    re.IGNORECASE,
+)
+YES_NO_HINT = re.compile(r"\s*please\s+respond\s+with\s+yes/no\s*$", re.IGNORECASE)
+# Questions whose answer is a dollar amount or a percentage
+AMOUNT_QUESTION_PATTERN = re.compile(r"\b(?:copay|co-pay|coinsurance|co-insurance|amount|how\s+much|cost)\b", re.IGNORECASE)
+AMOUNT_PATTERN = re.compile(r"\$\s?\d[\d,]*(?:\.\d+)?|\b\d[\d,]*(?:\.\d+)?\s*(?:%|percent\b|dollars?\b|usd\b)", re.IGNORECASE)
+# A bare number only counts when nothing carries a unit
+NUMBER_PATTERN = re.compile(r"\b\d[\d,]*(?:\.\d+)?\b")
+NO_AMOUNT_PATTERN = re.compile(r"^\W*(?:none|zero|nothing)\W*$|\bno\s+(?:copay|co-pay|coinsurance|co-insurance|charge|cost)\b", re.IGNORECASE)
+# Holding phrases while the representative looks something up; they answer nothing
+HOLD_PATTERN = re.compile(
+    r"^\W*(?:(?:sure|okay|ok|alright|all\s+right|yes|yeah)\W+)?(?:(?:just\s+)?(?:one|a)\s+(?:moment|second|sec|minute)"
+    r"|(?:please\s+)?hold\s+on|bear\s+with\s+me|let\s+me\s+(?:check|see|look|pull|find|verify)"
+    r"|give\s+me\s+a\s+(?:moment|second|sec|minute)|i(?:'ll|\s+will)\s+(?:check|look))\b",
+    re.IGNORECASE,
+)
+REFERENCE_PATTERN = re.compile(r"\b(?=[A-Z0-9-]*\d)[A-Z0-9][A-Z0-9-]{3,}\b", re.IGNORECASE)
+
+REFERENCE_PROMPT = "Thank you. Could you please provide the reference number for this call?"
+FEEDBACK_PROMPT = "Thank you. Before we wrap up, do you have any feedback about this call?"
+CLOSING_MESSAGE = "Thank you for your help today. Let me know if you'd like a summary of the responses."
+HOLD_MESSAGE = "Sure, take your time."
+
+stats = {"turns": 0, "scripted": 0, "deferred": 0, "by_stage": {}}
+_stats_lock = threading.Lock()
+
+def _record(stage, scripted):
+    with _stats_lock:
+        stats["turns"] += 1
+        stats["scripted" if scripted else "deferred"] += 1
+        stats["by_stage"][stage] = stats["by_stage"].get(stage, 0) + 1
+
+def new_state():
+    """Fresh state for a call; plain JSON so the session store can persist it."""
+    return {
+        "stage": AUTHENTICATION,
+        "question_index": 0,
+        "answers": {},
+        "reference_number": None,
+        "feedback": None,
+    }
+
+def question_text(question):
+    # The yes/no hint is for the answer parser, not something to read out
+    return YES_NO_HINT.sub("", question).strip()
+
+def is_yes_no(question):
+    return YES_NO_HINT.search(question) is not None
+
+def is_amount(question):
+    return AMOUNT_QUESTION_PATTERN.search(question_text(question)) is not None
+
+def parse_answer(question, text):
+    """The answer `text` gives to `question`, or None when it doesn't answer it."""
+    text = text.strip()
+    if is_yes_no(question):
+        if UNSURE_PATTERN.search(text):
+            return None
+        if NO_PATTERN.search(text):
+            return "No"
+        if YES_PATTERN.search(text):
+            return "Yes"
+        return None
+    if is_amount(question):
+        if NO_AMOUNT_PATTERN.search(text):
+            return "0"
+        match = AMOUNT_PATTERN.search(text) or NUMBER_PATTERN.search(text)
+        return match.group(0).strip() if match else None
+    return text or None
+
+def parse_reference_number(text):
+    match = REFERENCE_PATTERN.search(text)
+    return match.group(0) if match else None
+
+def current_prompt(state, coverage_flow_questions, payload_data=None):
+    """What we are currently waiting on the representative to answer."""
+    stage = state["stage"]
+    if stage == COVERAGE:
+        question = question_text(coverage_flow_questions[state["question_index"]])
+        cpt_code = (payload_data or {}).get("cptCode")
+        if state["question_index"] == 0 and cpt_code:
+            return f"I'd like to check coverage for CPT code {cpt_code}. {question}"
+        return question
+    if stage == REFERENCE_NUMBER:
+        return REFERENCE_PROMPT
+    if stage == FEEDBACK:
+        return FEEDBACK_PROMPT
+    return None
+
+def summary(state):
+    lines = [f"{question}: {answer}" for question, answer in state["answers"].items()]
+    lines.append(f"Reference number: {state['reference_number'] or 'not provided'}")
+    if state["feedback"]:
+        lines.append(f"Feedback: {state['feedback']}")
+    return "\n".join(lines)
+
+def _advance(state, coverage_flow_questions, payload_data):
+    if state["stage"] == AUTHENTICATION:
+        state["stage"] = COVERAGE if coverage_flow_questions else REFERENCE_NUMBER
+    elif state["stage"] == COVERAGE:
+        state["question_index"] += 1
+        if state["question_index"] >= len(coverage_flow_questions):
+            state["stage"] = REFERENCE_NUMBER
+    elif state["stage"] == REFERENCE_NUMBER:
+        state["stage"] = FEEDBACK
+    elif state["stage"] == FEEDBACK:
+        state["stage"] = COMPLETE
+        return CLOSING_MESSAGE
+    return current_prompt(state, coverage_flow_questions, payload_data)
+
+def next_turn(state, text, payload_data, coverage_flow_questions):
+    """Update the state with the representative's turn and return our scripted reply.
+
+    Returns None when the turn needs a model answer (authentication questions,
+    the representative asking something mid-flow, or a reply that doesn't answer
+    the open question); the state is left as is.
+    """
+    stage = state["stage"]
+    response = None
+    if stage == AUTHENTICATION:
+        if AUTH_CONFIRMED_PATTERN.search(text):
+            response = _advance(state, coverage_flow_questions, payload_data)
+    elif stage == COMPLETE:
+        if SUMMARY_PATTERN.search(text):
+            response = summary(state)
+    elif REPEAT_PATTERN.search(text):
+        response = current_prompt(state, coverage_flow_questions, payload_data)
+    elif SUMMARY_PATTERN.search(text):
+        # The summary is only shared once the reference number and feedback are collected
+        response = f"I'll share the summary at the end of the call. {current_prompt(state, coverage_flow_questions, payload_data)}"
+    elif HOLD_PATTERN.search(text):
+        # The representative is looking it up; the question stays open
+        response = HOLD_MESSAGE
+    elif not QUESTION_PATTERN.search(text):
+        # Only an answer that fits the open question moves the flow on; anything else goes to the model
+        if stage == COVERAGE:
+            question = coverage_flow_questions[state["question_index"]]
+            answer = parse_answer(question, text)
+            if answer is not None:
+                state["answers"][question_text(question)] = answer
+                response = _advance(state, coverage_flow_questions, payload_data)
+        elif stage == REFERENCE_NUMBER:
+            reference_number = parse_reference_number(text)
+            if reference_number is not None:
+                state["reference_number"] = reference_number
+                response = _advance(state, coverage_flow_questions, payload_data)
+        elif stage == FEEDBACK:
+            if text.strip():
+                state["feedback"] = text.strip()
+                response = _advance(state, coverage_flow_questions, payload_data)
+    _record(stage, response is not None)
+    return response
+
+def position(state):
+    """Where a call is in the flow, e.g. "coverage:2"; the prefetcher predicts turns per position."""
+    if state is None:
+        return AUTHENTICATION
+    if state["stage"] == COVERAGE:
+        return f"{COVERAGE}:{state['question_index']}"
+    return state["stage"]
+
+def prompt_stage(state):
+    """Stage to build the model prompt for when next_turn defers to the model."""
+    return "authentication" if state["stage"] == AUTHENTICATION else "coverage_flow"
+
+def prompt_questions(state, coverage_flow_questions):
+    # Only the open question is relevant to a mid-flow model turn, keeping its prompt constant-size
+    if state["stage"] == COVERAGE:
+        return [coverage_flow_questions[state["question_index"]]]
+    return []
+
+def metrics():
+    with _stats_lock:
+        metrics = dict(stats, by_stage=dict(stats["by_stage"]))
+    metrics["scripted_rate"] = metrics["scripted"] / metrics["turns"] if metrics["turns"] else 0.0
+    return metrics
+
+register_source("bot_coverage_flow", metrics, counters=stats, labels={"by_stage": "stage"})
@@ -0,0 +1,170 @@
+import argparse
+import json
+import logging
+import re
+import sys
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WRITTEN_NUMBERS = {
+    'a': 1, 'an': 1, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+    'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12,
+    'fifteen': 15, 'twenty': 20, 'twenty four': 24, 'twenty-four': 24, 'thirty': 30,
+    'forty five': 45, 'forty-five': 45, 'half a': 0.5, 'half an': 0.5,
+}
+UNIT_HOURS = {'m': 1 / 60, 'h': 1, 'd': 24}
+
+VEHICLE_GROUPS = {
+    'vehicle_two': ('two-wheeler', r"(?:two|2)[\s-]?wheelers?|motor\s?(?:bike|cycle)s?|bikes?|scoot(?:er|y)s?|mopeds?"),
+    'vehicle_four': ('four-wheeler', r"(?:four|4)[\s-]?wheelers?|cars?|suvs?|vans?|jeeps?|sedans?|hatchbacks?"),
+    'vehicle_heavy': ('heavy vehicle', r"heavy\s+vehicles?|trucks?|lorr(?:y|ies)|buse?s?|tempos?"),
+}
+DURATION_UNIT = r"hours?|hrs?|h|minutes?|mins?|m|days?|d"
+_NUMBER_WORDS = "|".join(sorted((re.escape(w) for w in WRITTEN_NUMBERS), key=len, reverse=True))
+
+# All entity kinds in one alternation so a message is scanned once. Vehicle
+# phrases come first so "two wheeler" wins over the duration "two ...".
+ENTITY_PATTERN = re.compile(
+    "|".join(
+        [rf"\b(?P<{name}>{pattern})\b" for name, (_, pattern) in VEHICLE_GROUPS.items()]
+        + [
+            # Indian registration numbers: KA 01 AB 1234, MH-12-A-7, 22 BH 1234 AA. The state code is
+            # case-sensitive and a plate is never followed by a duration unit, so "is 3 hr 30 mins" stays a duration
+            r"\b(?P<registration>(?-i:[A-Z]{2})[-\s]?\d{1,2}[-\s]?[A-Z]{1,3}[-\s]?\d{1,4}|\d{2}[-\s]?(?-i:BH)[-\s]?\d{4}[-\s]?[A-Z]{1,2})\b"
+            rf"(?![-\s]*(?:{DURATION_UNIT})\b)",
+            # Durations: "3 hours", "45min", "2h", "two hours", "half an hour"
+            rf"\b(?P<duration>(?P<duration_value>\d+(?:\.\d+)?)\s*(?P<duration_unit>{DURATION_UNIT})"
+            rf"|(?P<duration_word>{_NUMBER_WORDS})\s+(?P<duration_word_unit>hours?|hrs?|minutes?|mins?|days?))\b",
+            r"\b(?P<cpt>(?:cpt|procedure)\s*(?:codes?)?\s*(?:is|:|#|number)?\s*(?P<cpt_code>\d{4}[0-9FTU]))\b",
+            r"\b(?P<member_id>member\s*(?:id|number)\s*(?:is|:|#)?\s*(?P<member_id_value>[A-Z0-9]*\d[A-Z0-9-]{3,}))",
+        ]
+    ),
+    re.IGNORECASE,
+)
+VEHICLE_TYPES = {name: vehicle_type for name, (vehicle_type, _) in VEHICLE_GROUPS.items()}
+# Only durations joined like this add up ("1 hr 30 mins", "2 hours and 15 minutes")
+COMPOUND_GAP = re.compile(r"^\s*(?:,|and|,\s*and)?\s*$", re.IGNORECASE)
+# Durations that say when the caller arrives rather than how long they stay: "in a minute", "5 min away"
+ARRIVAL_BEFORE = re.compile(r"\b(?:in|within)\s+(?:about\s+|around\s+)?$", re.IGNORECASE)
+ARRIVAL_AFTER = re.compile(r"\s*(?:away|late|early|ago|from\s+(?:here|there|now))\b", re.IGNORECASE)
+
+def _duration_hours(match):
+    if match.group('duration_value') is not None:
+        amount, unit = float(match.group('duration_value')), match.group('duration_unit')
+    else:
+        amount, unit = WRITTEN_NUMBERS[match.group('duration_word').lower()], match.group('duration_word_unit')
+    return amount * UNIT_HOURS[unit[0].lower()]
+
+def _stay_hours(message, durations):
+    """One stay length from the duration matches, or None when they disagree.
+
+    Adjacent durations in falling units form one compound duration; arrival
+    times are ignored.
+    """
+    totals = []
+    previous = None
+    for match in durations:
+        if ARRIVAL_BEFORE.search(message, 0, match.start()) or ARRIVAL_AFTER.match(message, match.end()):
+            previous = None
+            continue
+        hours = _duration_hours(match)
+        unit = UNIT_HOURS[(match.group('duration_unit') or match.group('duration_word_unit'))[0].lower()]
+        if (previous is not None and unit < previous[1]
+                and COMPOUND_GAP.match(message[previous[0].end():match.start()])):
+            totals[-1] += hours
+        else:
+            totals.append(hours)
+        previous = (match, unit)
+    if not totals or any(total != totals[0] for total in totals):
+        return None
+    return totals[0]
+
+def extract_entities(message):
+    """Extract vehicle types, registration numbers, duration, CPT codes and member IDs in one pass.
+
+    Adjacent durations are summed ("2 hours 30 minutes" -> 2.5) and reported
+    in hours; unrelated durations that disagree leave `hours` as None. Lists
+    keep the order of appearance.
+    """
+    entities = {
+        'vehicle_types': [], 'vehicle_numbers': [], 'hours': None,
+        'cpt_codes': [], 'member_ids': [],
+    }
+    durations = []
+    for match in ENTITY_PATTERN.finditer(message):
+        kind = match.lastgroup
+        if kind in VEHICLE_TYPES:
+            entities['vehicle_types'].append(VEHICLE_TYPES[kind])
+        elif kind == 'registration':
+            entities['vehicle_numbers'].append(re.sub(r"[-\s]", "", match.group(kind)).upper())
+        elif kind == 'duration':
+            durations.append(match)
+        elif kind == 'cpt':
+            entities['cpt_codes'].append(match.group('cpt_code').upper())
+        elif kind == 'member_id':
+            entities['member_ids'].append(match.group('member_id_value').upper())
+    if durations:
+        entities['hours'] = _stay_hours(message, durations)
+    return entities
+
+def extract_batch(messages):
+    """Lazily extract entities from an iterable of messages."""
+    for message in messages:
+        yield extract_entities(message)
+
+def iter_transcript_lines(paths):
+    """Stream (path, line_number, text) from transcript files.
+
+    Plain text files yield one utterance per line; .jsonl files yield the
+    `text`, `transcript` or `Utterances` field of each record.
+    """
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                if path.endswith('.jsonl'):
+                    record = json.loads(line)
+                    line = record.get('text') or record.get('transcript') or record.get('Utterances') or ''
+                yield path, line_number, line
+
+def backfill(paths, output):
+    """Write one JSON line of entities per transcript line, for offline backfills."""
+    count = 0
+    for path, line_number, text in iter_transcript_lines(paths):
+        record = extract_entities(text)
+        record['source'] = path
+        record['line'] = line_number
+        output.write(json.dumps(record) + "\n")
+        count += 1
+    return count
+
+def benchmark(iterations=200000):
+    """Single-core throughput of extract_entities over a mix of representative messages."""
+    samples = [
+        "I want to park my two wheeler KA 01 AB 1234 for 3 hours",
+        "How much for a car for two hours and 30 minutes?",
+        "Book a truck MH-12-DE-4321 for a day",
+        "The CPT code is 99213 and the member ID is 0014168073-01",
+        "What are the parking rates?",
+    ]
+    start = time.perf_counter()
+    for i in range(iterations):
+        extract_entities(samples[i % len(samples)])
+    elapsed = time.perf_counter() - start
+    return {"messages": iterations, "seconds": elapsed, "messages_per_second": iterations / elapsed}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract entities from transcripts, or benchmark the extractor.")
+    parser.add_argument("paths", nargs="*", help="transcript files (.txt or .jsonl)")
+    parser.add_argument("--bench", action="store_true", help="run the single-core micro-benchmark")
+    args = parser.parse_args()
+    if args.bench:
+        print(json.dumps(benchmark()))
+    else:
+        written = backfill(args.paths, sys.stdout)
+        logger.info(f"Extracted entities from {written} transcript lines")
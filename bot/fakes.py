@@ -0,0 +1,292 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from google.cloud import bigquery
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from prompt_builder import count_message_tokens, count_tokens
+
+# Local stand-ins for external services, used for offline runs and benchmarks
+
+class FakeQueryJob:
+    def __init__(self, rows, columns=None):
+        self._rows = rows
+        self._columns = columns
+
+    def result(self):
+        return self._rows
+
+    def to_arrow(self):
+        import pyarrow as pa
+        columns = self._columns or (list(self._rows[0].keys()) if self._rows else [])
+        return pa.table({name: [row.get(name) for row in self._rows] for name in columns})
+
+class FakeBigQueryClient:
+    """In-memory stand-in for bigquery.Client covering the statements the bot issues.
+
+    Rows live in a dict keyed by session_id. MERGE statements are applied from
+    their @rows parameter with the same COALESCE semantics the writer uses, and
+    SELECTs are filtered by @session_id or @session_ids. Every call sleeps `latency` seconds.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.rows = {}
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def query(self, query, job_config=None):
+        if self.latency:
+            time.sleep(self.latency)
+        parameters = {p.name: p for p in (job_config.query_parameters if job_config else [])}
+        statement = query.lstrip().split(None, 1)[0].upper()
+        with self._lock:
+            self.queries.append(query)
+            if statement == "MERGE":
+                self._merge(parameters["rows"])
+                return FakeQueryJob([])
+            if statement == "SELECT":
+                return self._select(query, parameters)
+        raise NotImplementedError(f"FakeBigQueryClient does not support: {statement}")
+
+    def _merge(self, rows_parameter):
+        for struct in rows_parameter.values:
+            values = struct.struct_values
+            row = self.rows.setdefault(values["session_id"], {})
+            for name, value in values.items():
+                if value is not None or name not in row:
+                    row[name] = value
+
+    def _select(self, query, parameters):
+        selected = re.search(r"SELECT\s+(.*?)\s+FROM", query, re.IGNORECASE | re.DOTALL).group(1)
+        columns = None if selected.strip() == "*" else [c.strip().strip("`") for c in selected.split(",")]
+
+        match = re.search(r"session_id\s*=\s*'([^']*)'", query)
+        if match:
+            rows = [self.rows[match.group(1)]] if match.group(1) in self.rows else []
+        elif "session_id" in parameters:
+            session_id = parameters["session_id"].value
+            rows = [self.rows[session_id]] if session_id in self.rows else []
+        elif "session_ids" in parameters:
+            rows = [self.rows[session_id] for session_id in parameters["session_ids"].values if session_id in self.rows]
+        else:
+            rows = list(self.rows.values())
+        if re.search(r"parking_hours\s+IS\s+NOT\s+NULL", query, re.IGNORECASE):
+            rows = [row for row in rows if row.get("parking_hours") is not None]
+
+        result = []
+        for row in rows:
+            names = columns or list(row)
+            result.append(bigquery.Row(tuple(row.get(name) for name in names), {name: i for i, name in enumerate(names)}))
+        return FakeQueryJob(result, columns)
+
+# Deterministic multi-sentence answers so streaming has something to split
+FAKE_RESPONSES = [
+    "Thank you, that matches our records. Let's continue with the coverage questions.",
+    "The member's plan is Medicare through American Specialty Health. The provider is in network for this service.",
+    "I don't have that information in the member details. Could you check the member ID and try again?",
+    "Understood, I've noted that. Has the patient met the deductible for this year?",
+]
+
+# Prompts asking for structured output get a JSON answer to each "- question" line instead
+JSON_REQUEST_MARKER = "JSON object"
+
+def fake_json_response(question):
+    digest = int(hashlib.md5(str(question).encode()).hexdigest(), 16)
+    answers = {}
+    for i, line in enumerate(str(question).splitlines()):
+        if line.startswith("- "):
+            asked = line[2:].strip()
+            answers[asked] = ("Yes", "No")[(digest >> i) & 1] if "yes/no" in asked.lower() else f"${(digest >> i) % 50 + 10}"
+    answers["reference_number"] = f"REF-{digest % 100000:05d}"
+    return json.dumps(answers)
+
+class FakeRateLimitError(Exception):
+    """Raised by FakeChatModel to exercise retry paths; carries the status code openai.RateLimitError does."""
+    status_code = 429
+
+# Totals across every FakeChatModel call, read by the benchmark
+fake_llm_usage = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+_usage_lock = threading.Lock()
+
+class FakeChatModel(BaseChatModel):
+    """Chat model stand-in with configurable latency and token accounting.
+
+    The answer is picked deterministically from FAKE_RESPONSES by hashing the
+    last human message. `latency` is the time to the full response; streamed
+    responses spread it over the chunks after `first_token_latency`. A
+    `rate_limit_rate` fraction of calls raise FakeRateLimitError.
+    """
+
+    latency: float = 0.0
+    first_token_latency: float = 0.0
+    rate_limit_rate: float = 0.0
+    # Reported as the model in llm_output, so fakes standing in for different tiers can be told apart
+    model_name: str = "fake-chat"
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _respond(self, messages):
+        if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+            raise FakeRateLimitError("Rate limit reached (fake)")
+        question = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        if any(JSON_REQUEST_MARKER in str(m.content) for m in messages):
+            text = fake_json_response(question)
+        else:
+            text = FAKE_RESPONSES[int(hashlib.md5(str(question).encode()).hexdigest(), 16) % len(FAKE_RESPONSES)]
+        usage = {"prompt_tokens": count_message_tokens(messages), "completion_tokens": count_tokens(text)}
+        with _usage_lock:
+            fake_llm_usage["calls"] += 1
+            fake_llm_usage["prompt_tokens"] += usage["prompt_tokens"]
+            fake_llm_usage["completion_tokens"] += usage["completion_tokens"]
+        return text, usage
+
+    def _result(self, text, usage):
+        message = AIMessage(content=text, response_metadata={"token_usage": usage})
+        return ChatResult(generations=[ChatGeneration(message=message)], llm_output={"token_usage": usage, "model_name": self.model_name})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._respond(messages)
+        time.sleep(self.latency)
+        return self._result(text, usage)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text, usage = self._respond(messages)
+        await asyncio.sleep(self.latency)
+        return self._result(text, usage)
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, _ = self._respond(messages)
+        words = text.split(" ")
+        time.sleep(self.first_token_latency)
+        for i, word in enumerate(words):
+            time.sleep(max(self.latency - self.first_token_latency, 0) / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text, _ = self._respond(messages)
+        words = text.split(" ")
+        await asyncio.sleep(self.first_token_latency)
+        for i, word in enumerate(words):
+            await asyncio.sleep(max(self.latency - self.first_token_latency, 0) / len(words))
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+
+class _MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            return self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+        with mock.lock:
+            mock.requests += 1
+            scripted = mock.scripted_latencies.pop(0) if mock.scripted_latencies else None
+        if scripted is None:
+            scripted = mock.slow_latency if random.random() < mock.slow_rate else mock.latency
+        time.sleep(scripted)
+        if random.random() < mock.error_rate:
+            return self._send(500, {"error": {"message": "Mock server error", "type": "server_error"}})
+
+        messages = body.get("messages", [])
+        question = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        text = FAKE_RESPONSES[int(hashlib.md5(str(question).encode()).hexdigest(), 16) % len(FAKE_RESPONSES)]
+        prompt_tokens = sum(count_tokens(str(m.get("content", ""))) for m in messages)
+        completion = {
+            "id": f"chatcmpl-mock-{mock.requests}",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+        }
+        if not body.get("stream"):
+            return self._send(200, {
+                **completion,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": count_tokens(text),
+                          "total_tokens": prompt_tokens + count_tokens(text)},
+            })
+
+        # Server-sent events, one word per chunk; the connection closes after [DONE]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            delta = {"content": word if i == 0 else " " + word}
+            chunk = {**completion, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        done = {**completion, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode())
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class _MockOpenAIHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on hedges that lost and calls past their deadline; that's expected here
+        if not issubclass(sys.exc_info()[0], ConnectionError):
+            super().handle_error(request, client_address)
+
+class MockOpenAIServer:
+    """Local OpenAI-compatible /v1/chat/completions endpoint, for running the real client stack offline.
+
+    Point the openai client at it with OPENAI_BASE_URL=server.base_url. Each request
+    takes `latency` seconds, or `slow_latency` for a `slow_rate` fraction of them,
+    and an `error_rate` fraction answer HTTP 500. Connections are kept alive.
+    The first requests take `scripted_latencies` instead, in order, for deterministic tests.
+    """
+
+    def __init__(self, latency=0.05, slow_rate=0.0, slow_latency=2.0, error_rate=0.0, host="127.0.0.1", port=0,
+                 scripted_latencies=()):
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate
+        self.scripted_latencies = list(scripted_latencies)
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._server = _MockOpenAIHTTPServer((host, port), _MockOpenAIHandler)
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-openai", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
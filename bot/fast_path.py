@@ -0,0 +1,199 @@
+import datetime
+import logging
+import re
+import string
+import threading
+from metrics import register_source
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Intent name -> (question pattern, answer template, kind used for yes/no comparison)
+INTENTS = {
+    "member_first_name": (r"(?:member|patient)(?:'s)?\s+first\s+name|first\s+name\s+of\s+the\s+(?:member|patient)",
+                          "The member's first name is {memberFirstName}.", "name"),
+    "member_last_name": (r"(?:member|patient)(?:'s)?\s+(?:last|sur)\s*name|last\s+name\s+of\s+the\s+(?:member|patient)",
+                         "The member's last name is {memberLastName}.", "name"),
+    "member_name": (r"(?:member|patient)(?:'s)?\s+(?:full\s+)?name|name\s+of\s+the\s+(?:member|patient)",
+                    "The member's name is {member_full_name}.", "name"),
+    "member_dob": (r"date\s+of\s+birth|\bdob\b|birth\s*date|\bborn\b",
+                   "The member's date of birth is {memberDob}.", "date"),
+    "member_id": (r"member\s*(?:id|number)|subscriber\s*(?:id|number)|policy\s*(?:id|number)",
+                  "The member ID is {memberId}.", "number"),
+    "group_number": (r"group\s*(?:number|no\b|#|id)",
+                     "The group number is {memberGroupNumber}.", "number"),
+    "provider_npi": (r"\bnpi\b", "The NPI is {providerNpi}.", "number"),
+    "provider_tax_id": (r"tax\s*id|\btin\b|\bein\b", "The tax ID is {providerTaxId}.", "number"),
+    "member_phone": (r"(?:member|patient)(?:'s)?\s+(?:phone|contact)\s*(?:number)?",
+                     "The member's phone number is {memberPhoneNumber}.", "number"),
+    "member_zip": (r"zip\s*code|\bzip\b|postal\s+code", "The member's zip code is {memberZipcode}.", "number"),
+    "member_address": (r"(?:member|patient)(?:'s)?\s+(?:home\s+|street\s+)?address",
+                       "The member's address is {memberStreet}, {memberZipcode}.", "text"),
+    "member_gender": (r"\bgender\b|\bsex\b", "The member's gender is {gender}.", "text"),
+    "cpt_code": (r"\bcpt\b(?:\s+code)?|procedure\s+code", "The CPT code is {cptCode}.", "number"),
+    "provider_name": (r"(?:provider|doctor|physician)(?:'s)?\s+name|rendering\s+provider",
+                      "The provider is {provider_full_name}.", "name"),
+}
+
+# One scan over the question finds every intent keyword
+INTENT_INDEX = re.compile(
+    "|".join(f"(?P<{name}>{pattern})" for name, (pattern, _, _) in INTENTS.items()),
+    re.IGNORECASE,
+)
+REPEAT_PATTERN = re.compile(r"\brepeat\b|say\s+(?:that|it)\s+again|come\s+again|\bpardon\b", re.IGNORECASE)
+YES_NO_PATTERN = re.compile(r"^\s*(?:is|are|was|does|do|can\s+you\s+confirm|confirm)\b", re.IGNORECASE)
+# Questions that combine asks or need reasoning go to the LLM
+COMPLEX_PATTERN = re.compile(r"\b(?:and|also|or|why|how|when|which|if|whether|both)\b|,", re.IGNORECASE)
+# Questions about someone or some plan other than the member's own; the payload only describes the member
+OTHER_PARTY_PATTERN = re.compile(
+    r"\b(?:secondary|tertiary|spouse|husband|wife|partner|dependents?|child|son|daughter|parent|guardian"
+    r"|policy\s*holder|(?:other|another|previous|prior|former|old)\s+(?:insurance|plan|policy|coverage|payer|carrier))\b",
+    re.IGNORECASE,
+)
+CLAIM_FILLER = re.compile(r"^(?:\s|is|was|of|the|it|as|a|an|on\s+file|correct|:|=)+|[\s?.!]+$", re.IGNORECASE)
+MAX_FAST_PATH_WORDS = 16
+
+MONTHS = {name: index for index, name in enumerate(
+    ("january", "february", "march", "april", "may", "june", "july", "august", "september", "october",
+     "november", "december"), start=1)}
+MONTH = r"(?P<month_name>[a-z]{3,9})\.?"
+# Numeric dates are read month first, as the payload stores them
+DATE_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"^(?P<year>\d{4})[-/.](?P<month>\d{1,2})[-/.](?P<day>\d{1,2})$",
+    r"^(?P<month>\d{1,2})[-/.](?P<day>\d{1,2})[-/.](?P<year>\d{2}|\d{4})$",
+    rf"^{MONTH}\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?,?\s+(?P<year>\d{{2}}|\d{{4}})$",
+    rf"^(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?{MONTH},?\s+(?P<year>\d{{2}}|\d{{4}})$",
+)]
+
+# Composite values built from several payload fields
+DERIVED_FIELDS = {
+    "member_full_name": ("memberFirstName", "memberMiddleName", "memberLastName"),
+    "provider_full_name": ("providerFirstName", "providerMiddleName", "providerLastName"),
+}
+TEMPLATE_FIELDS = {
+    name: [field for _, field, _, _ in string.Formatter().parse(template) if field]
+    for name, (_, template, _) in INTENTS.items()
+}
+
+stats = {"lookups": 0, "hits": 0, "misses": 0, "by_intent": {}}
+_stats_lock = threading.Lock()
+
+def _record(intent):
+    with _stats_lock:
+        stats["lookups"] += 1
+        if intent is None:
+            stats["misses"] += 1
+        else:
+            stats["hits"] += 1
+            stats["by_intent"][intent] = stats["by_intent"].get(intent, 0) + 1
+
+def _clean(value):
+    return re.sub(r"\s+", " ", str(value)).strip()
+
+def _field_values(fields, payload_data):
+    values = {}
+    for field in fields:
+        if field in DERIVED_FIELDS:
+            value = " ".join(str(payload_data.get(part, "")) for part in DERIVED_FIELDS[field])
+        else:
+            value = payload_data.get(field)
+        if value is None or not _clean(value):
+            raise KeyError(field)
+        values[field] = _clean(value)
+    return values
+
+def _parse_date(text):
+    """(year, month, day) for a full date such as 12/17/91 or December 17 1991, else None."""
+    text = _clean(text)
+    for pattern in DATE_PATTERNS:
+        match = pattern.match(text)
+        if match is None:
+            continue
+        parts = match.groupdict()
+        if parts.get("month_name") is not None:
+            month = next((number for name, number in MONTHS.items()
+                          if name.startswith(parts["month_name"].lower())), None)
+        else:
+            month = int(parts["month"])
+        year = int(parts["year"])
+        if len(parts["year"]) == 2:
+            # Birth dates are in the past, so 91 is 1991 and 05 is 2005
+            this_year = datetime.date.today().year
+            year += this_year - this_year % 100
+            if year > this_year:
+                year -= 100
+        try:
+            return datetime.date(year, month, int(parts["day"])).timetuple()[:3] if month else None
+        except ValueError:
+            return None
+    return None
+
+def _compare(kind, claim, expected):
+    """Whether the claim matches the value on file; None when the claim can't be checked here."""
+    if kind == "name":
+        claimed = set(re.findall(r"[a-z]+", claim.lower()))
+        return bool(claimed) and claimed <= set(re.findall(r"[a-z]+", expected.lower()))
+    if kind == "date":
+        claimed, on_file = _parse_date(claim), _parse_date(expected)
+        if claimed is None or on_file is None:
+            return None
+        return claimed == on_file
+    if kind == "number":
+        claimed = re.sub(r"\D", "", claim)
+        return bool(claimed) and claimed == re.sub(r"\D", "", expected)
+    return claim.lower() == expected.lower()
+
+def _last_ai_message(history):
+    for message in reversed(history.messages if history is not None else []):
+        if message.type == "ai":
+            return message.content
+    return None
+
+def answer(question, payload_data, history=None):
+    """Answer a plain lookup question from the payload, or return None to defer to the LLM."""
+    if REPEAT_PATTERN.search(question):
+        previous = _last_ai_message(history)
+        _record("repeat" if previous else None)
+        return previous
+
+    matches = [match for match in INTENT_INDEX.finditer(question)]
+    intents = {match.lastgroup for match in matches}
+    if (len(intents) != 1 or len(question.split()) > MAX_FAST_PATH_WORDS
+            or COMPLEX_PATTERN.search(question) or OTHER_PARTY_PATTERN.search(question)):
+        _record(None)
+        return None
+
+    intent = intents.pop()
+    _, template, kind = INTENTS[intent]
+    try:
+        statement = template.format(**_field_values(TEMPLATE_FIELDS[intent], payload_data))
+    except KeyError:
+        # Field not in this payload; let the LLM explain what is missing
+        _record(None)
+        return None
+
+    if YES_NO_PATTERN.match(question):
+        claim = CLAIM_FILLER.sub("", question[matches[-1].end():])
+        if not claim:
+            _record(None)
+            return None
+        expected = re.search(r"\bis (.*)\.$", statement).group(1)
+        matched = _compare(kind, claim, expected)
+        if matched is None:
+            _record(None)
+            return None
+        response = "Yes." if matched else f"No. {statement}"
+    else:
+        response = statement
+
+    _record(intent)
+    return response
+
+def metrics():
+    with _stats_lock:
+        metrics = dict(stats, by_intent=dict(stats["by_intent"]))
+    metrics["hit_rate"] = metrics["hits"] / metrics["lookups"] if metrics["lookups"] else 0.0
+    return metrics
+
+register_source("bot_fast_path", metrics, counters=stats, labels={"by_intent": "intent"})
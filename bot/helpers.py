@@ -1,142 +1,202 @@
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage
-from langchain.memory import ConversationBufferMemory
-from langchain.chains import ConversationChain
-from google.cloud import bigquery
-import os
-import uuid
-import logging
-import re
-from datetime import datetime
-
-# Set up logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Initialize BigQuery client
-bigquery_client = bigquery.Client()
-
-# Set your BigQuery dataset and table name
-DATASET_NAME = 'parkin_pro'
-TABLE_NAME = 'parking_sessions'
-
-# Initialize LangChain components
-llm = ChatOpenAI(temperature=0.7, model="gpt-4")
-memory = ConversationBufferMemory()
-conversation = ConversationChain(llm=llm, memory=memory, verbose=True)
-
-# System message for the AI assistant
-SYSTEM_MESSAGE = """You are a helpful assistant for booking parking in malls and restaurants in India. Provide information based on these common rates and terms:
-
-Parking Rates:
-- Two-wheeler: ₹20 for first 2 hours, ₹10/hour after that, or ₹100/day
-- Four-wheeler: ₹40 for first 2 hours, ₹20/hour after that, or ₹200/day
-- Heavy vehicle: ₹80 for first 2 hours, ₹40/hour after that, or ₹400/day
-
-Terms and Conditions:
-1. Parking is at owner's risk
-2. Lost ticket fee: ₹500
-3. No overnight parking for two-wheelers
-4. Maximum stay: 24 hours
-5. Parking fees are non-refundable
-
-Vehicle Types:
-- Two-wheeler: Motorcycles, scooters
-- Four-wheeler: Cars, SUVs, vans
-- Heavy vehicle: Trucks, buses, tempos
-
-After providing information, ask for the vehicle type, vehicle number, and parking duration to create an entry."""
-
-conversation.memory.chat_memory.add_message(SystemMessage(content=SYSTEM_MESSAGE))
-
-def generate_new_session():
-    session_id = str(uuid.uuid4())
-    query = f"""
-    INSERT INTO `{DATASET_NAME}.{TABLE_NAME}` (session_id, start_time, active)
-    VALUES ('{session_id}', CURRENT_TIMESTAMP(), TRUE)
-    """
-    query_job = bigquery_client.query(query)
-    query_job.result()
-    logger.info(f"New session created: {session_id}")
-    return session_id
-
-def deactivate_session(session_id):
-    query = f"""
-    UPDATE `{DATASET_NAME}.{TABLE_NAME}`
-    SET active = FALSE
-    WHERE session_id = '{session_id}'
-    """
-    bigquery_client.query(query).result()
-    logger.info(f"Deactivated session: {session_id}")
-
-def extract_info(message):
-    vehicle_types = {
-        'two': 'two-wheeler',
-        'bike': 'two-wheeler',
-        'scooter': 'two-wheeler',
-        'four': 'four-wheeler',
-        'car': 'four-wheeler',
-        'suv': 'four-wheeler',
-        'heavy': 'heavy vehicle',
-        'truck': 'heavy vehicle',
-        'bus': 'heavy vehicle'
-    }
-    
-    vehicle_type = next((vehicle_types[word] for word in message.lower().split() if word in vehicle_types), None)
-    
-    vehicle_number = re.search(r'\b[A-Z]{2}[-\s]?\d{1,2}[-\s]?[A-Z]{1,2}[-\s]?\d{1,4}\b', message, re.IGNORECASE)
-    vehicle_number = vehicle_number.group() if vehicle_number else None
-    
-    hours = re.search(r'\b(\d+)\s*(hour|hr|h|hour)\b', message, re.IGNORECASE)
-    hours = int(hours.group(1)) if hours else None
-    
-    return vehicle_type, vehicle_number, hours
-
-def update_parking_entry(session_id, vehicle_type, vehicle_number, parking_hours):
-    query = f"""
-    UPDATE `{DATASET_NAME}.{TABLE_NAME}`
-    SET vehicle_type = '{vehicle_type}', 
-        vehicle_number = '{vehicle_number}', 
-        parking_hours = {parking_hours}, 
-        timestamp = CURRENT_TIMESTAMP(), 
-        confirmed = FALSE
-    WHERE session_id = '{session_id}'
-    """
-    query_job = bigquery_client.query(query)
-    query_job.result()
-    logger.info(f"Updated parking entry for session: {session_id}")
-
-def confirm_parking_entry(session_id):
-    query = f"""
-    UPDATE `{DATASET_NAME}.{TABLE_NAME}`
-    SET confirmed = TRUE, confirmation_timestamp = CURRENT_TIMESTAMP(), active = FALSE
-    WHERE session_id = '{session_id}'
-    """
-    query_job = bigquery_client.query(query)
-    query_job.result()
-    logger.info(f"Confirmed parking entry for session: {session_id}")
-
-def get_parking_entries(session_id):
-    query = f"""
-    SELECT * FROM `{DATASET_NAME}.{TABLE_NAME}`
-    WHERE session_id = '{session_id}'
-    """
-    query_job = bigquery_client.query(query)
-    results = query_job.result()
-    
-    entries = []
-    for row in results:
-        entry = dict(row.items())
-        entry['start_time'] = entry['start_time'].isoformat() if entry['start_time'] else None
-        entry['timestamp'] = entry['timestamp'].isoformat() if entry['timestamp'] else None
-        entry['confirmation_timestamp'] = entry['confirmation_timestamp'].isoformat() if entry['confirmation_timestamp'] else None
-        entries.append(entry)
-    
-    logger.info(f"Retrieved {len(entries)} entries for session: {session_id}")
-    return entries
-
-def generate_bot_response(user_message):
-    return conversation.predict(input=user_message)
-
-def get_welcome_message():
+import os
+import uuid
+import logging
+import re
+import math
+import time
+from datetime import datetime, timezone
+from clients import get_bigquery_client, lazy
+from llm_client import is_fallback
+import router
+from bq_writer import SessionEventWriter
+from bq_reader import SessionReader, TIMESTAMP_COLUMNS
+from extractor import extract_entities
+from tariff import codes_from_dictionary, compute_fees, format_quote
+from response_cache import response_cache, build_key, fingerprint, is_cacheable
+from session_store import session_store
+from prompt_builder import history_trimmer
+from metrics import count, register_source, span
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Set your BigQuery dataset and table name
+DATASET_NAME = 'parkin_pro'
+TABLE_NAME = 'parking_sessions'
+
+# Session lifecycle writes are batched in the background instead of one DML per turn
+session_writer = SessionEventWriter(get_bigquery_client, f"{DATASET_NAME}.{TABLE_NAME}")
+# Parameterized reads with a short-lived cache the writer invalidates as its batches land
+session_reader = SessionReader(get_bigquery_client, f"{DATASET_NAME}.{TABLE_NAME}", writer=session_writer)
+register_source("bot_session_writer", lambda: dict(session_writer.stats, queue_depth=session_writer.queue_depth()),
+                counters=session_writer.stats)
+register_source("bot_session_reader", session_reader.metrics, counters=session_reader.stats)
+
+# System message for the AI assistant
+SYSTEM_MESSAGE = """You are a helpful assistant for booking parking in malls and restaurants in India. Provide information based on these common rates and terms:
+
+Parking Rates:
+- Two-wheeler: ₹20 for first 2 hours, ₹10/hour after that, or ₹100/day
+- Four-wheeler: ₹40 for first 2 hours, ₹20/hour after that, or ₹200/day
+- Heavy vehicle: ₹80 for first 2 hours, ₹40/hour after that, or ₹400/day
+
+Terms and Conditions:
+1. Parking is at owner's risk
+2. Lost ticket fee: ₹500
+3. No overnight parking for two-wheelers
+4. Maximum stay: 24 hours
+5. Parking fees are non-refundable
+
+Vehicle Types:
+- Two-wheeler: Motorcycles, scooters
+- Four-wheeler: Cars, SUVs, vans
+- Heavy vehicle: Trucks, buses, tempos
+
+After providing information, ask for the vehicle type, vehicle number, and parking duration to create an entry."""
+
+@lazy
+def get_conversation():
+    # One stateless chain for every caller; each session's memory lives in the session store
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain_core.runnables.history import RunnableWithMessageHistory
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_MESSAGE),
+        MessagesPlaceholder(variable_name="history"),
+        ("human", "{input}"),
+    ])
+    return RunnableWithMessageHistory(
+        history_trimmer("history") | prompt | router.tiered_llm(temperature=0.7),
+        session_store.get,
+        input_messages_key="input",
+        history_messages_key="history",
+    )
+
+def remember_turn(session_id, user_message, response):
+    from langchain_core.messages import AIMessage, HumanMessage
+    session_store.get(session_id).add_messages([HumanMessage(content=user_message), AIMessage(content=response)])
+
+# Cached answers are only valid for the rate card they were generated from
+SYSTEM_MESSAGE_FINGERPRINT = fingerprint(SYSTEM_MESSAGE)
+
+# Messages asking what a stay costs; answered from the tariff table when the duration is known
+FEE_QUESTION_PATTERN = re.compile(r"\b(cost|costs|fee|fees|charge|charges|how much|price|pay|tariff)\b", re.IGNORECASE)
+
+def generate_new_session():
+    session_id = str(uuid.uuid4())
+    session_writer.submit(session_id, start_time=datetime.now(timezone.utc), active=True)
+    logger.info(f"New session created: {session_id}")
+    return session_id
+
+def deactivate_session(session_id):
+    session_writer.submit(session_id, active=False)
+    logger.info(f"Deactivated session: {session_id}")
+
+def extract_info(message):
+    entities = extract_entities(message)
+    vehicle_type = entities['vehicle_types'][0] if entities['vehicle_types'] else None
+    vehicle_number = entities['vehicle_numbers'][0] if entities['vehicle_numbers'] else None
+    # parking_hours is stored as whole hours, and partial hours are billed as full ones
+    hours = math.ceil(entities['hours']) if entities['hours'] else None
+    return vehicle_type, vehicle_number, hours
+
+def update_parking_entry(session_id, vehicle_type, vehicle_number, parking_hours):
+    session_writer.submit(
+        session_id,
+        vehicle_type=vehicle_type,
+        vehicle_number=vehicle_number,
+        parking_hours=parking_hours,
+        timestamp=datetime.now(timezone.utc),
+        confirmed=False,
+    )
+    logger.info(f"Updated parking entry for session: {session_id}")
+
+def confirm_parking_entry(session_id):
+    now = datetime.now(timezone.utc)
+    session_writer.submit(session_id, confirmed=True, confirmation_timestamp=now, active=False)
+    logger.info(f"Confirmed parking entry for session: {session_id}")
+
+def get_parking_entries(session_id):
+    # Snapshot unwritten changes before querying so a flush in between can't hide them
+    pending = session_writer.pending_row(session_id)
+    rows = session_reader.get(session_id)
+
+    # Overlay changes still waiting in the writer so callers read their own writes
+    if pending:
+        if not rows:
+            rows = [dict.fromkeys(TIMESTAMP_COLUMNS)]
+        for row in rows:
+            row.update(pending)
+
+    entries = []
+    for entry in rows:
+        for column in TIMESTAMP_COLUMNS:
+            entry[column] = entry[column].isoformat() if entry.get(column) else None
+        entries.append(entry)
+
+    logger.info(f"Retrieved {len(entries)} entries for session: {session_id}")
+    return entries
+
+def get_parking_entries_table(session_ids, columns=None):
+    """Committed rows for many sessions in one query, as a pyarrow Table (timestamps stay native)."""
+    table = session_reader.get_many(session_ids, columns)
+    logger.info(f"Retrieved {table.num_rows} entries for {len(session_ids)} sessions")
+    return table
+
+def get_fee_quote(vehicle_type, parking_hours):
+    return format_quote(vehicle_type, parking_hours)
+
+def recompute_parking_fees():
+    """Recompute the fee for every session with a duration, as an Arrow table with a `fee` column."""
+    query = f"""
+    SELECT session_id, vehicle_type, parking_hours FROM `{DATASET_NAME}.{TABLE_NAME}`
+    WHERE parking_hours IS NOT NULL
+    """
+    import pyarrow as pa
+    table = get_bigquery_client().query(query).to_arrow()
+    vehicle_types = table.column('vehicle_type').combine_chunks().dictionary_encode()
+    codes = codes_from_dictionary(vehicle_types.dictionary.to_pylist(), vehicle_types.indices.fill_null(-1).to_numpy())
+    fees = compute_fees(codes, table.column('parking_hours').to_numpy())
+    logger.info(f"Recomputed fees for {table.num_rows} sessions")
+    return table.append_column('fee', pa.array(fees))
+
+def generate_bot_response(user_message, session_id):
+    started = time.perf_counter()
+    vehicle_type, vehicle_number, hours = extract_info(user_message)
+
+    # Fee arithmetic comes from the tariff table instead of the LLM
+    if vehicle_type and hours:
+        quote = get_fee_quote(vehicle_type, hours)
+        if FEE_QUESTION_PATTERN.search(user_message) and vehicle_number is None:
+            remember_turn(session_id, user_message, quote)
+            count("responses", source="tariff")
+            router.record(router.RULES_TIER, time.perf_counter() - started)
+            return quote
+        user_message = f"{user_message}\n\n(Exact fee from the rate card: {quote})"
+
+    # Standalone rate-card questions repeat across calls; replies and turns carrying a vehicle number or duration are stateful
+    cache_key = None
+    if is_cacheable(user_message, 'parking') and vehicle_number is None and hours is None:
+        cache_key = build_key(user_message, 'parking', SYSTEM_MESSAGE_FINGERPRINT)
+        cached_response = response_cache.get(cache_key, 'parking')
+        if cached_response is not None:
+            remember_turn(session_id, user_message, cached_response)
+            count("responses", source="cache")
+            router.record(router.RULES_TIER, time.perf_counter() - started)
+            return cached_response
+    else:
+        response_cache.bypass()
+
+    count("responses", source="llm")
+    tier = router.route('parking', user_message)
+    started = time.perf_counter()
+    with span("llm", tag='parking', tier=tier):
+        message = get_conversation().invoke({"input": user_message}, config=router.route_config(session_id, tier))
+    router.record(tier, time.perf_counter() - started, message)
+    response = message.content
+    if cache_key is not None and not is_fallback(message):
+        response_cache.put(cache_key, response, 'parking', latency=time.perf_counter() - started)
+    return response
+
+def get_welcome_message():
     return "Welcome! I'm here to help you with parking information for malls and restaurants in India. How can I assist you today?"
\ No newline at end of file
@@ -0,0 +1,518 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from clients import lazy
+from metrics import count, register_source
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (e.g. Windows): the token bucket is per process
+    fcntl = None
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Every model call answers within the deadline, with the canned fallback if it has to.
+# The ASGI app gives up on the whole request at REQUEST_DEADLINE_SECONDS (4.5s).
+LLM_DEADLINE_SECONDS = float(os.environ.get("LLM_DEADLINE_SECONDS", "4.0"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("LLM_CONNECT_TIMEOUT_SECONDS", "1.0"))
+# The openai client's own retries back off for seconds; retries and hedges happen here instead
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "0"))
+LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", "64"))
+LLM_KEEPALIVE_SECONDS = float(os.environ.get("LLM_KEEPALIVE_SECONDS", "30"))
+
+# A call still running at the model's p95 latency gets a duplicate; the first answer wins
+LLM_HEDGE_ENABLED = os.environ.get("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.environ.get("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_LATENCY_WINDOW = int(os.environ.get("LLM_LATENCY_WINDOW", "200"))
+# Attempts per call, counting hedges and retries after an error
+LLM_MAX_ATTEMPTS = int(os.environ.get("LLM_MAX_ATTEMPTS", "2"))
+
+# After this many failed calls in a row a model is skipped for LLM_BREAKER_RESET_SECONDS,
+# then a single probe call decides whether it's back
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Calls per second shared by every worker process on the host; 0 turns the limit off
+LLM_RATE_LIMIT_PER_SECOND = float(os.environ.get("LLM_RATE_LIMIT_PER_SECOND", "0"))
+LLM_RATE_LIMIT_BURST = float(os.environ.get("LLM_RATE_LIMIT_BURST", str(max(LLM_RATE_LIMIT_PER_SECOND, 1.0))))
+LLM_RATE_LIMIT_FILE = os.environ.get("LLM_RATE_LIMIT_FILE", os.path.join(tempfile.gettempdir(), "parkingpro-llm-bucket"))
+
+FALLBACK_MESSAGE = os.environ.get(
+    "LLM_FALLBACK_MESSAGE",
+    "I'm sorry, I'm having trouble looking that up right now. Could you please repeat that in a moment?",
+)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+stats = {"calls": 0, "succeeded": 0, "failed": 0, "timeouts": 0, "hedged": 0, "hedge_wins": 0,
+         "retried": 0, "fallbacks": 0, "rate_limited": 0, "breaker_opened": 0}
+_stats_lock = threading.Lock()
+
+def _bump(name, value=1):
+    with _stats_lock:
+        stats[name] += value
+
+@lazy
+def get_http_clients():
+    """Keep-alive connection pools shared by every ChatOpenAI instance, as (sync, async)."""
+    import httpx
+    limits = httpx.Limits(max_connections=LLM_POOL_SIZE, max_keepalive_connections=LLM_POOL_SIZE,
+                          keepalive_expiry=LLM_KEEPALIVE_SECONDS)
+    timeout = httpx.Timeout(LLM_DEADLINE_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS)
+    return httpx.Client(limits=limits, timeout=timeout), httpx.AsyncClient(limits=limits, timeout=timeout)
+
+def openai_client_kwargs():
+    """HTTP settings for ChatOpenAI: the shared pools, a timeout and no client-side retries."""
+    http_client, http_async_client = get_http_clients()
+    return {
+        "http_client": http_client,
+        "http_async_client": http_async_client,
+        "timeout": LLM_DEADLINE_SECONDS,
+        "max_retries": LLM_MAX_RETRIES,
+    }
+
+class TokenBucket:
+    """Token bucket kept in a small file under flock, so worker processes share one budget."""
+
+    def __init__(self, rate, capacity, path=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path if fcntl is not None else None
+        self._tokens = capacity
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def _file(self):
+        # flock belongs to the open file, which a forked worker would share; open one per process
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _take(self):
+        """Take a token if one is there; otherwise return the seconds until one will be."""
+        with self._lock:
+            if self.path is None:
+                tokens, updated = self._tokens, self._updated
+            else:
+                fd = self._file()
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if self.path is not None:
+                    raw = os.pread(fd, 16, 0)
+                    tokens, updated = struct.unpack("dd", raw) if len(raw) == 16 else (self.capacity, time.time())
+                # Wall-clock time, since monotonic clocks aren't comparable across processes
+                now = time.time()
+                tokens = min(self.capacity, tokens + max(now - updated, 0.0) * self.rate)
+                wait_seconds = 0.0 if tokens >= 1 else (1 - tokens) / self.rate
+                if not wait_seconds:
+                    tokens -= 1
+                if self.path is None:
+                    self._tokens, self._updated = tokens, now
+                else:
+                    os.pwrite(fd, struct.pack("dd", tokens, now), 0)
+            finally:
+                if self.path is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            return wait_seconds
+
+    def try_acquire(self):
+        return self._take() == 0.0
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            wait_seconds = self._take()
+            if not wait_seconds:
+                return True
+            if time.monotonic() + wait_seconds > deadline:
+                return False
+            time.sleep(wait_seconds)
+
+    async def aacquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            wait_seconds = self._take()
+            if not wait_seconds:
+                return True
+            if time.monotonic() + wait_seconds > deadline:
+                return False
+            await asyncio.sleep(wait_seconds)
+
+class _Unlimited:
+    def try_acquire(self):
+        return True
+
+    def acquire(self, timeout):
+        return True
+
+    async def aacquire(self, timeout):
+        return True
+
+@lazy
+def get_rate_limiter():
+    if LLM_RATE_LIMIT_PER_SECOND <= 0:
+        return _Unlimited()
+    return TokenBucket(LLM_RATE_LIMIT_PER_SECOND, LLM_RATE_LIMIT_BURST, LLM_RATE_LIMIT_FILE)
+
+class CircuitBreaker:
+    """Closed until `failure_threshold` calls fail in a row, then open for `reset_seconds`.
+
+    After that it is half open: one probe call is let through, and its outcome closes
+    or re-opens the breaker. A probe that never reports back is replaced after another
+    `reset_seconds`.
+    """
+
+    def __init__(self, failure_threshold=LLM_BREAKER_FAILURES, reset_seconds=LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self._changed_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if time.monotonic() - self._changed_at < self.reset_seconds:
+                return False
+            self.state = HALF_OPEN
+            self._changed_at = time.monotonic()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self._changed_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            _bump("breaker_opened")
+            logger.warning(f"Circuit breaker opened after {self.failures} failed LLM calls")
+
+class ModelGuard:
+    """Recent latencies and the circuit breaker for one model."""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+        self._latencies = deque(maxlen=LLM_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None until there are enough samples."""
+        with self._lock:
+            if len(self._latencies) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(int(len(latencies) * LLM_HEDGE_PERCENTILE), len(latencies) - 1)]
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+def get_guard(model):
+    guard = _guards.get(model)
+    if guard is None:
+        with _guards_lock:
+            guard = _guards.setdefault(model, ModelGuard())
+    return guard
+
+@lazy
+def get_executor():
+    # Sync calls run here so the caller can stop waiting at the deadline or when a hedge wins
+    return ThreadPoolExecutor(max_workers=LLM_POOL_SIZE, thread_name_prefix="llm")
+
+def is_fallback(message):
+    return bool((getattr(message, "response_metadata", None) or {}).get("fallback"))
+
+def _fallback_message(reason, chunk=False):
+    from langchain_core.messages import AIMessage, AIMessageChunk
+    _bump("fallbacks")
+    count("llm_fallbacks", reason=reason)
+    return (AIMessageChunk if chunk else AIMessage)(content=FALLBACK_MESSAGE, response_metadata={"fallback": reason})
+
+def _fallback_result(reason):
+    from langchain_core.outputs import ChatGeneration, ChatResult
+    return ChatResult(generations=[ChatGeneration(message=_fallback_message(reason))], llm_output={"model_name": "fallback"})
+
+def _fallback_chunk(reason):
+    from langchain_core.outputs import ChatGenerationChunk
+    return ChatGenerationChunk(message=_fallback_message(reason, chunk=True))
+
+_resilient_class = None
+
+def resilient(llm, model_key):
+    """Wrap a chat model with a deadline, hedged attempts, a circuit breaker and rate limiting.
+
+    Calls that can't be answered in time, or while the breaker is open, return
+    FALLBACK_MESSAGE instead of raising; check for it with is_fallback().
+    """
+    global _resilient_class
+    if _resilient_class is None:
+        # Built on first use so importing this module doesn't pull in langchain
+        _resilient_class = _build_resilient_class()
+    return _resilient_class(inner=llm, model_key=model_key)
+
+def _build_resilient_class():
+    from langchain_core.language_models.chat_models import BaseChatModel
+
+    class ResilientChatModel(BaseChatModel):
+        inner: BaseChatModel
+        model_key: str
+        hedging: bool = LLM_HEDGE_ENABLED
+
+        @property
+        def _llm_type(self):
+            return f"resilient-{self.inner._llm_type}"
+
+        @property
+        def _identifying_params(self):
+            return {"model_key": self.model_key, **self.inner._identifying_params}
+
+        def _start(self):
+            _bump("calls")
+            guard = get_guard(self.model_key)
+            return guard, None if guard.breaker.allow() else "circuit_open"
+
+        def _succeeded(self, guard, hedge_won):
+            guard.breaker.record_success()
+            _bump("succeeded")
+            if hedge_won:
+                _bump("hedge_wins")
+
+        def _failed(self, guard, error):
+            """Record a call that got no answer in time; returns the fallback reason."""
+            guard.breaker.record_failure()
+            if error is None:
+                _bump("timeouts")
+                logger.warning(f"LLM call to {self.model_key} missed its {LLM_DEADLINE_SECONDS}s deadline")
+                return "deadline"
+            _bump("failed")
+            logger.warning(f"LLM call to {self.model_key} failed: {error!r}")
+            return "error"
+
+        def _another_attempt(self, attempts, failed, hedge_due):
+            """'retried' or 'hedged' if another attempt should start now, else None."""
+            # Extra attempts only spend spare rate budget, never wait for it
+            if (failed or hedge_due) and len(attempts) < LLM_MAX_ATTEMPTS and get_rate_limiter().try_acquire():
+                kind = "retried" if failed else "hedged"
+                _bump(kind)
+                return kind
+            return None
+
+        def _hedge_at(self, guard):
+            delay = guard.hedge_delay() if self.hedging else None
+            return None if delay is None else time.monotonic() + delay
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            guard, refused = self._start()
+            if refused:
+                return _fallback_result(refused)
+            deadline = time.monotonic() + LLM_DEADLINE_SECONDS
+            if not get_rate_limiter().acquire(LLM_DEADLINE_SECONDS):
+                _bump("rate_limited")
+                return _fallback_result("rate_limited")
+            hedge_at = self._hedge_at(guard)
+            attempts = {}
+
+            def launch(kind="first"):
+                started = time.perf_counter()
+                future = get_executor().submit(self.inner._generate, messages, stop=stop, **kwargs)
+                # Abandoned attempts still report their latency when they finish
+                future.add_done_callback(
+                    lambda f: not f.cancelled() and f.exception() is None and guard.observe(time.perf_counter() - started)
+                )
+                attempts[future] = kind
+                return future
+
+            pending = {launch()}
+            winner = error = None
+            while pending and winner is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                timeout = remaining if hedge_at is None else min(remaining, max(hedge_at - time.monotonic(), 0))
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        winner = future
+                        break
+                    error = future.exception()
+                if winner is None:
+                    hedge_due = hedge_at is not None and time.monotonic() >= hedge_at
+                    if hedge_due:
+                        hedge_at = None
+                    kind = self._another_attempt(attempts, bool(done), hedge_due)
+                    if kind:
+                        pending.add(launch(kind))
+            for future in pending:
+                future.cancel()
+            if winner is None:
+                return _fallback_result(self._failed(guard, error))
+            self._succeeded(guard, attempts[winner] == "hedged")
+            return winner.result()
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            guard, refused = self._start()
+            if refused:
+                return _fallback_result(refused)
+            deadline = time.monotonic() + LLM_DEADLINE_SECONDS
+            if not await get_rate_limiter().aacquire(LLM_DEADLINE_SECONDS):
+                _bump("rate_limited")
+                return _fallback_result("rate_limited")
+            hedge_at = self._hedge_at(guard)
+            attempts = {}
+
+            def launch(kind="first"):
+                started = time.perf_counter()
+                task = asyncio.ensure_future(self.inner._agenerate(messages, stop=stop, **kwargs))
+                # Cancelled attempts (losing hedges) are skipped; their short runs would drag the p95 down
+                task.add_done_callback(
+                    lambda t: not t.cancelled() and t.exception() is None and guard.observe(time.perf_counter() - started)
+                )
+                attempts[task] = kind
+                return task
+
+            pending = {launch()}
+            winner = error = None
+            try:
+                while pending and winner is None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    timeout = remaining if hedge_at is None else min(remaining, max(hedge_at - time.monotonic(), 0))
+                    done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            winner = task
+                            break
+                        error = task.exception()
+                    if winner is None:
+                        hedge_due = hedge_at is not None and time.monotonic() >= hedge_at
+                        if hedge_due:
+                            hedge_at = None
+                        kind = self._another_attempt(attempts, bool(done), hedge_due)
+                        if kind:
+                            pending.add(launch(kind))
+            finally:
+                for task in pending:
+                    task.cancel()
+            if winner is None:
+                return _fallback_result(self._failed(guard, error))
+            self._succeeded(guard, attempts[winner] == "hedged")
+            return winner.result()
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            # Streams aren't hedged; the deadline covers the first chunk, after which the caller is being answered
+            guard, refused = self._start()
+            if refused:
+                yield _fallback_chunk(refused)
+                return
+            deadline = time.monotonic() + LLM_DEADLINE_SECONDS
+            if not await get_rate_limiter().aacquire(LLM_DEADLINE_SECONDS):
+                _bump("rate_limited")
+                yield _fallback_chunk("rate_limited")
+                return
+            stream = self.inner._astream(messages, stop=stop, **kwargs)
+            try:
+                async with asyncio.timeout(deadline - time.monotonic()):
+                    first = await anext(stream, None)
+            except Exception as exc:
+                await stream.aclose()
+                reason = self._failed(guard, None if isinstance(exc, TimeoutError) else exc)
+                yield _fallback_chunk(reason)
+                return
+            if first is not None:
+                yield first
+                try:
+                    async for chunk in stream:
+                        yield chunk
+                except Exception as exc:
+                    self._failed(guard, exc)
+                    raise
+            self._succeeded(guard, False)
+
+    return ResilientChatModel
+
+def metrics():
+    with _stats_lock:
+        metrics = dict(stats)
+    with _guards_lock:
+        guards = dict(_guards)
+    metrics["breaker_open"] = {model: int(guard.breaker.state != CLOSED) for model, guard in guards.items()}
+    metrics["hedge_delay_seconds"] = {model: guard.hedge_delay() or 0.0 for model, guard in guards.items()}
+    return metrics
+
+register_source("bot_llm_client", metrics, counters=stats,
+                labels={"breaker_open": "model", "hedge_delay_seconds": "model"})
+
+async def _run_against_mock(args):
+    from clients import get_llm
+    from langchain_core.messages import HumanMessage
+    # The clients module wraps models with the imported llm_client, not this __main__ copy
+    from llm_client import is_fallback
+    llm = get_llm()
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    answers = {"answered": 0, "fallback": 0}
+
+    async def call(i):
+        async with slots:
+            started = time.perf_counter()
+            message = await llm.ainvoke([HumanMessage(content=f"Is the provider in network? ({i})")])
+            latencies.append(time.perf_counter() - started)
+            answers["fallback" if is_fallback(message) else "answered"] += 1
+
+    await asyncio.gather(*(call(i) for i in range(args.calls)))
+    latencies.sort()
+    return {
+        **answers,
+        "p50": round(latencies[len(latencies) // 2], 4),
+        "p95": round(latencies[int(len(latencies) * 0.95)], 4),
+        "p99": round(latencies[int(len(latencies) * 0.99)], 4),
+        "max": round(latencies[-1], 4),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exercise the resilient LLM client against a local mock OpenAI server.")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server response time")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="fraction of responses that take --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=2.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of responses that are HTTP 500s")
+    args = parser.parse_args()
+    from fakes import MockOpenAIServer
+    with MockOpenAIServer(args.latency, args.slow_rate, args.slow_latency, args.error_rate) as server:
+        os.environ["OPENAI_BASE_URL"] = server.base_url
+        os.environ.setdefault("OPENAI_API_KEY", "mock")
+        result = asyncio.run(_run_against_mock(args))
+        result["server_requests"] = server.requests
+    import llm_client
+    print(json.dumps({"calls": result, "llm_client": llm_client.metrics()}, indent=2))
@@ -0,0 +1,213 @@
+import argparse
+import ast
+import csv
+import glob
+import gzip
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from clients import lazy
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Daily member batch files (.jsonl or .csv, optionally .gz); glob patterns separated by os.pathsep
+MEMBER_BATCH_PATHS = os.environ.get("MEMBER_BATCH_PATHS", "")
+
+# Fields of a member payload as sent by the call scheduler
+MEMBER_FIELDS = (
+    "CalleeType", "Priority", "Utterances", "cptCode", "benefitCoverageServiceType", "benefitCoverageType",
+    "birthDate", "callLogCollectionName", "callPurpose", "callSessionCollectionName", "callbackNumber",
+    "calleeName", "callee_number", "customersCollectionName", "data", "date", "date_priority",
+    "diagnosisCode", "extensionNumber", "gender", "healthPlanNumber", "healthPlanTypePrimary",
+    "healthPlanTypeSecondary", "insurancePlanType", "localInsurance", "memberCity", "memberDob",
+    "memberFirstName", "memberGroupNumber", "memberId", "memberLastName", "memberPhoneNumber",
+    "memberSecondaryFirstName", "memberSecondaryGroupNumber", "memberSecondaryId", "memberSecondaryLastName",
+    "memberSecondaryMiddleName", "memberSecondaryRelationship", "memberSsn", "memberState", "memberStreet",
+    "memberZipcode", "payorGreetingValue", "payorName", "payorPhoneNumber", "payorProviderRelation",
+    "placeCategory", "placeType", "planType", "prior_authorization_field", "providerClinicAddress",
+    "providerClinicName", "providerFacilityName", "providerFaciltiyAddress", "providerFaxNumber",
+    "providerFirstName", "providerGeneralType", "providerId", "providerLastName", "providerMiddleName",
+    "providerNpi", "providerPhoneNumber", "providerPhoneNumberType", "providerSpecificType", "providerNpiId",
+    "providerState", "providerStreet", "providerTaxId", "providerZipcode", "purposeCollectionName", "reason",
+    "requiredCoverageAbsolutes", "resourceType", "serviceType", "time", "time_priority",
+    "batchRequestDocumentId", "created_date", "call_count", "callDocumentId", "callLogDocumentId",
+    "callRequestDocumentId", "customerDocumentId", "memberMiddleName",
+)
+# Fields holding JSON or Python-literal blobs; parsed once at load instead of by the LLM each turn
+NESTED_FIELDS = ("data", "diagnosisCode", "requiredCoverageAbsolutes", "serviceType")
+# Lookup keys, in the order a webhook's parameters are checked
+INDEXED_FIELDS = ("memberId", "customerDocumentId")
+# A batch request covers many members, so it indexes a list and never resolves a single member
+BATCH_FIELD = "batchRequestDocumentId"
+_FIELD_SET = frozenset(MEMBER_FIELDS)
+
+def parse_nested(value):
+    if not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return value
+
+class MemberRecord:
+    """One member payload; unset slots stand for empty fields, unknown fields go to `extra`."""
+
+    __slots__ = MEMBER_FIELDS + ("extra",)
+
+    def __init__(self, raw, parsed=None):
+        self.extra = None
+        for field, value in raw.items():
+            if value is None or value == "":
+                continue
+            if field in NESTED_FIELDS:
+                # Batches repeat the same blobs; parse each distinct one once and share the result
+                if parsed is None or not isinstance(value, str):
+                    value = parse_nested(value)
+                else:
+                    if value not in parsed:
+                        parsed[value] = parse_nested(value)
+                    value = parsed[value]
+            elif isinstance(value, str):
+                # Plan, payor and provider values repeat across a batch; share one copy
+                value = sys.intern(value)
+            if field in _FIELD_SET:
+                setattr(self, field, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[field] = value
+
+    def get(self, field, default=None):
+        if field in _FIELD_SET:
+            return getattr(self, field, default)
+        return (self.extra or {}).get(field, default)
+
+    def to_payload(self):
+        """The record as the payload dict the prompt builder and fast path expect.
+
+        Parsed nested values may be shared between records, so treat them as read-only.
+        """
+        payload = {field: getattr(self, field) for field in MEMBER_FIELDS if hasattr(self, field)}
+        if self.extra:
+            payload.update(self.extra)
+        return payload
+
+def iter_member_rows(paths):
+    """Stream raw member dicts from .jsonl / .csv batch files (optionally gzipped)."""
+    for path in paths:
+        name = path[:-3] if path.endswith('.gz') else path
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8', newline='') as f:
+            if name.endswith('.csv'):
+                yield from csv.DictReader(f)
+            else:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield json.loads(line)
+
+def expand_paths(patterns):
+    paths = []
+    for pattern in patterns:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    return paths
+
+class MemberStore:
+    """Members of the current batch with O(1) lookup by memberId or customerDocumentId.
+
+    batchRequestDocumentId lists the members of each batch request.
+    """
+
+    def __init__(self):
+        self._records = []
+        self._indexes = {field: {} for field in INDEXED_FIELDS}
+        # batchRequestDocumentId -> {memberId: record}, in load order
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def load(self, paths, replace=True):
+        """Load batch files; by default the new batch replaces the current one in a single swap."""
+        started = time.perf_counter()
+        with self._lock:
+            records = [] if replace else list(self._records)
+            indexes = {field: {} if replace else dict(index) for field, index in self._indexes.items()}
+            batches = {} if replace else {key: dict(members) for key, members in self._batches.items()}
+        parsed = {}
+        for row in iter_member_rows(paths):
+            record = MemberRecord(row, parsed)
+            records.append(record)
+            for field, index in indexes.items():
+                key = record.get(field)
+                if key is not None:
+                    # A later row for the same member supersedes the earlier one
+                    index[str(key).strip()] = record
+            batch_id = record.get(BATCH_FIELD)
+            if batch_id is not None:
+                members = batches.setdefault(str(batch_id).strip(), {})
+                members[str(record.get("memberId", len(members))).strip()] = record
+        with self._lock:
+            self._records = records
+            self._indexes = indexes
+            self._batches = batches
+        logger.info(f"Loaded {len(records)} members from {len(paths)} files in {time.perf_counter() - started:.2f}s")
+        return len(records)
+
+    def get(self, key, field="memberId"):
+        return self._indexes[field].get(str(key).strip())
+
+    def batch_members(self, batch_id):
+        """All members of a batch request, in load order; empty when the batch isn't loaded."""
+        return list(self._batches.get(str(batch_id).strip(), {}).values())
+
+    def lookup(self, parameters):
+        """Find the member a webhook call is about from its session parameters."""
+        for field in INDEXED_FIELDS:
+            key = parameters.get(field)
+            if key:
+                record = self.get(key, field)
+                if record is not None:
+                    return record
+        return None
+
+    def metrics(self):
+        return {
+            "members": len(self._records),
+            **{f"{field}_keys": len(index) for field, index in self._indexes.items()},
+            f"{BATCH_FIELD}_keys": len(self._batches),
+        }
+
+@lazy
+def get_member_store():
+    # Loaded on first use so importing the webhook stays cheap
+    store = MemberStore()
+    patterns = [pattern for pattern in MEMBER_BATCH_PATHS.split(os.pathsep) if pattern]
+    if patterns:
+        store.load(expand_paths(patterns))
+    return store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load member batch files and report size and lookup cost.")
+    parser.add_argument("paths", nargs="+", help="member batch files (.jsonl or .csv, optionally .gz)")
+    parser.add_argument("--lookup", help="print the payload for this memberId / document ID")
+    parser.add_argument("--batch", help="print the memberIds in this batch request")
+    args = parser.parse_args()
+    store = MemberStore()
+    store.load(expand_paths(args.paths))
+    print(json.dumps(store.metrics()))
+    if args.lookup:
+        record = store.lookup({field: args.lookup for field in INDEXED_FIELDS})
+        print(json.dumps(record.to_payload() if record else None, indent=2, default=str))
+    if args.batch:
+        print(json.dumps([record.get("memberId") for record in store.batch_members(args.batch)]))
@@ -0,0 +1,227 @@
+import bisect
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+# Sampled traces go to their own logger as one JSON object per line
+trace_logger = logging.getLogger("traces")
+
+# Fraction of requests whose full trace is logged; requests slower than TRACE_SLOW_SECONDS always are
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_SECONDS = float(os.environ.get("TRACE_SLOW_SECONDS", "2.0"))
+
+# Histogram buckets in seconds, from a fast-path lookup up to the webhook deadline
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_sources = []
+_help = {}
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+def increment(name, value=1, help=None, **labels):
+    """Add to a Prometheus counter (name should end in _total)."""
+    key = _label_key(labels)
+    with _lock:
+        if help:
+            _help.setdefault(name, help)
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+def observe(name, value, help=None, **labels):
+    """Record a value in a latency histogram."""
+    key = _label_key(labels)
+    with _lock:
+        if help:
+            _help.setdefault(name, help)
+        series = _histograms.setdefault(name, {})
+        state = series.get(key)
+        if state is None:
+            state = series[key] = [[0] * len(LATENCY_BUCKETS), 0, 0.0]
+        index = bisect.bisect_left(LATENCY_BUCKETS, value)
+        if index < len(LATENCY_BUCKETS):
+            state[0][index] += 1
+        state[1] += 1
+        state[2] += value
+
+def register_source(prefix, source, counters=(), labels=None):
+    """Expose a component's metrics() dict as series named {prefix}_{key}, read at scrape time.
+
+    Fields in `counters` only ever grow and become counters named {prefix}_{key}_total;
+    the rest are gauges. Nested dicts become one series per key, labelled with
+    `labels[field]` (default `key`).
+    """
+    with _lock:
+        _sources.append((prefix, source, frozenset(counters), dict(labels or {})))
+
+class Trace:
+    """Spans and counters for one request, carried in a context variable."""
+
+    __slots__ = ("trace_id", "name", "attributes", "started", "spans", "counts")
+
+    def __init__(self, name, attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.spans = []
+        self.counts = {}
+
+    def add(self, counter, value=1):
+        self.counts[counter] = self.counts.get(counter, 0) + value
+
+    def to_dict(self, duration):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "duration_ms": round(duration * 1000, 3),
+            **self.attributes,
+            "counts": self.counts,
+            "spans": self.spans,
+        }
+
+@contextmanager
+def trace(name, **attributes):
+    """Root span of a request; nested span() calls in the same context attach to it."""
+    current = Trace(name, attributes)
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+        duration = time.perf_counter() - current.started
+        observe("bot_request_seconds", duration, help="Webhook request latency", route=name)
+        if duration >= TRACE_SLOW_SECONDS or random.random() < TRACE_SAMPLE_RATE:
+            trace_logger.info(json.dumps(current.to_dict(duration), default=str))
+
+@contextmanager
+def span(name, **attributes):
+    """Time a pipeline stage into bot_stage_seconds and the current trace, if any."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        observe("bot_stage_seconds", duration, help="Latency of each pipeline stage", stage=name)
+        current = _current_trace.get()
+        if current is not None:
+            current.spans.append({
+                "stage": name,
+                "start_ms": round((started - current.started) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+                **attributes,
+            })
+
+def count(counter, value=1, **labels):
+    """Increment bot_{counter}_total and the same count on the current trace."""
+    increment(f"bot_{counter}_total", value, **labels)
+    current = _current_trace.get()
+    if current is not None:
+        current.add(counter, value)
+
+def annotate(**attributes):
+    current = _current_trace.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+def record_llm_usage(model, prompt_tokens, completion_tokens):
+    count("llm_calls", model=model)
+    if prompt_tokens:
+        count("llm_prompt_tokens", prompt_tokens, model=model)
+    if completion_tokens:
+        count("llm_completion_tokens", completion_tokens, model=model)
+
+_usage_handler = None
+
+def llm_usage_handler():
+    """LangChain callback that records token usage reported by each LLM call."""
+    global _usage_handler
+    if _usage_handler is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class UsageHandler(BaseCallbackHandler):
+            # Run in the caller's context so counts land on the request's trace
+            run_inline = True
+
+            def on_llm_end(self, response, **kwargs):
+                output = response.llm_output or {}
+                usage = output.get("token_usage") or {}
+                record_llm_usage(output.get("model_name", "unknown"),
+                                 usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+
+        _usage_handler = UsageHandler()
+    return _usage_handler
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        counters = {name: dict(series) for name, series in _counters.items()}
+        histograms = {name: {key: (list(s[0]), s[1], s[2]) for key, s in series.items()} for name, series in _histograms.items()}
+        sources = list(_sources)
+        help_text = dict(_help)
+
+    for name, series in sorted(counters.items()):
+        if name in help_text:
+            lines.append(f"# HELP {name} {help_text[name]}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(series.items()):
+            lines.append(f"{name}{_format_labels(key)} {_format_number(value)}")
+
+    for name, series in sorted(histograms.items()):
+        if name in help_text:
+            lines.append(f"# HELP {name} {help_text[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, (buckets, total, total_sum) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS, buckets):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {total}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total_sum!r}")
+            lines.append(f"{name}_count{_format_labels(key)} {total}")
+
+    for prefix, source, source_counters, source_labels in sources:
+        try:
+            values = source()
+        except Exception:
+            logger.exception(f"Metrics source {prefix} failed")
+            continue
+        for field, value in sorted(values.items()):
+            kind = "counter" if field in source_counters else "gauge"
+            name = f"{prefix}_{field}_total" if kind == "counter" else f"{prefix}_{field}"
+            if isinstance(value, dict):
+                numeric = {k: v for k, v in value.items() if isinstance(v, (int, float)) and not isinstance(v, bool)}
+                if numeric:
+                    label = source_labels.get(field, "key")
+                    lines.append(f"# TYPE {name} {kind}")
+                    lines.extend(f"{name}{_format_labels(((label, k),))} {_format_number(v)}" for k, v in sorted(numeric.items()))
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {_format_number(value)}")
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
@@ -0,0 +1,196 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import register_source
+from response_cache import normalize_text
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# While the representative is answering, the model answer to the question they most
+# likely ask next is generated in the background and served if that's what they ask
+PREFETCH_ENABLED = os.environ.get("PREFETCH_ENABLED", "true").lower() == "true"
+# Only speculate once a flow position has this many turns and one question makes up this share of them
+PREFETCH_MIN_OBSERVATIONS = int(os.environ.get("PREFETCH_MIN_OBSERVATIONS", "20"))
+PREFETCH_MIN_SHARE = float(os.environ.get("PREFETCH_MIN_SHARE", "0.5"))
+PREFETCH_MAX_CANDIDATES = int(os.environ.get("PREFETCH_MAX_CANDIDATES", "50"))
+PREFETCH_TTL_SECONDS = float(os.environ.get("PREFETCH_TTL_SECONDS", "120"))
+PREFETCH_MAX_SESSIONS = int(os.environ.get("PREFETCH_MAX_SESSIONS", "10000"))
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", "4"))
+
+class NextTurnModel:
+    """What representatives said first after the flow reached each position, to predict that turn.
+
+    Every such turn counts toward its position's total; only turns that needed a
+    model answer are candidates, keyed by normalized text.
+    """
+
+    def __init__(self, min_observations=PREFETCH_MIN_OBSERVATIONS, min_share=PREFETCH_MIN_SHARE,
+                 max_candidates=PREFETCH_MAX_CANDIDATES):
+        self.min_observations = min_observations
+        self.min_share = min_share
+        self.max_candidates = max_candidates
+        # position -> [turns, Counter(normalized text), {normalized text: text as first seen}]
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def observe(self, position, text, needs_model):
+        with self._lock:
+            entry = self._positions.get(position)
+            if entry is None:
+                entry = self._positions[position] = [0, Counter(), {}]
+            entry[0] += 1
+            if not needs_model:
+                return
+            key = normalize_text(text)
+            entry[1][key] += 1
+            entry[2].setdefault(key, text)
+            if len(entry[1]) > 2 * self.max_candidates:
+                # Keep the common questions; one-off ones would never be predicted anyway
+                entry[1] = Counter(dict(entry[1].most_common(self.max_candidates)))
+                entry[2] = {key: entry[2][key] for key in entry[1]}
+
+    def predict(self, position):
+        """The question most likely asked next at this position, or None when no guess is good enough."""
+        with self._lock:
+            entry = self._positions.get(position)
+            if entry is None or entry[0] < self.min_observations or not entry[1]:
+                return None
+            key, seen = entry[1].most_common(1)[0]
+            if seen / entry[0] < self.min_share:
+                return None
+            return entry[2][key]
+
+    def __len__(self):
+        return len(self._positions)
+
+class Slot:
+    """The first turn expected at a flow position, with the reply speculatively generated for it, if any."""
+
+    __slots__ = ("position", "key", "future", "started", "finished", "expires", "settled")
+
+    def __init__(self, position, expires):
+        self.position = position
+        self.key = None
+        self.future = None
+        self.started = None
+        self.finished = None
+        self.expires = expires
+        self.settled = False
+
+class Prefetcher:
+    """One slot per session for the turn after the flow moved on, filled on a small thread pool.
+
+    Each turn claim()s the slot its predecessor schedule()d, tries to serve() from
+    it once scripted answers are ruled out, and finish()es it, which also teaches
+    the model what was said at that position.
+    """
+
+    def __init__(self, model=None, ttl_seconds=PREFETCH_TTL_SECONDS, max_sessions=PREFETCH_MAX_SESSIONS,
+                 workers=PREFETCH_WORKERS):
+        self.model = model or NextTurnModel()
+        self.ttl_seconds = ttl_seconds
+        self.max_sessions = max_sessions
+        self.workers = workers
+        self._slots = OrderedDict()
+        self._executor = None
+        self._lock = threading.Lock()
+        self.stats = {"scheduled": 0, "no_prediction": 0, "hits": 0, "misses": 0, "late": 0, "failed": 0,
+                      "expired": 0, "latency_saved_seconds": 0.0}
+
+    def _submit(self, generate, text):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch")
+        return self._executor.submit(generate, text)
+
+    def _settle(self, slot, outcome):
+        if slot.future is None or slot.settled:
+            return
+        slot.settled = True
+        # A speculative call already running is left to finish; cancel only stops queued ones
+        slot.future.cancel()
+        with self._lock:
+            self.stats[outcome] += 1
+
+    def schedule(self, session_id, position, generate):
+        """Open the session's slot for `position` and speculatively answer the question predicted there.
+
+        `generate(text)` returns the reply message to `text` from the session's
+        current context, or None when it has no usable answer.
+        """
+        slot = Slot(position, time.monotonic() + self.ttl_seconds)
+        predicted = self.model.predict(position)
+        if predicted is not None:
+            slot.key = normalize_text(predicted)
+            slot.started = time.monotonic()
+            slot.future = self._submit(generate, predicted)
+            slot.future.add_done_callback(lambda _: setattr(slot, "finished", time.monotonic()))
+        replaced = []
+        with self._lock:
+            self.stats["scheduled" if predicted is not None else "no_prediction"] += 1
+            replaced.append(self._slots.pop(session_id, None))
+            self._slots[session_id] = slot
+            while len(self._slots) > self.max_sessions:
+                replaced.append(self._slots.popitem(last=False)[1])
+        for old in replaced:
+            if old is not None:
+                self._settle(old, "expired")
+
+    def claim(self, session_id):
+        """Take the session's slot for this turn; None when the turn isn't the first at a new position."""
+        with self._lock:
+            slot = self._slots.pop(session_id, None)
+        if slot is not None and time.monotonic() > slot.expires:
+            self._settle(slot, "expired")
+            return None
+        return slot
+
+    def serve(self, slot, text):
+        """The prefetched reply if the slot predicted `text` and it is ready."""
+        if slot is None or slot.future is None or slot.settled:
+            return None
+        arrived = time.monotonic()
+        if normalize_text(text) != slot.key:
+            self._settle(slot, "misses")
+            return None
+        if not slot.future.done():
+            # Right guess, but the representative was quicker than the model
+            self._settle(slot, "late")
+            return None
+        try:
+            message = slot.future.result()
+        except Exception:
+            logger.exception(f"Prefetch for {slot.position} failed")
+            message = None
+        if message is None:
+            self._settle(slot, "failed")
+            return None
+        slot.settled = True
+        with self._lock:
+            self.stats["hits"] += 1
+            self.stats["latency_saved_seconds"] += min(slot.finished or arrived, arrived) - slot.started
+        return message
+
+    def finish(self, slot, text, needs_model):
+        if slot is None:
+            return
+        # Answered before serve() was reached (e.g. by the script), so not the predicted question
+        self._settle(slot, "misses")
+        self.model.observe(slot.position, text, needs_model)
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self.stats, slots=len(self._slots), positions=len(self.model))
+        claimed = metrics["hits"] + metrics["misses"] + metrics["late"] + metrics["failed"]
+        metrics["hit_rate"] = metrics["hits"] / claimed if claimed else 0.0
+        metrics["avg_latency_saved_seconds"] = metrics["latency_saved_seconds"] / metrics["hits"] if metrics["hits"] else 0.0
+        return metrics
+
+prefetcher = Prefetcher()
+register_source("bot_prefetch", prefetcher.metrics, counters=prefetcher.stats)
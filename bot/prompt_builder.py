@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+import re
+import threading
+from metrics import count, register_source
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Token budget for the replayed chat history on each turn
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "1200"))
+# Long member field values (JSON blobs) are cut to this many characters
+MAX_FIELD_CHARS = int(os.environ.get("MAX_FIELD_CHARS", "400"))
+TOKENIZER_MODEL = os.environ.get("TOKENIZER_MODEL", "gpt-4")
+
+# Member fields grouped by what a question is about, with the words that signal it
+FIELD_GROUPS = {
+    "name": (r"\bnames?\b|\bcalled\b|\bspell", ["memberFirstName", "memberMiddleName", "memberLastName"]),
+    "dob": (r"\bdob\b|birth|\bborn\b|\bage\b", ["memberDob"]),
+    "member_id": (r"member\s*id|subscriber|\bid\b|policy", ["memberId"]),
+    "group": (r"\bgroup\b", ["memberGroupNumber"]),
+    "npi": (r"\bnpi\b", ["providerNpi"]),
+    "tax_id": (r"\btax\b|\btin\b|\bein\b", ["providerTaxId"]),
+    "provider": (r"provider|doctor|\bdr\b|physician|clinic|facility|specialist|chiropractor",
+                 ["providerFirstName", "providerMiddleName", "providerLastName", "providerClinicName",
+                  "providerClinicAddress", "providerSpecificType", "providerGeneralType", "providerPhoneNumber"]),
+    "address": (r"address|street|\bzip|postal|\bcity\b|\bstate\b|live",
+                ["memberStreet", "memberCity", "memberState", "memberZipcode"]),
+    "phone": (r"phone|callback|call back|contact|\bnumber\b", ["memberPhoneNumber", "callbackNumber"]),
+    "ssn": (r"\bssn\b|social security", ["memberSsn"]),
+    "gender": (r"gender|\bsex\b|\bmale\b|\bfemale\b", ["gender"]),
+    "plan": (r"\bplan\b|insurance|payor|payer|medicare|network",
+             ["planType", "insurancePlanType", "healthPlanNumber", "payorName", "payorProviderRelation"]),
+    "secondary": (r"secondary|spouse|dependent", [
+        "memberSecondaryFirstName", "memberSecondaryMiddleName", "memberSecondaryLastName",
+        "memberSecondaryId", "memberSecondaryGroupNumber", "memberSecondaryRelationship"]),
+    "diagnosis": (r"diagnos|\bicd\b|\bdx\b", ["diagnosisCode"]),
+    "service": (r"\bcpt\b|\bcode\b|procedure|service|treatment|benefit",
+                ["cptCode", "serviceType", "benefitCoverageServiceType", "benefitCoverageType"]),
+    "coverage": (r"copay|co-pay|deductible|coinsurance|out of pocket|out-of-pocket|maximum|visit",
+                 ["requiredCoverageAbsolutes"]),
+    "place": (r"\bplace\b|outpatient|inpatient|location", ["placeType", "placeCategory"]),
+}
+
+# Fields always sent for a stage, whatever the question
+STAGE_FIELDS = {
+    "authentication": ["memberFirstName", "memberLastName", "memberDob", "memberId", "cptCode"],
+    "coverage_flow": ["memberFirstName", "memberLastName", "memberId", "cptCode", "serviceType",
+                      "benefitCoverageServiceType", "benefitCoverageType", "diagnosisCode"],
+}
+
+# Stages whose prompts need the list of coverage flow questions
+COVERAGE_STAGES = {"coverage_flow"}
+
+_FIELD_PATTERNS = [(re.compile(pattern, re.IGNORECASE), fields) for pattern, fields in FIELD_GROUPS.values()]
+
+# Running totals reported by token_metrics()
+token_stats = {"turns": 0, "prompt_tokens": 0, "history_messages_dropped": 0}
+_stats_lock = threading.Lock()
+
+_encoder = None
+
+def count_tokens(text):
+    """Count tokens with tiktoken when available, otherwise estimate at ~4 characters per token."""
+    global _encoder
+    if _encoder is None:
+        try:
+            import tiktoken
+            _encoder = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+        except Exception:
+            _encoder = False
+    if _encoder:
+        return len(_encoder.encode(text))
+    return len(text) // 4 + 1
+
+def count_message_tokens(messages):
+    # Roughly 4 tokens of per-message overhead in the chat format
+    return sum(count_tokens(str(message.content)) + 4 for message in messages)
+
+def select_member_fields(question, payload_data, stage="authentication"):
+    """Pick the member fields relevant to the question plus the stage's base fields."""
+    selected = list(STAGE_FIELDS.get(stage, STAGE_FIELDS["authentication"]))
+    for pattern, fields in _FIELD_PATTERNS:
+        if pattern.search(question):
+            selected.extend(fields)
+    return {field: payload_data[field] for field in dict.fromkeys(selected) if payload_data.get(field) not in (None, "")}
+
+def format_member_details(fields):
+    lines = []
+    for field, value in fields.items():
+        # Nested fields arrive parsed from the member store; render them as compact JSON
+        value = json.dumps(value) if isinstance(value, (dict, list)) else str(value).strip()
+        if len(value) > MAX_FIELD_CHARS:
+            value = value[:MAX_FIELD_CHARS] + "..."
+        lines.append(f"{field}: {value}")
+    return "\n".join(lines)
+
+def build_member_context(question, payload_data, stage="authentication"):
+    """Compact member details for the prompt instead of the full payload dict."""
+    return format_member_details(select_member_fields(question, payload_data, stage))
+
+def coverage_questions_for_stage(coverage_flow_questions, stage):
+    if stage not in COVERAGE_STAGES:
+        return "(not needed yet)"
+    if not coverage_flow_questions:
+        return "(none pending)"
+    return "\n".join(f"- {question}" for question in coverage_flow_questions)
+
+def trim_history(messages, budget=HISTORY_TOKEN_BUDGET):
+    """Keep the newest messages that fit in the token budget, plus a leading system message."""
+    messages = list(messages)
+    pinned = []
+    if messages and messages[0].type == "system":
+        pinned = [messages.pop(0)]
+    kept = []
+    used = count_message_tokens(pinned)
+    for message in reversed(messages):
+        cost = count_message_tokens([message])
+        if used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+    dropped = len(messages) - len(kept)
+    if dropped:
+        from langchain_core.messages import SystemMessage
+        with _stats_lock:
+            token_stats["history_messages_dropped"] += dropped
+        pinned.append(SystemMessage(content=f"({dropped} earlier messages of this call omitted)"))
+    return pinned + kept[::-1]
+
+def history_trimmer(history_key, budget=HISTORY_TOKEN_BUDGET):
+    """Runnable step that trims the history injected by RunnableWithMessageHistory."""
+    from langchain_core.runnables import RunnableLambda
+
+    def _trim(inputs):
+        return {**inputs, history_key: trim_history(inputs.get(history_key, []), budget)}
+    return RunnableLambda(_trim)
+
+def prompt_token_counter():
+    """Runnable step placed after the prompt template that records prompt tokens for the turn."""
+    from langchain_core.runnables import RunnableLambda
+
+    def _count(prompt_value):
+        tokens = count_message_tokens(prompt_value.to_messages())
+        with _stats_lock:
+            token_stats["turns"] += 1
+            token_stats["prompt_tokens"] += tokens
+        # Counted, not logged: per-turn logging of prompt details stays off the hot path
+        count("prompt_tokens_estimated", tokens)
+        logger.debug(f"Prompt tokens this turn: {tokens}")
+        return prompt_value
+    return RunnableLambda(_count)
+
+def token_metrics():
+    with _stats_lock:
+        metrics = dict(token_stats)
+    metrics["avg_prompt_tokens"] = metrics["prompt_tokens"] / metrics["turns"] if metrics["turns"] else 0.0
+    return metrics
+
+register_source("bot_prompt", token_metrics, counters=token_stats)
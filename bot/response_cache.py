@@ -0,0 +1,188 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from metrics import register_source
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "5000"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+# Optional SQLite file shared by the workers on one host
+RESPONSE_CACHE_DB_PATH = os.environ.get("RESPONSE_CACHE_DB_PATH")
+# Tags whose turns depend on conversation state and must never be served from cache
+RESPONSE_CACHE_DISABLED_TAGS = set(
+    tag.strip() for tag in os.environ.get("RESPONSE_CACHE_DISABLED_TAGS", "coverage_flow").split(",") if tag.strip()
+)
+
+# Turns that refer back to the conversation can't be answered from a cache
+CONTEXT_DEPENDENT_PATTERN = re.compile(
+    r"\b(?:it|that|again|repeat|previous|earlier|above|same|last one|you said)\b", re.IGNORECASE
+)
+FILLER_PATTERN = re.compile(r"^(?:(?:hi|hello|hey|ok|okay|please|so|and|um|uh)\b\s*)+")
+# Only standalone questions are shared across callers; replies like "Yes" mean something different in every call
+QUESTION_FORM_PATTERN = re.compile(
+    r"\?\s*$|^\W*(?:what|which|who|whom|whose|when|where|why|how|is|are|was|were|do|does|did|can|could|will|would"
+    r"|should|shall|may|have|has|had)\b",
+    re.IGNORECASE,
+)
+CONFIRMATION_WORDS = frozenset((
+    "yes", "yeah", "yep", "no", "nope", "ok", "okay", "sure", "right", "correct", "fine", "thanks", "thank",
+    "you", "confirm", "confirmed", "please", "hi", "hello", "hey", "so", "and", "um", "uh", "alright", "great",
+))
+# Words a question needs beyond confirmations to stand on its own
+RESPONSE_CACHE_MIN_WORDS = int(os.environ.get("RESPONSE_CACHE_MIN_WORDS", "3"))
+
+def normalize_text(text):
+    """Lowercase, drop punctuation and leading filler words, collapse whitespace."""
+    text = re.sub(r"[^\w\s/-]", " ", text.lower().replace("'", ""))
+    text = re.sub(r"\s+", " ", text).strip()
+    return FILLER_PATTERN.sub("", text)
+
+def fingerprint(data):
+    """Stable hash of the payload fields (or any JSON-able data) an answer depends on."""
+    encoded = json.dumps(data, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+def build_key(text, stage, data_fingerprint):
+    raw = f"{stage}\x1f{normalize_text(text)}\x1f{data_fingerprint}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def is_standalone_question(text):
+    if not QUESTION_FORM_PATTERN.search(text):
+        return False
+    words = [word for word in normalize_text(text).split() if word not in CONFIRMATION_WORDS]
+    return len(words) >= RESPONSE_CACHE_MIN_WORDS
+
+def is_cacheable(text, tag):
+    return (
+        tag not in RESPONSE_CACHE_DISABLED_TAGS
+        and not CONTEXT_DEPENDENT_PATTERN.search(text)
+        and is_standalone_question(text)
+    )
+
+class SqliteCacheBackend:
+    """Shared on-disk tier; entries carry an absolute expiry time."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=1.0)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (time.time(),))
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ? AND expires_at >= ?",
+                (key, time.time()),
+            ).fetchone()
+        return row
+
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+
+class ResponseCache:
+    """LRU + TTL cache of LLM responses with an optional shared disk tier."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS, backend=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Moving average of what a miss costs, used to estimate time saved by hits
+        self._avg_miss_latency = {}
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "evictions": 0,
+                      "saved_seconds": 0.0}
+
+    def get(self, key, stage="default"):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at >= now:
+                    self._entries.move_to_end(key)
+                    self._record_hit(stage)
+                    return value
+                del self._entries[key]
+
+        if self.backend is not None:
+            try:
+                row = self.backend.get(key)
+            except sqlite3.Error:
+                logger.exception("Response cache disk lookup failed")
+                row = None
+            if row is not None:
+                with self._lock:
+                    self._store(key, row[0], row[1])
+                    self.stats["disk_hits"] += 1
+                    self._record_hit(stage)
+                return row[0]
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def put(self, key, value, stage="default", latency=None, ttl_seconds=None):
+        """Cache a response; `latency` is how long computing it took."""
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        with self._lock:
+            self._store(key, value, expires_at)
+            if latency is not None:
+                previous = self._avg_miss_latency.get(stage)
+                self._avg_miss_latency[stage] = latency if previous is None else 0.9 * previous + 0.1 * latency
+        if self.backend is not None:
+            try:
+                self.backend.put(key, value, expires_at)
+            except sqlite3.Error:
+                logger.exception("Response cache disk write failed")
+
+    def bypass(self):
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self.stats)
+            metrics["entries"] = len(self._entries)
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        return metrics
+
+    def _store(self, key, value, expires_at):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _record_hit(self, stage):
+        self.stats["hits"] += 1
+        self.stats["saved_seconds"] += self._avg_miss_latency.get(stage, 0.0)
+
+def create_default_cache():
+    backend = SqliteCacheBackend(RESPONSE_CACHE_DB_PATH) if RESPONSE_CACHE_DB_PATH else None
+    return ResponseCache(backend=backend)
+
+# Process-wide cache shared by the bot modules
+response_cache = create_default_cache()
+register_source("bot_response_cache", response_cache.metrics, counters=response_cache.stats)
@@ -0,0 +1,98 @@
+import json
+import os
+import re
+import threading
+from clients import DEFAULT_MODEL, get_llm
+from metrics import observe, register_source
+
+# Model tiers. "rules" turns are answered by the coverage flow, fast path, tariff
+# table or response cache and never reach a model.
+RULES_TIER = "rules"
+SMALL_TIER = "small"
+LARGE_TIER = "large"
+SMALL_MODEL = os.environ.get("LLM_SMALL_MODEL", "gpt-4o-mini")
+LARGE_MODEL = DEFAULT_MODEL
+TIER_MODELS = {SMALL_TIER: SMALL_MODEL, LARGE_TIER: LARGE_MODEL}
+
+# Set ROUTER_ENABLED=false to send every model turn to the large model
+ROUTER_ENABLED = os.environ.get("ROUTER_ENABLED", "true").lower() == "true"
+# Longer turns, and every turn in these stages (e.g. coverage_flow), go to the large model
+ROUTER_SMALL_MAX_WORDS = int(os.environ.get("ROUTER_SMALL_MAX_WORDS", "20"))
+ROUTER_LARGE_STAGES = {stage for stage in os.environ.get("ROUTER_LARGE_STAGES", "").split(",") if stage}
+
+# USD per 1K (prompt, completion) tokens; ROUTER_PRICES takes a JSON object to override
+MODEL_PRICES = {
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+}
+MODEL_PRICES.update({model: tuple(price) for model, price in json.loads(os.environ.get("ROUTER_PRICES", "{}")).items()})
+
+# Reasoning, comparisons and policy questions need the large model even when short
+COMPLEX_TURN_PATTERN = re.compile(
+    r"\b(?:why|explain|compare|difference|whether|if|both|unless|except|"
+    r"medical\s+necessity|prior\s+auth\w*|appeal|denied|denial|exclusion)\b",
+    re.IGNORECASE,
+)
+
+TIERS = (RULES_TIER, SMALL_TIER, LARGE_TIER)
+stats = {name: {tier: 0 for tier in TIERS} for name in ("turns", "seconds", "prompt_tokens", "completion_tokens", "cost_usd")}
+_stats_lock = threading.Lock()
+
+def route(stage, text):
+    """Pick the model tier for a turn the rules couldn't answer, from its stage and complexity."""
+    if not ROUTER_ENABLED or stage in ROUTER_LARGE_STAGES:
+        return LARGE_TIER
+    if len(text.split()) > ROUTER_SMALL_MAX_WORDS or text.count("?") > 1 or COMPLEX_TURN_PATTERN.search(text):
+        return LARGE_TIER
+    return SMALL_TIER
+
+def tiered_llm(**kwargs):
+    """The large model, switchable to the small one per call with route_config()."""
+    from langchain_core.runnables import ConfigurableField
+    return get_llm(LARGE_MODEL, **kwargs).configurable_alternatives(
+        ConfigurableField(id="model_tier"),
+        default_key=LARGE_TIER,
+        **{SMALL_TIER: get_llm(SMALL_MODEL, **kwargs)},
+    )
+
+def route_config(session_id, tier):
+    return {"configurable": {"session_id": session_id, "model_tier": tier}}
+
+def _usage(message):
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    return token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+def record(tier, seconds, message=None):
+    """Account one turn's latency and, for model tiers, its token usage and cost."""
+    prompt_tokens, completion_tokens = _usage(message) if message is not None else (0, 0)
+    cost = estimate_cost(TIER_MODELS.get(tier), prompt_tokens, completion_tokens) if tier in TIER_MODELS else 0.0
+    with _stats_lock:
+        stats["turns"][tier] += 1
+        stats["seconds"][tier] += seconds
+        stats["prompt_tokens"][tier] += prompt_tokens
+        stats["completion_tokens"][tier] += completion_tokens
+        stats["cost_usd"][tier] += cost
+    observe("bot_tier_seconds", seconds, help="Turn latency by model tier", tier=tier)
+
+def metrics():
+    with _stats_lock:
+        metrics = {name: dict(values) for name, values in stats.items()}
+    metrics["avg_seconds"] = {
+        tier: metrics["seconds"][tier] / metrics["turns"][tier] if metrics["turns"][tier] else 0.0 for tier in TIERS
+    }
+    total = sum(metrics["turns"].values())
+    metrics["share"] = {tier: metrics["turns"][tier] / total if total else 0.0 for tier in TIERS}
+    return metrics
+
+register_source("bot_router", metrics, counters=stats,
+                labels={field: "tier" for field in (*stats, "avg_seconds", "share")})
@@ -0,0 +1,361 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from metrics import register_source
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# In-memory tier: how many sessions to keep and for how long after last use
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", "3600"))
+# Independently locked LRU shards; concurrent sessions only contend within a shard
+SESSION_SHARDS = int(os.environ.get("SESSION_SHARDS", "16"))
+# Per-session caps; the oldest non-system messages are dropped first
+SESSION_MAX_MESSAGES = int(os.environ.get("SESSION_MAX_MESSAGES", "50"))
+SESSION_MAX_BYTES = int(os.environ.get("SESSION_MAX_BYTES", "32768"))
+# Optional on-disk tier so a restarted worker can resume a session
+SESSION_DB_PATH = os.environ.get("SESSION_DB_PATH")
+SESSION_DB_RETENTION_SECONDS = float(os.environ.get("SESSION_DB_RETENTION_SECONDS", "86400"))
+
+def _message_size(message):
+    return len(str(message.content).encode("utf-8"))
+
+def _is_system(message):
+    return message.type == "system"
+
+class BoundedChatMessageHistory:
+    """Chat history capped by message count and content bytes, mirrored to the store's disk tier.
+
+    Implements the BaseChatMessageHistory interface used by RunnableWithMessageHistory
+    without importing LangChain; the async methods don't need an executor hop
+    because everything here is in memory or a short SQLite write.
+    """
+
+    def __init__(self, session_id, store, messages=None, next_seq=0, state=None):
+        self.session_id = session_id
+        self._store = store
+        # Structured conversation state (e.g. the coverage flow) kept beside the messages
+        self.state = state
+        self._messages = list(messages or [])
+        self._seqs = list(range(next_seq - len(self._messages), next_seq))
+        self._next_seq = next_seq
+        self._bytes = sum(_message_size(m) for m in self._messages)
+        self._lock = threading.Lock()
+
+    @property
+    def messages(self):
+        return list(self._messages)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def add_message(self, message):
+        self.add_messages([message])
+
+    async def aget_messages(self):
+        return self.messages
+
+    async def aadd_messages(self, messages):
+        self.add_messages(messages)
+
+    async def aclear(self):
+        self.clear()
+
+    def add_messages(self, messages):
+        with self._lock:
+            added = []
+            for message in messages:
+                self._messages.append(message)
+                self._seqs.append(self._next_seq)
+                self._bytes += _message_size(message)
+                added.append((self._next_seq, message))
+                self._next_seq += 1
+            trimmed = self._trim()
+            pinned_seq = self._seqs[0] if self._messages and _is_system(self._messages[0]) else -1
+            kept = [seq for seq in self._seqs if seq != pinned_seq]
+            keep_from = kept[0] if kept else self._next_seq
+        self._store._persist(self.session_id, added, keep_from, pinned_seq, trimmed)
+
+    def clear(self):
+        with self._lock:
+            self._messages = []
+            self._seqs = []
+            self._bytes = 0
+            self.state = None
+        self._store._delete_persisted(self.session_id)
+
+    def _trim(self):
+        trimmed = 0
+        while len(self._messages) > 1 and (
+            len(self._messages) > self._store.max_messages or self._bytes > self._store.max_bytes
+        ):
+            # Keep a leading system message pinned
+            index = 1 if _is_system(self._messages[0]) else 0
+            if index >= len(self._messages) - 1:
+                break
+            self._bytes -= _message_size(self._messages.pop(index))
+            self._seqs.pop(index)
+            trimmed += 1
+        return trimmed
+
+class SqliteSessionBackend:
+    """Append-only message log per session in a single SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_messages ("
+                " session_id TEXT NOT NULL, seq INTEGER NOT NULL, message TEXT NOT NULL,"
+                " created_at REAL NOT NULL, PRIMARY KEY (session_id, seq))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_state ("
+                " session_id TEXT PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def load(self, session_id):
+        from langchain_core.messages import messages_from_dict
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, message FROM session_messages WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+        if not rows:
+            return None
+        return messages_from_dict([json.loads(message) for _, message in rows]), rows[-1][0] + 1
+
+    def load_state(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM session_state WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_state(self, session_id, state):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO session_state (session_id, state, updated_at) VALUES (?, ?, ?)",
+                (session_id, json.dumps(state), time.time()),
+            )
+
+    def append(self, session_id, entries, keep_from, pinned_seq=-1):
+        from langchain_core.messages import message_to_dict
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO session_messages (session_id, seq, message, created_at) VALUES (?, ?, ?, ?)",
+                [(session_id, seq, json.dumps(message_to_dict(message)), now) for seq, message in entries],
+            )
+            self._conn.execute(
+                "DELETE FROM session_messages WHERE session_id = ? AND seq < ? AND seq != ?",
+                (session_id, keep_from, pinned_seq),
+            )
+            self._conn.execute("COMMIT")
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM session_state WHERE session_id = ?", (session_id,))
+
+    def prune(self, max_age_seconds):
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM session_messages WHERE session_id IN"
+                " (SELECT session_id FROM session_messages GROUP BY session_id HAVING MAX(created_at) < ?)",
+                (cutoff,),
+            )
+            self._conn.execute("DELETE FROM session_state WHERE updated_at < ?", (cutoff,))
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class SessionHistoryStore:
+    """LRU/TTL cache of per-session chat histories with an optional disk tier."""
+
+    def __init__(self, max_sessions=SESSION_CACHE_SIZE, ttl_seconds=SESSION_TTL_SECONDS,
+                 max_messages=SESSION_MAX_MESSAGES, max_bytes=SESSION_MAX_BYTES, backend=None):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0, "misses": 0, "disk_loads": 0,
+            "evictions_lru": 0, "evictions_ttl": 0, "trimmed_messages": 0,
+        }
+
+    def get(self, session_id):
+        """Return the history for a session, loading it from disk or creating it on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                history, last_used = entry
+                if now - last_used <= self.ttl_seconds:
+                    self._sessions[session_id] = (history, now)
+                    self._sessions.move_to_end(session_id)
+                    self.stats["hits"] += 1
+                    return history
+                del self._sessions[session_id]
+                self.stats["evictions_ttl"] += 1
+            self.stats["misses"] += 1
+
+        history = self._load(session_id)
+
+        with self._lock:
+            # Another thread may have loaded it meanwhile; keep the first one
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                history = entry[0]
+            self._sessions[session_id] = (history, now)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.stats["evictions_lru"] += 1
+        return history
+
+    def get_state(self, session_id):
+        """Return the structured state stored for a session, or None.
+
+        A read on the side of the turn's own get(), so it leaves the hit/miss stats and LRU order alone.
+        """
+        history = self._peek(session_id)
+        if history is not None:
+            return history.state
+        if self.backend is not None:
+            return self.backend.load_state(session_id)
+        return None
+
+    def save_state(self, session_id, state):
+        """Replace a session's structured state in memory and on disk."""
+        history = self._peek(session_id)
+        if history is None:
+            history = self.get(session_id)
+        history.state = state
+        if self.backend is not None:
+            try:
+                self.backend.save_state(session_id, state)
+            except sqlite3.Error:
+                logger.exception(f"Failed to persist state for session: {session_id}")
+
+    def discard(self, session_id):
+        """Drop a session from every tier."""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        self._delete_persisted(session_id)
+
+    def metrics(self):
+        with self._lock:
+            metrics = dict(self.stats)
+            metrics["sessions"] = len(self._sessions)
+            metrics["bytes"] = sum(history.size_bytes for history, _ in self._sessions.values())
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        return metrics
+
+    def _peek(self, session_id):
+        """The live cached history for a session, without counting a lookup or refreshing it."""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+        if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+            return None
+        return entry[0]
+
+    def _load(self, session_id):
+        if self.backend is not None:
+            loaded = self.backend.load(session_id)
+            state = self.backend.load_state(session_id)
+            if loaded is not None or state is not None:
+                messages, next_seq = loaded or ([], 0)
+                with self._lock:
+                    self.stats["disk_loads"] += 1
+                history = BoundedChatMessageHistory(session_id, self, messages, next_seq, state)
+                history._trim()
+                return history
+        return BoundedChatMessageHistory(session_id, self)
+
+    def _persist(self, session_id, entries, keep_from, pinned_seq, trimmed):
+        if trimmed:
+            with self._lock:
+                self.stats["trimmed_messages"] += trimmed
+        if self.backend is not None and entries:
+            try:
+                self.backend.append(session_id, entries, keep_from, pinned_seq)
+            except sqlite3.Error:
+                logger.exception(f"Failed to persist history for session: {session_id}")
+
+    def _delete_persisted(self, session_id):
+        if self.backend is not None:
+            self.backend.delete(session_id)
+
+class ShardedSessionStore:
+    """Session registry striped over SessionHistoryStore shards by session ID.
+
+    Each shard has its own lock and LRU, so threaded and async workers serving
+    different calls don't serialize on one lock; the disk tier is shared.
+    """
+
+    def __init__(self, shards=SESSION_SHARDS, max_sessions=SESSION_CACHE_SIZE, backend=None, **kwargs):
+        per_shard = max(1, -(-max_sessions // shards))
+        self.backend = backend
+        self.shards = [
+            SessionHistoryStore(max_sessions=per_shard, backend=backend, **kwargs) for _ in range(shards)
+        ]
+
+    def shard(self, session_id):
+        # crc32 rather than hash() so the layout doesn't change between worker processes
+        return self.shards[zlib.crc32(session_id.encode("utf-8")) % len(self.shards)]
+
+    def get(self, session_id):
+        return self.shard(session_id).get(session_id)
+
+    def get_state(self, session_id):
+        return self.shard(session_id).get_state(session_id)
+
+    def save_state(self, session_id, state):
+        self.shard(session_id).save_state(session_id, state)
+
+    def discard(self, session_id):
+        self.shard(session_id).discard(session_id)
+
+    def metrics(self):
+        metrics = {}
+        for shard in self.shards:
+            for name, value in shard.metrics().items():
+                if name != "hit_rate":
+                    metrics[name] = metrics.get(name, 0) + value
+        lookups = metrics["hits"] + metrics["misses"]
+        metrics["hit_rate"] = metrics["hits"] / lookups if lookups else 0.0
+        metrics["shards"] = len(self.shards)
+        return metrics
+
+def create_default_store():
+    backend = None
+    if SESSION_DB_PATH:
+        backend = SqliteSessionBackend(SESSION_DB_PATH)
+        pruned = backend.prune(SESSION_DB_RETENTION_SECONDS)
+        logger.info(f"Session history on disk at {SESSION_DB_PATH} (pruned {pruned} expired messages)")
+    return ShardedSessionStore(backend=backend)
+
+# Process-wide store shared by the bot modules
+session_store = create_default_store()
+register_source("bot_sessions", session_store.metrics, counters=session_store.shards[0].stats)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import os
+import re
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Don't cut before this many characters, so "Yes." doesn't become the whole first message
+MIN_FIRST_SENTENCE_CHARS = int(os.environ.get("MIN_FIRST_SENTENCE_CHARS", "12"))
+# Remainders nobody asked for are dropped after this long
+FOLLOWUP_TTL_SECONDS = float(os.environ.get("FOLLOWUP_TTL_SECONDS", "120"))
+
+SENTENCE_END = re.compile(r"[.!?]+(?=\s)")
+ABBREVIATIONS = {"dr", "mr", "mrs", "ms", "no", "st", "apt", "jr", "sr", "vs", "e.g", "i.e", "etc"}
+
+def find_sentence_end(text):
+    """Index just past the first complete sentence in text, or None if there isn't one yet."""
+    for match in SENTENCE_END.finditer(text):
+        if match.end() < MIN_FIRST_SENTENCE_CHARS:
+            continue
+        words = text[:match.start()].split()
+        if words and words[-1].lower().strip("(\"'") in ABBREVIATIONS:
+            continue
+        return match.end()
+    return None
+
+async def _drain(iterator, buffer):
+    parts = [buffer]
+    async for chunk in iterator:
+        parts.append(chunk)
+    return "".join(parts).strip()
+
+async def split_first_sentence(chunks):
+    """Read an async stream of text chunks up to the first complete sentence.
+
+    Returns (first_sentence, rest) where rest is a task that keeps consuming
+    the stream and resolves to the remaining text, or None when the whole
+    response fit in the first message.
+    """
+    iterator = chunks.__aiter__()
+    buffer = ""
+    try:
+        while True:
+            try:
+                chunk = await iterator.__anext__()
+            except StopAsyncIteration:
+                return buffer.strip(), None
+            buffer += chunk
+            end = find_sentence_end(buffer)
+            if end is not None:
+                first_sentence, buffer = buffer[:end].strip(), buffer[end:]
+                return first_sentence, asyncio.ensure_future(_drain(iterator, buffer))
+    except BaseException:
+        # Deadline hit or stream failed: release the underlying LLM stream
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
+        raise
+
+class FollowupRegistry:
+    """Per-session slot for the rest of a streamed response, collected by a follow-up turn."""
+
+    def __init__(self, ttl_seconds=FOLLOWUP_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._slots = {}
+
+    def put(self, session_id, task):
+        self._prune()
+        previous = self._slots.pop(session_id, None)
+        if previous is not None:
+            previous[0].cancel()
+        self._slots[session_id] = (task, time.monotonic())
+
+    def pending(self, session_id):
+        return session_id in self._slots
+
+    async def pop(self, session_id):
+        """Wait for the session's remainder; it stays queued if the caller gives up waiting."""
+        slot = self._slots.get(session_id)
+        if slot is None:
+            return None
+        try:
+            text = await asyncio.shield(slot[0])
+        except Exception:
+            logger.exception(f"Streaming remainder failed for session: {session_id}")
+            text = None
+        if self._slots.get(session_id) is slot:
+            del self._slots[session_id]
+        return text
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.ttl_seconds
+        for session_id, (task, created) in list(self._slots.items()):
+            if created < cutoff:
+                task.cancel()
+                del self._slots[session_id]
@@ -0,0 +1,94 @@
+import math
+import numpy as np
+
+# Rate card from the system prompt, as data. Fees are in rupees.
+FIRST_BLOCK_HOURS = 2
+MAX_STAY_HOURS = 24
+LOST_TICKET_FEE = 500
+
+# 'overnight' is a time-of-day rule; stays are quoted by length, so it is stated in the quote rather than enforced
+TARIFFS = {
+    'two-wheeler': {'first_block_fee': 20, 'hourly_fee': 10, 'daily_cap': 100, 'overnight': False},
+    'four-wheeler': {'first_block_fee': 40, 'hourly_fee': 20, 'daily_cap': 200, 'overnight': True},
+    'heavy vehicle': {'first_block_fee': 80, 'hourly_fee': 40, 'daily_cap': 400, 'overnight': True},
+}
+
+# Column view of the table for the vectorized path; index i is VEHICLE_TYPES[i]
+VEHICLE_TYPES = list(TARIFFS)
+_FIRST_BLOCK_FEES = np.array([TARIFFS[v]['first_block_fee'] for v in VEHICLE_TYPES], dtype=np.float64)
+_HOURLY_FEES = np.array([TARIFFS[v]['hourly_fee'] for v in VEHICLE_TYPES], dtype=np.float64)
+_DAILY_CAPS = np.array([TARIFFS[v]['daily_cap'] for v in VEHICLE_TYPES], dtype=np.float64)
+
+def compute_fee(vehicle_type, hours, lost_ticket=False):
+    """Fee for one stay. Partial hours are billed as full hours, capped at the daily rate."""
+    tariff = TARIFFS.get(vehicle_type)
+    if tariff is None:
+        raise ValueError(f"Unknown vehicle type: {vehicle_type}")
+    if hours is None or hours <= 0:
+        raise ValueError(f"Parking duration must be positive, got: {hours}")
+    if hours > MAX_STAY_HOURS:
+        raise ValueError(f"Maximum stay is {MAX_STAY_HOURS} hours, got: {hours}")
+
+    billable_hours = math.ceil(hours)
+    fee = tariff['first_block_fee'] + tariff['hourly_fee'] * max(billable_hours - FIRST_BLOCK_HOURS, 0)
+    fee = min(fee, tariff['daily_cap'])
+    if lost_ticket:
+        fee += LOST_TICKET_FEE
+    return fee
+
+def vehicle_type_codes(vehicle_types):
+    """Map vehicle type strings to tariff indexes; unknown types become -1."""
+    vehicle_types = np.asarray(vehicle_types, dtype=object)
+    codes = np.full(vehicle_types.shape, -1, dtype=np.int64)
+    for code, vehicle_type in enumerate(VEHICLE_TYPES):
+        codes[vehicle_types == vehicle_type] = code
+    return codes
+
+def codes_from_dictionary(dictionary, indices):
+    """Tariff codes for dictionary-encoded vehicle types (e.g. an Arrow DictionaryArray).
+
+    Only the handful of distinct strings are compared; rows map through an
+    integer gather. Null indices (negative) become -1.
+    """
+    mapping = np.append(vehicle_type_codes(dictionary), -1)
+    indices = np.asarray(indices, dtype=np.int64)
+    return mapping[np.where(indices >= 0, indices, len(mapping) - 1)]
+
+def compute_fees(vehicle_types, hours, lost_ticket=None):
+    """Vectorized compute_fee over arrays of rows.
+
+    vehicle_types is either an array of type strings or of tariff codes from
+    vehicle_type_codes/codes_from_dictionary. Returns a float array of fees;
+    rows with an unknown vehicle type or a duration outside
+    (0, MAX_STAY_HOURS] are NaN instead of raising.
+    """
+    vehicle_types = np.asarray(vehicle_types)
+    if np.issubdtype(vehicle_types.dtype, np.integer):
+        codes = vehicle_types
+    else:
+        codes = vehicle_type_codes(vehicle_types)
+    hours = np.asarray(hours, dtype=np.float64)
+    valid = (codes >= 0) & (hours > 0) & (hours <= MAX_STAY_HOURS)
+    safe_codes = np.where(valid, codes, 0)
+
+    billable_hours = np.ceil(np.where(valid, hours, 0))
+    fees = _FIRST_BLOCK_FEES[safe_codes] + _HOURLY_FEES[safe_codes] * np.maximum(billable_hours - FIRST_BLOCK_HOURS, 0)
+    fees = np.minimum(fees, _DAILY_CAPS[safe_codes])
+    if lost_ticket is not None:
+        fees = fees + np.where(np.asarray(lost_ticket, dtype=bool), LOST_TICKET_FEE, 0)
+    fees[~valid] = np.nan
+    return fees
+
+def format_quote(vehicle_type, hours, lost_ticket=False):
+    """One-sentence quote for the caller, or the reason no quote is possible."""
+    try:
+        fee = compute_fee(vehicle_type, hours, lost_ticket)
+    except ValueError as e:
+        if hours is not None and hours > MAX_STAY_HOURS:
+            return f"Sorry, the maximum parking stay is {MAX_STAY_HOURS} hours."
+        return str(e)
+    hour_label = "hour" if hours == 1 else "hours"
+    quote = f"Parking a {vehicle_type} for {hours} {hour_label} costs ₹{fee}."
+    if not TARIFFS[vehicle_type]['overnight']:
+        quote += f" Please note there is no overnight parking for a {vehicle_type}."
+    return quote
@@ -0,0 +1,189 @@
+import time
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from google.api_core.exceptions import BadRequest, ServiceUnavailable
+
+import helpers
+from bq_reader import SessionReader
+from bq_writer import SessionEventWriter
+from fakes import FakeBigQueryClient
+
+TABLE = "parkin_pro.parking_sessions"
+
+class FlakyBigQueryClient(FakeBigQueryClient):
+    """Fails the first `failures` MERGE statements."""
+
+    def __init__(self, failures=1, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+
+    def query(self, query, job_config=None):
+        if query.lstrip().upper().startswith("MERGE") and self.failures:
+            self.failures -= 1
+            raise RuntimeError("MERGE failed")
+        return super().query(query, job_config=job_config)
+
+class PoisonRowBigQueryClient(FakeBigQueryClient):
+    """Rejects any MERGE carrying a row whose vehicle_number is BAD, as BigQuery does for a bad value."""
+
+    def query(self, query, job_config=None):
+        if query.lstrip().upper().startswith("MERGE"):
+            rows = [struct.struct_values for struct in job_config.query_parameters[0].values]
+            if any(row["vehicle_number"] == "BAD" for row in rows):
+                with self._lock:
+                    self.queries.append(query)
+                raise BadRequest("Invalid value for vehicle_number")
+        return super().query(query, job_config=job_config)
+
+def merges(client):
+    return [query for query in client.queries if query.lstrip().upper().startswith("MERGE")]
+
+def entry_attempts(writer):
+    return [entry["attempts"] for entry in writer.dead_letters]
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+class SessionEventWriterTest(unittest.TestCase):
+    def make_writer(self, client, **kwargs):
+        writer = SessionEventWriter(lambda: client, TABLE, **kwargs)
+        self.addCleanup(writer.close, 5.0)
+        return writer
+
+    def test_flushes_when_batch_is_full(self):
+        client = FakeBigQueryClient()
+        writer = self.make_writer(client, max_batch_size=3, flush_interval=60.0)
+        for i in range(3):
+            writer.submit(f"s{i}", active=True)
+        self.assertTrue(wait_for(lambda: len(client.rows) == 3))
+        self.assertEqual(len(merges(client)), 1)
+        self.assertEqual(writer.stats["rows_written"], 3)
+
+    def test_flushes_after_interval(self):
+        client = FakeBigQueryClient()
+        writer = self.make_writer(client, max_batch_size=100, flush_interval=0.1)
+        started = time.monotonic()
+        writer.submit("s1", active=True)
+        self.assertTrue(wait_for(lambda: "s1" in client.rows))
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        self.assertEqual(writer.stats["flushes"], 1)
+
+    def test_coalesces_events_per_session(self):
+        client = FakeBigQueryClient()
+        writer = self.make_writer(client, max_batch_size=100, flush_interval=60.0)
+        writer.submit("s1", active=True, vehicle_type="car")
+        writer.submit("s1", parking_hours=3)
+        writer.submit("s1", active=False)
+        self.assertTrue(writer.flush(5.0))
+        self.assertEqual(len(merges(client)), 1)
+        self.assertEqual(writer.stats["events"], 3)
+        self.assertEqual(writer.stats["rows_written"], 1)
+        row = client.rows["s1"]
+        self.assertEqual((row["active"], row["vehicle_type"], row["parking_hours"]), (False, "car", 3))
+
+    def test_pending_row_merges_in_flight_and_pending_changes(self):
+        client = FakeBigQueryClient(latency=0.3)
+        writer = self.make_writer(client, max_batch_size=1, flush_interval=60.0)
+        writer.submit("s1", vehicle_type="car", parking_hours=2)
+        self.assertTrue(wait_for(lambda: writer._in_flight))
+        writer.submit("s1", parking_hours=4)
+        self.assertEqual(writer.pending_row("s1"), {"session_id": "s1", "vehicle_type": "car", "parking_hours": 4})
+        self.assertTrue(writer.flush(5.0))
+        self.assertIsNone(writer.pending_row("s1"))
+        self.assertEqual(client.rows["s1"]["parking_hours"], 4)
+
+    def test_get_parking_entries_reads_unwritten_changes(self):
+        client = FakeBigQueryClient()
+        writer = self.make_writer(client, max_batch_size=100, flush_interval=60.0)
+        reader = SessionReader(lambda: client, TABLE, writer=writer)
+        started = datetime(2024, 9, 4, 13, 52, tzinfo=timezone.utc)
+        with mock.patch.object(helpers, "session_writer", writer), mock.patch.object(helpers, "session_reader", reader):
+            writer.submit("s1", start_time=started, active=True, vehicle_type="four-wheeler", parking_hours=2)
+            entries = helpers.get_parking_entries("s1")
+            self.assertEqual(len(entries), 1)
+            self.assertEqual(entries[0]["vehicle_type"], "four-wheeler")
+            self.assertEqual(entries[0]["start_time"], started.isoformat())
+            self.assertEqual(merges(client), [])
+
+            # Once written, the same entry comes back from the table
+            self.assertTrue(writer.flush(5.0))
+            self.assertEqual(helpers.get_parking_entries("s1")[0]["parking_hours"], 2)
+
+    def test_retries_after_failed_merge(self):
+        client = FlakyBigQueryClient(failures=1)
+        writer = self.make_writer(client, max_batch_size=100, flush_interval=0.05)
+        writer.submit("s1", active=True, parking_hours=2)
+        self.assertTrue(wait_for(lambda: writer.stats["errors"] == 1))
+        # Changes submitted before the retry win over the failed batch
+        writer.submit("s1", parking_hours=5)
+        self.assertTrue(writer.flush(5.0))
+        self.assertEqual(writer.stats["errors"], 1)
+        self.assertEqual(client.rows["s1"]["active"], True)
+        self.assertEqual(client.rows["s1"]["parking_hours"], 5)
+
+    def test_rejected_row_is_isolated_and_dead_lettered(self):
+        client = PoisonRowBigQueryClient()
+        writer = self.make_writer(client, max_batch_size=100, flush_interval=0.01, max_attempts=2)
+        for i in range(8):
+            writer.submit(f"s{i}", active=True, vehicle_number="BAD" if i == 5 else f"KA01AB{i:04d}")
+        self.assertTrue(writer.flush(5.0))
+        # The good rows land on the first flush even though they shared a batch with the bad one
+        self.assertEqual(set(client.rows), {f"s{i}" for i in range(8)} - {"s5"})
+        self.assertEqual(writer.stats["rows_written"], 7)
+        self.assertEqual(writer.stats["dead_lettered"], 1)
+        self.assertEqual([entry["row"]["session_id"] for entry in writer.dead_letters], ["s5"])
+        self.assertEqual(entry_attempts(writer), [2])
+        self.assertIsNone(writer.pending_row("s5"))
+
+        # Later writes for the same session start over
+        writer.submit("s5", vehicle_number="KA01AB0005")
+        self.assertTrue(writer.flush(5.0))
+        self.assertEqual(client.rows["s5"]["vehicle_number"], "KA01AB0005")
+
+    def test_transient_failures_are_retried_up_to_max_attempts(self):
+        client = FakeBigQueryClient()
+        client.query = mock.Mock(side_effect=ServiceUnavailable("backend error"))
+        writer = self.make_writer(client, max_batch_size=100, flush_interval=0.01, max_attempts=3, max_backoff=0.05)
+        writer.submit("s1", active=True)
+        writer.submit("s2", active=True)
+        self.assertTrue(writer.flush(5.0))
+        # Not a rejection, so the batch is retried whole rather than split
+        self.assertEqual(client.query.call_count, 3)
+        self.assertEqual(writer.stats["errors"], 3)
+        self.assertEqual(writer.stats["retried"], 4)
+        self.assertEqual(writer.stats["dead_lettered"], 2)
+        self.assertEqual(writer.queue_depth(), 0)
+
+    def test_submit_gives_up_when_queue_stays_full(self):
+        client = FakeBigQueryClient()
+        client.query = mock.Mock(side_effect=ServiceUnavailable("backend error"))
+        writer = self.make_writer(client, max_batch_size=100, flush_interval=60.0, max_pending=1, submit_timeout=0.1)
+        self.assertTrue(writer.submit("s1", active=True))
+        started = time.monotonic()
+        self.assertFalse(writer.submit("s2", active=True))
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        self.assertEqual(writer.stats["dropped"], 1)
+        self.assertIsNone(writer.pending_row("s2"))
+        # The session already queued can still take changes
+        self.assertTrue(writer.submit("s1", active=False))
+
+    def test_close_flushes_pending_events(self):
+        client = FakeBigQueryClient()
+        writer = SessionEventWriter(lambda: client, TABLE, max_batch_size=100, flush_interval=60.0)
+        writer.submit("s1", active=True)
+        writer.submit("s2", active=True)
+        writer.close(5.0)
+        self.assertEqual(set(client.rows), {"s1", "s2"})
+        self.assertEqual(writer.queue_depth(), 0)
+        with self.assertRaises(RuntimeError):
+            writer.submit("s3", active=True)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+import unittest
+
+import coverage_flow
+
+QUESTIONS = [
+    "Has the patient met the deductible? please respond with yes/no",
+    "What is the copay for this code?",
+    "What is the member's coinsurance amount?",
+    "Is medical necessity review for any of the codes? please respond with yes/no",
+]
+DEDUCTIBLE, COPAY, COINSURANCE, NECESSITY = QUESTIONS
+PAYLOAD = {"cptCode": "99213"}
+
+class ParseAnswerTest(unittest.TestCase):
+    def assertAnswers(self, question, cases):
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(coverage_flow.parse_answer(question, text), expected)
+
+    def test_yes_no_affirmations(self):
+        self.assertAnswers(DEDUCTIBLE, [
+            ("Yes", "Yes"),
+            ("Yeah, it has.", "Yes"),
+            ("It has been met.", "Yes"),
+            ("It's met for this year", "Yes"),
+            ("They have met it", "Yes"),
+            ("Correct", "Yes"),
+        ])
+
+    def test_yes_no_negations(self):
+        self.assertAnswers(DEDUCTIBLE, [
+            ("No", "No"),
+            ("Nope", "No"),
+            ("It has not been met yet.", "No"),
+            ("It hasn't been met", "No"),
+            ("It's not met", "No"),
+            ("They haven't met it", "No"),
+            ("Not yet", "No"),
+        ])
+        self.assertAnswers(NECESSITY, [
+            ("it is not required", "No"),
+            ("It isn't", "No"),
+            ("It is required", "Yes"),
+        ])
+
+    def test_yes_no_hedges_are_unanswered(self):
+        self.assertAnswers(DEDUCTIBLE, [
+            ("Not sure", None),
+            ("I don't know", None),
+            ("No idea, sorry", None),
+            ("I can't confirm that", None),
+            ("Hmm", None),
+            ("Sure, one moment please.", None),
+        ])
+
+    def test_amounts(self):
+        self.assertAnswers(COPAY, [
+            ("The copay is $20.", "$20"),
+            ("40 dollars", "40 dollars"),
+            ("For 99213 the copay is $25", "$25"),
+            ("30", "30"),
+            ("There is no copay", "0"),
+            ("Let me check", None),
+        ])
+        self.assertAnswers(COINSURANCE, [
+            ("It's 20 percent", "20 percent"),
+            ("10%", "10%"),
+            ("Yes", None),
+        ])
+
+    def test_reference_number(self):
+        self.assertEqual(coverage_flow.parse_reference_number("Your reference number is REF12345"), "REF12345")
+        self.assertIsNone(coverage_flow.parse_reference_number("No"))
+        self.assertIsNone(coverage_flow.parse_reference_number("Sure, give me a second"))
+
+class NextTurnTest(unittest.TestCase):
+    def play(self, state, turns):
+        return [coverage_flow.next_turn(state, text, PAYLOAD, QUESTIONS) for text in turns]
+
+    def authenticated(self):
+        state = coverage_flow.new_state()
+        self.assertIsNone(coverage_flow.next_turn(state, "Thank you for calling, how may I help you?", PAYLOAD, QUESTIONS))
+        self.assertEqual(state["stage"], coverage_flow.AUTHENTICATION)
+        response = coverage_flow.next_turn(state, "You are verified, go ahead with your questions.", PAYLOAD, QUESTIONS)
+        self.assertEqual(response, "I'd like to check coverage for CPT code 99213. Has the patient met the deductible?")
+        return state
+
+    def test_full_call(self):
+        state = self.authenticated()
+        replies = self.play(state, [
+            "Sure, one moment please.",
+            "It has not been met yet.",
+            "The copay is $20.",
+            "Let me pull that up.",
+            "It's 20 percent",
+            "Not sure",
+            "It is not required",
+            "Your reference number is REF12345",
+            "No, thank you",
+            "Can I get a summary?",
+        ])
+        self.assertEqual(replies[0], coverage_flow.HOLD_MESSAGE)
+        self.assertEqual(replies[3], coverage_flow.HOLD_MESSAGE)
+        self.assertIsNone(replies[5])
+        self.assertEqual(replies[8], coverage_flow.CLOSING_MESSAGE)
+        self.assertEqual(replies[9].splitlines(), [
+            "Has the patient met the deductible?: No",
+            "What is the copay for this code?: $20",
+            "What is the member's coinsurance amount?: 20 percent",
+            "Is medical necessity review for any of the codes?: No",
+            "Reference number: REF12345",
+            "Feedback: No, thank you",
+        ])
+
+    def test_reply_that_does_not_fit_leaves_question_open(self):
+        state = self.authenticated()
+        self.assertIsNone(coverage_flow.next_turn(state, "Hmm.", PAYLOAD, QUESTIONS))
+        self.assertEqual((state["stage"], state["question_index"], state["answers"]), (coverage_flow.COVERAGE, 0, {}))
+
+    def test_question_mid_flow_defers_to_model(self):
+        state = self.authenticated()
+        self.assertIsNone(coverage_flow.next_turn(state, "What is the member's date of birth?", PAYLOAD, QUESTIONS))
+        self.assertEqual(state["question_index"], 0)
+
+    def test_repeat_and_early_summary_keep_position(self):
+        state = self.authenticated()
+        coverage_flow.next_turn(state, "Yes", PAYLOAD, QUESTIONS)
+        self.assertEqual(coverage_flow.next_turn(state, "Can you repeat that?", PAYLOAD, QUESTIONS),
+                         "What is the copay for this code?")
+        response = coverage_flow.next_turn(state, "Send me a summary", PAYLOAD, QUESTIONS)
+        self.assertTrue(response.startswith("I'll share the summary at the end of the call."))
+        self.assertEqual(state["question_index"], 1)
+
+    def test_reference_stage_needs_a_reference_number(self):
+        state = self.authenticated()
+        self.play(state, ["Yes", "$10", "20%", "No"])
+        self.assertEqual(state["stage"], coverage_flow.REFERENCE_NUMBER)
+        self.assertIsNone(coverage_flow.next_turn(state, "No", PAYLOAD, QUESTIONS))
+        self.assertEqual(state["stage"], coverage_flow.REFERENCE_NUMBER)
+        self.assertEqual(coverage_flow.next_turn(state, "It's AB-1234", PAYLOAD, QUESTIONS), coverage_flow.FEEDBACK_PROMPT)
+        self.assertEqual(state["reference_number"], "AB-1234")
+
+    def test_position(self):
+        self.assertEqual(coverage_flow.position(None), coverage_flow.AUTHENTICATION)
+        state = self.authenticated()
+        self.assertEqual(coverage_flow.position(state), "coverage:0")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from unittest import mock
+
+import helpers
+from extractor import extract_entities
+
+class ExtractEntitiesTest(unittest.TestCase):
+    def assertExtracts(self, message, **expected):
+        entities = extract_entities(message)
+        self.assertEqual({key: entities[key] for key in expected}, expected)
+
+    def test_plates(self):
+        self.assertExtracts("I want to park my two wheeler KA 01 AB 1234 for 3 hours",
+                            vehicle_numbers=["KA01AB1234"], vehicle_types=["two-wheeler"], hours=3.0)
+        self.assertExtracts("Book a truck MH-12-DE-4321 for a day", vehicle_numbers=["MH12DE4321"], hours=24)
+        self.assertExtracts("car 22 BH 1234 AA", vehicle_numbers=["22BH1234AA"])
+        self.assertExtracts("KA 01 ab 1234 for 2 hours", vehicle_numbers=["KA01AB1234"], hours=2.0)
+
+    def test_durations_are_not_read_as_plates(self):
+        self.assertExtracts("my bike, parking is 3 hr 30 mins", vehicle_numbers=[], hours=3.5)
+        self.assertExtracts("park car at 10 am 5 hours", vehicle_numbers=[], hours=5.0)
+        self.assertExtracts("PARK AT 10 AM 5 HOURS", vehicle_numbers=[], hours=5.0)
+        self.assertExtracts("MH 12 AB 12 hrs", vehicle_numbers=[], hours=12.0)
+        self.assertExtracts("What does parking cost for my bike, the time is 2 hrs 30 mins?",
+                            vehicle_numbers=[], vehicle_types=["two-wheeler"], hours=2.5)
+
+    def test_compound_and_conflicting_durations(self):
+        self.assertExtracts("1 hr 30 mins for car", hours=1.5)
+        self.assertExtracts("two hours and 30 minutes", hours=2.5)
+        self.assertExtracts("a day and 2 hours", hours=26.0)
+        self.assertExtracts("park 2 hours, no wait 3 hours", hours=None)
+        self.assertExtracts("park 2 hours, yes 2 hours", hours=2.0)
+
+    def test_arrival_times_are_ignored(self):
+        self.assertExtracts("I will come in a minute with my car, how much for 2 hours?", hours=2.0)
+        self.assertExtracts("I am 5 min away, park 2 hours", hours=2.0)
+
+    def test_codes_and_member_ids(self):
+        self.assertExtracts("The CPT code is 99213 and the member ID is 0014168073-01",
+                            cpt_codes=["99213"], member_ids=["0014168073-01"])
+
+class FeeQuoteTest(unittest.TestCase):
+    def test_fee_question_with_compound_duration_is_quoted_from_tariff(self):
+        with mock.patch.object(helpers, "remember_turn"), mock.patch.object(helpers, "get_conversation") as conversation:
+            response = helpers.generate_bot_response(
+                "What does parking cost for my bike, the time is 2 hrs 30 mins?", "session-1")
+        conversation.assert_not_called()
+        self.assertTrue(response.startswith("Parking a two-wheeler for 3 hours costs ₹30."))
+
+if __name__ == "__main__":
+    unittest.main()
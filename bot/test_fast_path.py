@@ -0,0 +1,78 @@
+import unittest
+
+from langchain_core.chat_history import InMemoryChatMessageHistory
+
+import fast_path
+
+PAYLOAD = {
+    "cptCode": "99213",
+    "memberDob": "12/17/1991",
+    "memberFirstName": " Nancy ",
+    "memberLastName": "Amaya",
+    "memberPhoneNumber": "650-834-1151",
+    "memberId": "0014168073-01",
+    "providerNpi": "1750522140",
+}
+
+class AnswerTest(unittest.TestCase):
+    def assertAnswers(self, cases):
+        for question, expected in cases:
+            with self.subTest(question=question):
+                self.assertEqual(fast_path.answer(question, PAYLOAD), expected)
+
+    def test_lookups(self):
+        self.assertAnswers([
+            ("What is the member's first name?", "The member's first name is Nancy."),
+            ("What's the patient's last name?", "The member's last name is Amaya."),
+            ("What is the member's name?", "The member's name is Nancy Amaya."),
+            ("Can I get the date of birth?", "The member's date of birth is 12/17/1991."),
+            ("Member ID please", "The member ID is 0014168073-01."),
+            ("What is the NPI?", "The NPI is 1750522140."),
+            ("What's the CPT code?", "The CPT code is 99213."),
+        ])
+
+    def test_yes_no_claims(self):
+        self.assertAnswers([
+            ("Is the member's first name Nancy?", "Yes."),
+            ("Is the member's last name Smith?", "No. The member's last name is Amaya."),
+            ("Is the date of birth December 17 1991?", "Yes."),
+            ("Is the DOB 12/17/91?", "Yes."),
+            ("Is the date of birth 17th of December 1991?", "Yes."),
+            ("Is the date of birth 1991-12-18?", "No. The member's date of birth is 12/17/1991."),
+            ("Is the member ID 0014168073-01?", "Yes."),
+            ("Is the NPI 1234567890?", "No. The NPI is 1750522140."),
+        ])
+
+    def test_unverifiable_claims_defer_to_model(self):
+        self.assertAnswers([
+            ("Is the date of birth in December?", None),
+            ("Is the member's first name correct?", None),
+        ])
+
+    def test_other_parties_defer_to_model(self):
+        self.assertAnswers([
+            ("What is the member's name on the secondary insurance?", None),
+            ("What is the spouse's date of birth?", None),
+            ("What is the dependent's member ID?", None),
+            ("Is the policy holder's first name Nancy?", None),
+            ("What was the member ID on the previous plan?", None),
+            ("What is the member ID for the other insurance?", None),
+        ])
+
+    def test_complex_and_missing_defer_to_model(self):
+        self.assertAnswers([
+            ("What is the member's first name and date of birth?", None),
+            ("Why was the claim denied?", None),
+            ("What is the group number?", None),
+            ("What is the copay?", None),
+        ])
+
+    def test_repeat_returns_last_reply(self):
+        history = InMemoryChatMessageHistory()
+        self.assertIsNone(fast_path.answer("Can you repeat that?", PAYLOAD, history))
+        history.add_user_message("What is the NPI?")
+        history.add_ai_message("The NPI is 1750522140.")
+        self.assertEqual(fast_path.answer("Sorry, say that again?", PAYLOAD, history), "The NPI is 1750522140.")
+
+if __name__ == "__main__":
+    unittest.main()
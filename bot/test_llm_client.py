@@ -0,0 +1,161 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+import uuid
+from unittest import mock
+
+from langchain_openai import ChatOpenAI
+
+import llm_client
+from fakes import MockOpenAIServer
+from llm_client import CLOSED, OPEN, TokenBucket, get_guard, get_rate_limiter, is_fallback, resilient
+
+def fallback_reason(message):
+    return (message.response_metadata or {}).get("fallback")
+
+class MockServerTestCase(unittest.TestCase):
+    def start_server(self, **kwargs):
+        server = MockOpenAIServer(**kwargs).start()
+        self.addCleanup(server.stop)
+        return server
+
+    def make_llm(self, server):
+        """A resilient model with its own guard, talking to the mock server."""
+        model_key = f"mock-{uuid.uuid4().hex[:8]}"
+        inner = ChatOpenAI(model="gpt-4o-mini", base_url=server.base_url, api_key="mock", max_retries=0, timeout=5)
+        return resilient(inner, model_key), get_guard(model_key)
+
+    def stat_deltas(self, before):
+        return {name: llm_client.stats[name] - value for name, value in before.items()}
+
+class HedgingTest(MockServerTestCase):
+    def prime(self, guard, seconds=0.1):
+        # Enough samples for a hedge delay of `seconds`
+        for _ in range(llm_client.LLM_HEDGE_MIN_SAMPLES):
+            guard.observe(seconds)
+        self.assertEqual(guard.hedge_delay(), seconds)
+
+    def test_no_hedge_without_latency_samples(self):
+        server = self.start_server(latency=0.01)
+        llm, guard = self.make_llm(server)
+        self.assertIsNone(guard.hedge_delay())
+        self.assertFalse(is_fallback(llm.invoke("Is the provider in network?")))
+        self.assertEqual(server.requests, 1)
+
+    def test_slow_call_is_hedged(self):
+        server = self.start_server(latency=0.01, scripted_latencies=[2.0])
+        llm, guard = self.make_llm(server)
+        self.prime(guard)
+        before = dict(llm_client.stats)
+        started = time.perf_counter()
+        message = llm.invoke("Is the provider in network?")
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertFalse(is_fallback(message))
+        self.assertEqual(server.requests, 2)
+        deltas = self.stat_deltas(before)
+        self.assertEqual((deltas["hedged"], deltas["hedge_wins"], deltas["succeeded"]), (1, 1, 1))
+
+    def test_async_hedge_skips_cancelled_attempt_latency(self):
+        server = self.start_server(latency=0.01, scripted_latencies=[2.0])
+        llm, guard = self.make_llm(server)
+        self.prime(guard)
+        before = dict(llm_client.stats)
+
+        async def call():
+            message = await llm.ainvoke("Is the provider in network?")
+            # Let the cancelled attempt's done-callback run
+            await asyncio.sleep(0.05)
+            return message
+
+        started = time.perf_counter()
+        message = asyncio.run(call())
+        self.assertLess(time.perf_counter() - started, 1.0)
+        self.assertFalse(is_fallback(message))
+        self.assertEqual(self.stat_deltas(before)["hedge_wins"], 1)
+        # Only the winning hedge reports a latency; the cancelled first attempt doesn't
+        samples = list(guard._latencies)
+        self.assertEqual(len(samples), llm_client.LLM_HEDGE_MIN_SAMPLES + 1)
+        self.assertLess(samples[-1], 0.1)
+
+class CircuitBreakerTest(MockServerTestCase):
+    def test_breaker_opens_after_failures_and_closes_after_probe(self):
+        server = self.start_server(latency=0.01, error_rate=1.0)
+        llm, guard = self.make_llm(server)
+        guard.breaker.failure_threshold = 2
+        guard.breaker.reset_seconds = 0.3
+
+        for _ in range(2):
+            self.assertEqual(fallback_reason(llm.invoke("Is the provider in network?")), "error")
+        self.assertEqual(guard.breaker.state, OPEN)
+
+        # While open, calls fall back without reaching the server
+        requests = server.requests
+        self.assertEqual(fallback_reason(llm.invoke("Is the provider in network?")), "circuit_open")
+        self.assertEqual(server.requests, requests)
+
+        # After reset_seconds one probe goes through; its success closes the breaker
+        server.error_rate = 0.0
+        time.sleep(0.35)
+        self.assertFalse(is_fallback(llm.invoke("Is the provider in network?")))
+        self.assertEqual(guard.breaker.state, CLOSED)
+        self.assertEqual(server.requests, requests + 1)
+
+    def test_failed_probe_reopens_breaker(self):
+        server = self.start_server(latency=0.01, error_rate=1.0)
+        llm, guard = self.make_llm(server)
+        guard.breaker.failure_threshold = 1
+        guard.breaker.reset_seconds = 0.2
+        self.assertTrue(is_fallback(llm.invoke("Is the provider in network?")))
+        self.assertEqual(guard.breaker.state, OPEN)
+        time.sleep(0.25)
+        self.assertEqual(fallback_reason(llm.invoke("Is the provider in network?")), "error")
+        self.assertEqual(guard.breaker.state, OPEN)
+        self.assertEqual(fallback_reason(llm.invoke("Is the provider in network?")), "circuit_open")
+
+class TokenBucketTest(MockServerTestCase):
+    def use_rate_limit(self, rate, burst):
+        path = os.path.join(tempfile.mkdtemp(), "bucket")
+        for name, value in (("LLM_RATE_LIMIT_PER_SECOND", rate), ("LLM_RATE_LIMIT_BURST", burst),
+                            ("LLM_RATE_LIMIT_FILE", path)):
+            patcher = mock.patch.object(llm_client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        get_rate_limiter.reset()
+        self.addCleanup(get_rate_limiter.reset)
+
+    def test_bucket_spaces_out_acquires(self):
+        bucket = TokenBucket(rate=20, capacity=2, path=os.path.join(tempfile.mkdtemp(), "bucket"))
+        started = time.perf_counter()
+        for _ in range(6):
+            self.assertTrue(bucket.acquire(timeout=1.0))
+        # Two from the burst, then one every 50ms
+        self.assertGreaterEqual(time.perf_counter() - started, 0.19)
+        self.assertFalse(bucket.try_acquire())
+
+    def test_calls_are_throttled_against_server(self):
+        server = self.start_server(latency=0.0)
+        self.use_rate_limit(rate=20, burst=1)
+        llm, _ = self.make_llm(server)
+        started = time.perf_counter()
+        for _ in range(5):
+            self.assertFalse(is_fallback(llm.invoke("Is the provider in network?")))
+        self.assertGreaterEqual(time.perf_counter() - started, 0.19)
+        self.assertEqual(server.requests, 5)
+
+    def test_call_falls_back_when_no_token_before_deadline(self):
+        server = self.start_server(latency=0.0)
+        # One token, then the next arrives long after the deadline
+        self.use_rate_limit(rate=0.01, burst=1)
+        llm, _ = self.make_llm(server)
+        before = dict(llm_client.stats)
+        self.assertFalse(is_fallback(llm.invoke("Is the provider in network?")))
+        started = time.perf_counter()
+        self.assertEqual(fallback_reason(llm.invoke("Is the provider in network?")), "rate_limited")
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(server.requests, 1)
+        self.assertEqual(self.stat_deltas(before)["rate_limited"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import os
+import tempfile
+import unittest
+
+from langchain_core.messages import HumanMessage
+
+from session_store import SessionHistoryStore, SqliteSessionBackend
+
+class SessionStateTest(unittest.TestCase):
+    def test_get_state_does_not_count_as_lookup(self):
+        store = SessionHistoryStore()
+        self.assertIsNone(store.get_state("s1"))
+        history = store.get("s1")
+        history.add_message(HumanMessage("Hello"))
+        store.save_state("s1", {"stage": "authentication"})
+        for _ in range(3):
+            self.assertEqual(store.get_state("s1"), {"stage": "authentication"})
+        metrics = store.metrics()
+        self.assertEqual((metrics["hits"], metrics["misses"], metrics["hit_rate"]), (0, 1, 0.0))
+        self.assertIs(store.get("s1"), history)
+        self.assertEqual(store.metrics()["hits"], 1)
+
+    def test_get_state_reads_disk_tier_after_restart(self):
+        path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+        backend = SqliteSessionBackend(path)
+        self.addCleanup(backend.close)
+        SessionHistoryStore(backend=backend).save_state("s1", {"stage": "coverage_flow"})
+
+        restarted = SessionHistoryStore(backend=backend)
+        self.assertEqual(restarted.get_state("s1"), {"stage": "coverage_flow"})
+        self.assertEqual(restarted.metrics()["sessions"], 0)
+        self.assertEqual(restarted.get("s1").state, {"stage": "coverage_flow"})
+
+if __name__ == "__main__":
+    unittest.main()